@@ -39,7 +39,7 @@ problem.create_clique_network()
 problem.add_smoothness_terms(2)
 problem.create_objective()
 
-H1 = problem.objective.hessian(trajectory.active_segment())
+H1 = problem.objective.hessian(trajectory.active_segment()).toarray()
 np.set_printoptions(suppress=True, linewidth=200, precision=0,
                     formatter={'float_kind': '{:2.0f}'.format})
 print(H1.shape)
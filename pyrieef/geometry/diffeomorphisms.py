@@ -519,7 +519,7 @@ def NaturalGradientGeodescis(obj, x_1, x_2, attractor=True):
     line.append([x_init.item(0), x_init.item(1)])
     for i in range(500):
         # Compute tensor.
-        J = obj.jacobian(np.array(x_tmp.T)[0])
+        J = np.matrix(obj.jacobian(np.array(x_tmp.T)[0]))
         # Implement the attractor derivative here directly
         # suposes that it's of the form |phi(q) - phi(q_goal)|^2
         # hence the addition of the J^T
@@ -23,6 +23,19 @@ from abc import abstractmethod
 
 
 class DifferentiableMap:
+    """
+    Differentiable map f : R^n -> R^m
+
+    Besides the single point methods (forward, jacobian, hessian),
+    maps can be evaluated on N points stacked in a N x n array with
+    the batch methods, that return:
+
+        forward_batch   : N x m
+        jacobian_batch  : N x m x n
+        hessian_batch   : N x n x n (only when m = 1)
+
+    The default batch implementations loop over the points.
+    """
 
     @abstractmethod
     def output_dimension(self):
@@ -49,13 +62,14 @@ class DifferentiableMap:
             for addition and substraction, of course gradients are
             only availables if the output dimension is one."""
         assert self.output_dimension() == 1
-        return np.array(self.jacobian(q)).reshape(self.input_dimension())
+        return np.asarray(self.jacobian(q)).reshape(self.input_dimension())
 
     def jacobian(self, q):
         """ Should return a matrix or single value of
                 m x n : ouput x input (dimensions)
             by default the method returns the finite difference jacobian.
-            WARNING the object returned by this function is a numpy matrix."""
+            The object returned by this function is a 2d numpy array,
+            use MatrixOutputMap to obtain numpy matrices."""
         return finite_difference_jacobian(self, q)
 
     def hessian(self, q):
@@ -65,7 +79,7 @@ class DifferentiableMap:
             that relies on the jacobian function.
             This method would be a third order tensor
             in the case of multiple output, we exclude this case for now.
-            WARNING the object returned by this function is a numpy matrix."""
+            The object returned by this function is a 2d numpy array."""
         return finite_difference_hessian(self, q)
 
     def evaluate(self, q):
@@ -77,6 +91,74 @@ class DifferentiableMap:
         J = self.jacobian(q)
         return [x, J]
 
+    def evaluate_all(self, q, order=2):
+        """ Evaluates the map and its derivatives up to order
+            (0 : value, 1 : jacobian, 2 : hessian) and returns [x, J, H],
+            the entries above order are None. The default implementation
+            calls forward, jacobian and hessian separately, overriding
+            this method allows to share the intermediate computations """
+        x = self.forward(q)
+        J = self.jacobian(q) if order >= 1 else None
+        H = self.hessian(q) if order >= 2 else None
+        return [x, J, H]
+
+    def evaluate_all_batch(self, Q, order=2):
+        """ Batch version of evaluate_all, returns [X, J, H] with the
+            dimensions of the batch methods. When the batch methods are
+            not vectorized, loops over evaluate_all for each point. """
+        if type(self).forward_batch is DifferentiableMap.forward_batch:
+            Q = np.asarray(Q)
+            m = self.output_dimension()
+            n = self.input_dimension()
+            X = np.zeros((Q.shape[0], m))
+            J = np.zeros((Q.shape[0], m, n)) if order >= 1 else None
+            H = np.zeros((Q.shape[0], n, n)) if order >= 2 else None
+            for i, q in enumerate(Q):
+                [x, J_q, H_q] = self.evaluate_all(q, order)
+                X[i] = np.asarray(x).reshape(m)
+                if order >= 1:
+                    J[i] = np.asarray(J_q).reshape(m, n)
+                if order >= 2:
+                    H[i] = np.asarray(H_q).reshape(n, n)
+            return [X, J, H]
+        X = self.forward_batch(Q)
+        J = self.jacobian_batch(Q) if order >= 1 else None
+        H = self.hessian_batch(Q) if order >= 2 else None
+        return [X, J, H]
+
+    def forward_batch(self, Q):
+        """ Evaluates the map on N points stacked in a N x n array
+            and returns a N x m array. The default implementation
+            loops over the points, overriding this method allows to
+            vectorize the evaluation. """
+        Q = np.asarray(Q)
+        m = self.output_dimension()
+        Y = np.zeros((Q.shape[0], m))
+        for i, q in enumerate(Q):
+            Y[i] = np.asarray(self.forward(q)).reshape(m)
+        return Y
+
+    def jacobian_batch(self, Q):
+        """ Evaluates the jacobian on N points stacked in a N x n array
+            and returns a N x m x n array. """
+        Q = np.asarray(Q)
+        m = self.output_dimension()
+        n = self.input_dimension()
+        J = np.zeros((Q.shape[0], m, n))
+        for i, q in enumerate(Q):
+            J[i] = np.asarray(self.jacobian(q)).reshape(m, n)
+        return J
+
+    def hessian_batch(self, Q):
+        """ Evaluates the hessian on N points stacked in a N x n array
+            and returns a N x n x n array. """
+        Q = np.asarray(Q)
+        n = self.input_dimension()
+        H = np.zeros((Q.shape[0], n, n))
+        for i, q in enumerate(Q):
+            H[i] = np.asarray(self.hessian(q)).reshape(n, n)
+        return H
+
 
 class Compose(DifferentiableMap):
 
@@ -115,7 +197,6 @@ class Compose(DifferentiableMap):
                     d/dq f(g(q)) = J_f(g(q)) J_g
             This method computes and
             returns this "pullback gradient" J_f (g(q)) J_g(q).
-            WARNING: J_f is assumed to be a jacobian np.matrix object
         """
         [y, J] = self.evaluate(q)
         return J
@@ -127,16 +208,8 @@ class Compose(DifferentiableMap):
 
             so far only works if f and g are functions, not maps.
             https://en.wikipedia.org/wiki/Chain_rule (Higher derivatives)
-            WARNING: J_f is assumed to be a jacobian np.matrix object
         """
-        x = self._g(q)
-        J_g = self._g.jacobian(q)
-        H_g = self._g.hessian(q)
-        J_f = self._f.jacobian(x)
-        H_f = self._f.hessian(x)
-        a_x = J_g.T * H_f * J_g
-        b_x = J_f * np.ones(self.input_dimension()) * H_g
-        return a_x + b_x
+        return self.evaluate_all(q, order=2)[2]
 
     def evaluate(self, q):
         """
@@ -144,9 +217,55 @@ class Compose(DifferentiableMap):
         """
         x = self._g(q)
         [y, J_f] = self._f.evaluate(x)
-        J = J_f * self._g.jacobian(q)
+        J = np.dot(J_f, self._g.jacobian(q))
         return [y, J]
 
+    def evaluate_all(self, q, order=2):
+        """
+            g(q) and its derivatives are only computed once
+            and shared between the value, jacobian and hessian.
+        """
+        [x, J_g, H_g] = self._g.evaluate_all(q, order)
+        [y, J_f, H_f] = self._f.evaluate_all(x, order)
+        J = np.dot(J_f, J_g) if order >= 1 else None
+        H = None
+        if order >= 2:
+            a_x = np.dot(J_g.T, np.dot(H_f, J_g))
+            b_x = np.asarray(J_f).item() * H_g
+            H = a_x + b_x
+        return [y, J, H]
+
+    def evaluate_all_batch(self, Q, order=2):
+        if order >= 2 and self._g.output_dimension() != 1:
+            return DifferentiableMap.evaluate_all_batch(self, Q, order)
+        [X, J_g, H_g] = self._g.evaluate_all_batch(Q, order)
+        [Y, J_f, H_f] = self._f.evaluate_all_batch(X, order)
+        J = np.matmul(J_f, J_g) if order >= 1 else None
+        H = None
+        if order >= 2:
+            a_x = np.matmul(np.transpose(J_g, (0, 2, 1)), np.matmul(H_f, J_g))
+            H = a_x + J_f * H_g
+        return [Y, J, H]
+
+    def forward_batch(self, Q):
+        return self._f.forward_batch(self._g.forward_batch(Q))
+
+    def jacobian_batch(self, Q):
+        X = self._g.forward_batch(Q)
+        return np.matmul(self._f.jacobian_batch(X), self._g.jacobian_batch(Q))
+
+    def hessian_batch(self, Q):
+        """ Only vectorized when g is a function (see hessian) """
+        if self._g.output_dimension() != 1:
+            return DifferentiableMap.hessian_batch(self, Q)
+        X = self._g.forward_batch(Q)
+        J_g = self._g.jacobian_batch(Q)
+        J_f = self._f.jacobian_batch(X)
+        a_x = np.matmul(np.transpose(J_g, (0, 2, 1)),
+                        np.matmul(self._f.hessian_batch(X), J_g))
+        b_x = J_f * self._g.hessian_batch(Q)
+        return a_x + b_x
+
 
 class Pullback(Compose):
 
@@ -169,12 +288,29 @@ class Pullback(Compose):
             this cooresponds to the full hessian when H_g = 0
             WARNING: f still has to be a function for now.
         """
-        x = self._g(q)
-        J_g = self._g.jacobian(q)
-        H_f = self._f.hessian(x)
-        # print("H_f :", H_f.shape)
-        # print("J_g :", J_g.shape)
-        return J_g.T * H_f * J_g
+        return self.evaluate_all(q, order=2)[2]
+
+    def evaluate_all(self, q, order=2):
+        [x, J_g, _] = self._g.evaluate_all(q, min(order, 1))
+        [y, J_f, H_f] = self._f.evaluate_all(x, order)
+        J = np.dot(J_f, J_g) if order >= 1 else None
+        H = np.dot(J_g.T, np.dot(H_f, J_g)) if order >= 2 else None
+        return [y, J, H]
+
+    def evaluate_all_batch(self, Q, order=2):
+        [X, J_g, _] = self._g.evaluate_all_batch(Q, min(order, 1))
+        [Y, J_f, H_f] = self._f.evaluate_all_batch(X, order)
+        J = np.matmul(J_f, J_g) if order >= 1 else None
+        H = None
+        if order >= 2:
+            H = np.matmul(np.transpose(J_g, (0, 2, 1)), np.matmul(H_f, J_g))
+        return [Y, J, H]
+
+    def hessian_batch(self, Q):
+        X = self._g.forward_batch(Q)
+        J_g = self._g.jacobian_batch(Q)
+        H_f = self._f.hessian_batch(X)
+        return np.matmul(np.transpose(J_g, (0, 2, 1)), np.matmul(H_f, J_g))
 
 
 class Scale(DifferentiableMap):
@@ -199,6 +335,23 @@ class Scale(DifferentiableMap):
     def hessian(self, q):
         return self._alpha * self._f.hessian(q)
 
+    def forward_batch(self, Q):
+        return self._alpha * self._f.forward_batch(Q)
+
+    def jacobian_batch(self, Q):
+        return self._alpha * self._f.jacobian_batch(Q)
+
+    def hessian_batch(self, Q):
+        return self._alpha * self._f.hessian_batch(Q)
+
+    def evaluate_all(self, q, order=2):
+        return [None if v is None else self._alpha * v
+                for v in self._f.evaluate_all(q, order)]
+
+    def evaluate_all_batch(self, Q, order=2):
+        return [None if v is None else self._alpha * v
+                for v in self._f.evaluate_all_batch(Q, order)]
+
 
 class SumOfTerms(DifferentiableMap):
     """ Sums n differentiable maps """
@@ -227,6 +380,25 @@ class SumOfTerms(DifferentiableMap):
     def hessian(self, q):
         return sum(f.hessian(q) for f in self._functions)
 
+    def forward_batch(self, Q):
+        return sum(f.forward_batch(Q) for f in self._functions)
+
+    def jacobian_batch(self, Q):
+        return sum(f.jacobian_batch(Q) for f in self._functions)
+
+    def hessian_batch(self, Q):
+        return sum(f.hessian_batch(Q) for f in self._functions)
+
+    def evaluate_all(self, q, order=2):
+        values = [f.evaluate_all(q, order) for f in self._functions]
+        return [None if k > order else sum(v[k] for v in values)
+                for k in range(3)]
+
+    def evaluate_all_batch(self, Q, order=2):
+        values = [f.evaluate_all_batch(Q, order) for f in self._functions]
+        return [None if k > order else sum(v[k] for v in values)
+                for k in range(3)]
+
 
 class RangeSubspaceMap(DifferentiableMap):
     """ Takes only some outputs """
@@ -246,11 +418,22 @@ class RangeSubspaceMap(DifferentiableMap):
         return q[self._indices]
 
     def jacobian(self, q):
-        return np.matrix(np.eye(self._dim))[self._indices, :]
+        return np.eye(self._dim)[self._indices, :]
 
     def hessian(self, q):
         assert self.output_dimension() == 1
-        return np.matrix(np.zeros((self._dim, self._dim)))
+        return np.zeros((self._dim, self._dim))
+
+    def forward_batch(self, Q):
+        return np.asarray(Q)[:, self._indices]
+
+    def jacobian_batch(self, Q):
+        J = np.eye(self._dim)[self._indices, :]
+        return np.repeat(J[None, :, :], np.asarray(Q).shape[0], axis=0)
+
+    def hessian_batch(self, Q):
+        assert self.output_dimension() == 1
+        return np.zeros((np.asarray(Q).shape[0], self._dim, self._dim))
 
 
 class CombinedOutputMap(DifferentiableMap):
@@ -315,32 +498,63 @@ class ProductFunction(DifferentiableMap):
         return v1 * v2
 
     def jacobian(self, x):
-        v1 = self._g.forward(x)
-        v2 = self._h.forward(x)
-        J1 = self._g.jacobian(x)
-        J2 = self._h.jacobian(x)
-        return v1 * J2 + v2 * J1
+        return self.evaluate_all(x, order=1)[1]
 
     def hessian(self, x):
         assert self.output_dimension() == 1
-        v1 = self._g.forward(x)
-        v2 = self._h.forward(x)
-
-        H1 = self._g.hessian(x)
-        H2 = self._h.hessian(x)
-
-        g1 = self._g.gradient(x)
-        g2 = self._h.gradient(x)
+        return self.evaluate_all(x, order=2)[2]
+
+    def evaluate_all(self, x, order=2):
+        [v1, J1, H1] = self._g.evaluate_all(x, order)
+        [v2, J2, H2] = self._h.evaluate_all(x, order)
+        J = v1 * J2 + v2 * J1 if order >= 1 else None
+        H = None
+        if order >= 2:
+            g1 = np.asarray(J1).reshape(self.input_dimension())
+            g2 = np.asarray(J2).reshape(self.input_dimension())
+            H = v1 * H2 + v2 * H1 + np.outer(g1, g2) + np.outer(g2, g1)
+        return [v1 * v2, J, H]
+
+    def forward_batch(self, X):
+        return self._g.forward_batch(X) * self._h.forward_batch(X)
+
+    def jacobian_batch(self, X):
+        v1 = self._g.forward_batch(X)[:, :, None]
+        v2 = self._h.forward_batch(X)[:, :, None]
+        J1 = self._g.jacobian_batch(X)
+        J2 = self._h.jacobian_batch(X)
+        return v1 * J2 + v2 * J1
 
-        return v1 * H2 + v2 * H1 + np.outer(g1, g2) + np.outer(g2, g1)
+    def hessian_batch(self, X):
+        v1 = self._g.forward_batch(X)[:, :, None]
+        v2 = self._h.forward_batch(X)[:, :, None]
+        H1 = self._g.hessian_batch(X)
+        H2 = self._h.hessian_batch(X)
+        g1 = self._g.jacobian_batch(X)
+        g2 = self._h.jacobian_batch(X)
+        g1g2 = np.matmul(np.transpose(g1, (0, 2, 1)), g2)
+        return v1 * H2 + v2 * H1 + g1g2 + np.transpose(g1g2, (0, 2, 1))
+
+    def evaluate_all_batch(self, X, order=2):
+        [v1, J1, H1] = self._g.evaluate_all_batch(X, order)
+        [v2, J2, H2] = self._h.evaluate_all_batch(X, order)
+        J = None
+        H = None
+        if order >= 1:
+            J = v1[:, :, None] * J2 + v2[:, :, None] * J1
+        if order >= 2:
+            g1g2 = np.matmul(np.transpose(J1, (0, 2, 1)), J2)
+            H = (v1[:, :, None] * H2 + v2[:, :, None] * H1 +
+                 g1g2 + np.transpose(g1g2, (0, 2, 1)))
+        return [v1 * v2, J, H]
 
 
 class AffineMap(DifferentiableMap):
     """Simple map of the form: f(x)=ax + b"""
 
     def __init__(self, a, b):
-        self._a = np.matrix(a)  # Make sure that a is matrix
-        self._b = np.matrix(b.reshape(b.size, 1))
+        self._a = np.atleast_2d(np.array(a, dtype=float))
+        self._b = np.array(b, dtype=float).reshape(b.size)
 
     def output_dimension(self):
         return self._b.shape[0]
@@ -352,17 +566,26 @@ class AffineMap(DifferentiableMap):
         return self._a
 
     def forward(self, x):
-        x_tmp = x.reshape(self.input_dimension(), 1)
-        y = self._a * x_tmp + self._b
-        return np.array(y).reshape(self.output_dimension())
+        x_tmp = np.asarray(x).reshape(self.input_dimension())
+        return np.dot(self._a, x_tmp) + self._b
 
     def jacobian(self, x):
         return self._a
 
     def hessian(self, x):
         assert self.output_dimension() == 1
-        return np.matrix(np.zeros((
-            self.input_dimension(), self.input_dimension())))
+        return np.zeros((self.input_dimension(), self.input_dimension()))
+
+    def forward_batch(self, X):
+        return np.dot(X, self._a.T) + self._b
+
+    def jacobian_batch(self, X):
+        return np.repeat(self._a[None, :, :], np.asarray(X).shape[0], axis=0)
+
+    def hessian_batch(self, X):
+        assert self.output_dimension() == 1
+        n = self.input_dimension()
+        return np.zeros((np.asarray(X).shape[0], n, n))
 
 
 class QuadricFunction(DifferentiableMap):
@@ -372,8 +595,8 @@ class QuadricFunction(DifferentiableMap):
     def __init__(self, a, b, c):
         assert a.shape[0] == a.shape[1]
         assert b.size == a.shape[1]
-        self._a = np.matrix(a)
-        self._b = np.matrix(b.reshape(b.size, 1))
+        self._a = np.array(a, dtype=float)
+        self._b = np.array(b, dtype=float).reshape(b.size)
         self._c = c
         self._symmetric = np.allclose(self._a, self._a.T, atol=1e-8)
         self._posdef = np.all(np.linalg.eigvals(self._a) > 0)
@@ -385,14 +608,14 @@ class QuadricFunction(DifferentiableMap):
         return self._b.size
 
     def forward(self, x):
-        x_tmp = np.matrix(x.reshape(self._b.size, 1))
-        v = np.asscalar(
-            .5 * x_tmp.T * self._a * x_tmp + self._b.T * x_tmp + self._c)
-        return v
+        x_tmp = np.asarray(x).reshape(self._b.size)
+        return float(.5 * np.dot(x_tmp, np.dot(self._a, x_tmp)) +
+                     np.dot(self._b, x_tmp) + self._c)
 
     def jacobian(self, x):
-        x_tmp = np.matrix(x.reshape(self._b.size, 1))
-        return (self.hessian(x) * x_tmp + self._b).T
+        x_tmp = np.asarray(x).reshape(self._b.size)
+        g = np.dot(self.hessian(x), x_tmp) + self._b
+        return g.reshape(1, self._b.size)
 
     def hessian(self, x):
         """ when the matrix is positive this can be simplified
@@ -432,11 +655,22 @@ class IdentityMap(DifferentiableMap):
         return q
 
     def jacobian(self, q):
-        return np.matrix(np.eye(self._dim))
+        return np.eye(self._dim)
 
     def hessian(self, x):
         assert self.output_dimension() == 1
-        return np.matrix(np.zeros((self._dim, self._dim)))
+        return np.zeros((self._dim, self._dim))
+
+    def forward_batch(self, Q):
+        return np.array(Q, dtype=float)
+
+    def jacobian_batch(self, Q):
+        J = np.eye(self._dim)
+        return np.repeat(J[None, :, :], np.asarray(Q).shape[0], axis=0)
+
+    def hessian_batch(self, Q):
+        assert self.output_dimension() == 1
+        return np.zeros((np.asarray(Q).shape[0], self._dim, self._dim))
 
 
 class ZeroMap(DifferentiableMap):
@@ -456,11 +690,11 @@ class ZeroMap(DifferentiableMap):
         return np.zeros(self._m)
 
     def jacobian(self, q):
-        return np.matrix(np.zeros((self._m, self._n)))
+        return np.zeros((self._m, self._n))
 
     def hessian(self, x):
         assert self.output_dimension() == 1
-        return np.matrix(np.zeros((self._n, self._n)))
+        return np.zeros((self._n, self._n))
 
 
 class SquaredNorm(DifferentiableMap):
@@ -481,11 +715,22 @@ class SquaredNorm(DifferentiableMap):
 
     def jacobian(self, x):
         delta_x = x - self.x_0
-        return np.matrix(delta_x)
+        return delta_x.reshape(1, self.x_0.size)
 
     def hessian(self, x):
         assert self.output_dimension() == 1
-        return np.matrix(np.eye(self.x_0.size, self.x_0.size))
+        return np.eye(self.x_0.size, self.x_0.size)
+
+    def forward_batch(self, X):
+        delta_x = np.asarray(X) - self.x_0
+        return 0.5 * np.sum(delta_x ** 2, axis=1).reshape(delta_x.shape[0], 1)
+
+    def jacobian_batch(self, X):
+        return (np.asarray(X) - self.x_0)[:, None, :]
+
+    def hessian_batch(self, X):
+        H = np.eye(self.x_0.size)
+        return np.repeat(H[None, :, :], np.asarray(X).shape[0], axis=0)
 
 
 class Norm(DifferentiableMap):
@@ -566,6 +811,16 @@ class SoftMax(DifferentiableMap):
         s = self.forward(q)
         return self._gamma * (np.diag(s) - np.outer(s, s))
 
+    def forward_batch(self, X):
+        z = self._gamma * np.asarray(X)
+        z = np.exp(z - np.max(z, axis=1)[:, None])
+        return z / np.sum(z, axis=1)[:, None]
+
+    def jacobian_batch(self, X):
+        s = SoftMax.forward_batch(self, X)
+        diag_s = s[:, :, None] * np.eye(self._n)
+        return self._gamma * (diag_s - s[:, :, None] * s[:, None, :])
+
 
 class LogSumExp(SoftMax):
     """ Log of softmax (smooth max)
@@ -587,7 +842,7 @@ class LogSumExp(SoftMax):
         return (1. / self._gamma) * np.log(np.sum(z))
 
     def jacobian(self, x):
-        return SoftMax.forward(self, x)
+        return SoftMax.forward(self, x).reshape(1, self._n)
 
     def hessian(self, x):
         z = np.exp(self._gamma * x)
@@ -595,6 +850,18 @@ class LogSumExp(SoftMax):
         M = p_inv * np.diag(z) - (p_inv ** 2) * np.outer(z, z)
         return self._gamma * M
 
+    def forward_batch(self, X):
+        z = self._gamma * np.asarray(X)
+        z_max = np.max(z, axis=1)
+        v = z_max + np.log(np.sum(np.exp(z - z_max[:, None]), axis=1))
+        return (v / self._gamma).reshape(z.shape[0], 1)
+
+    def jacobian_batch(self, X):
+        return SoftMax.forward_batch(self, X)[:, None, :]
+
+    def hessian_batch(self, X):
+        return SoftMax.jacobian_batch(self, X)
+
 
 class Sigmoid(DifferentiableMap):
     """
@@ -621,7 +888,7 @@ class Sigmoid(DifferentiableMap):
         return y
 
     def jacobian(self, x):
-        J = np.matrix(np.zeros((self._n, self._n)))
+        J = np.zeros((self._n, self._n))
         s = self.forward(x)
         for i in range(self._n):
             J[i, i] = s[i] * (1 - s[i])
@@ -629,11 +896,25 @@ class Sigmoid(DifferentiableMap):
 
     def hessian(self, x):
         assert self.output_dimension() == 1
-        H = np.matrix(np.zeros((self._n, self._n)))
+        H = np.zeros((self._n, self._n))
         s = self.forward(x)[0]
         H[0, 0] = s * (1 - s) * (1 - 2 * s)
         return H
 
+    def forward_batch(self, X):
+        X = np.asarray(X)
+        expx = np.exp(-np.fabs(X))
+        return np.where(X > 0, 1. / (1. + expx), expx / (1. + expx))
+
+    def jacobian_batch(self, X):
+        s = self.forward_batch(X)
+        return (s * (1 - s))[:, :, None] * np.eye(self._n)
+
+    def hessian_batch(self, X):
+        assert self.output_dimension() == 1
+        s = self.forward_batch(X)
+        return (s * (1 - s) * (1 - 2 * s))[:, :, None]
+
 
 class Tanh(DifferentiableMap):
     """
@@ -657,7 +938,7 @@ class Tanh(DifferentiableMap):
         return y
 
     def jacobian(self, x):
-        J = np.matrix(np.zeros((self._n, self._n)))
+        J = np.zeros((self._n, self._n))
         tanh = self.forward(x)
         for i in range(self._n):
             J[i, i] = 1 - tanh[i] ** 2
@@ -667,6 +948,18 @@ class Tanh(DifferentiableMap):
         """ TODO """
         assert self.output_dimension() == 1
 
+    def forward_batch(self, X):
+        return np.tanh(X)
+
+    def jacobian_batch(self, X):
+        tanh = np.tanh(X)
+        return (1 - tanh ** 2)[:, :, None] * np.eye(self._n)
+
+    def hessian_batch(self, X):
+        assert self.output_dimension() == 1
+        tanh = np.tanh(X)
+        return (-2 * tanh * (1 - tanh ** 2))[:, :, None]
+
 
 class Arccos(DifferentiableMap):
     """
@@ -686,14 +979,20 @@ class Arccos(DifferentiableMap):
         return np.arccos(x)
 
     def jacobian(self, x):
-        J = np.matrix([0.])
-        J[0, 0] = -1 / np.sqrt(1 - x ** 2)
-        return J
+        return (-1 / np.sqrt(1 - x ** 2)).reshape(1, 1)
 
     def hessian(self, x):
-        H = np.matrix([0.])
-        H[0, 0] = -x / np.power(1 - x ** 2, 1.5)
-        return H
+        return (-x / np.power(1 - x ** 2, 1.5)).reshape(1, 1)
+
+    def forward_batch(self, X):
+        return np.arccos(X)
+
+    def jacobian_batch(self, X):
+        return (-1 / np.sqrt(1 - np.asarray(X) ** 2))[:, :, None]
+
+    def hessian_batch(self, X):
+        X = np.asarray(X)
+        return (-X / np.power(1 - X ** 2, 1.5))[:, :, None]
 
 
 class RadialBasisFunction(DifferentiableMap):
@@ -734,6 +1033,55 @@ class RadialBasisFunction(DifferentiableMap):
         return 1
 
 
+class MatrixOutputMap(DifferentiableMap):
+    """
+    Compatibility wrapper for code expecting numpy matrices
+
+        The maps return jacobians and hessians as 2d numpy arrays,
+        this wrapper converts them to np.matrix objects.
+    """
+
+    def __init__(self, f):
+        self._f = f
+
+    def output_dimension(self):
+        return self._f.output_dimension()
+
+    def input_dimension(self):
+        return self._f.input_dimension()
+
+    def forward(self, q):
+        return self._f.forward(q)
+
+    def jacobian(self, q):
+        return np.matrix(self._f.jacobian(q))
+
+    def hessian(self, q):
+        return np.matrix(self._f.hessian(q))
+
+    def evaluate(self, q):
+        [x, J] = self._f.evaluate(q)
+        return [x, np.matrix(J)]
+
+
+def finite_difference_maps():
+    """
+    Returns a dictionary of the (loaded) differentiable map classes
+    that rely on the finite difference jacobian or hessian of
+    DifferentiableMap, with the names of the corresponding methods.
+    """
+    maps = {}
+    classes = DifferentiableMap.__subclasses__()
+    while classes:
+        f = classes.pop()
+        classes.extend(f.__subclasses__())
+        methods = [name for name in ["jacobian", "hessian"] if (
+            getattr(f, name) is getattr(DifferentiableMap, name))]
+        if methods:
+            maps[f] = methods
+    return maps
+
+
 def finite_difference_jacobian(f, q):
     """ Takes an object f that has a forward method returning
     a numpy array when querried. """
@@ -750,7 +1098,7 @@ def finite_difference_jacobian(f, q):
         q_down[j] -= dt_half
         x_down=f.forward(q_down)
         J[:, j]=(x_up - x_down) / dt
-    return np.matrix(J)
+    return J
 
 
 def finite_difference_hessian(f, q):
@@ -770,7 +1118,7 @@ def finite_difference_hessian(f, q):
         q_down[j] -= dt_half
         g_down=f.gradient(q_down)
         H[:, j]=(g_up - g_down) / dt
-    return np.matrix(H)
+    return H
 
 
 def check_is_close(a, b, tolerance=1e-10):
@@ -800,6 +1148,8 @@ def check_hessian_against_finite_difference(phi, verbose=True,
     """ Makes sure the hessuaian is close to the finite difference """
     q=np.random.rand(phi.input_dimension())
     H=phi.hessian(q)
+    if hasattr(H, "toarray"):  # scipy.sparse
+        H = H.toarray()
     H_diff=finite_difference_hessian(phi, q)
     if verbose:
         print("H : ")
@@ -807,3 +1157,20 @@ def check_hessian_against_finite_difference(phi, verbose=True,
         print("H_diff : ")
         print(H_diff)
     return check_is_close(H, H_diff, tolerance)
+
+
+def check_batch_against_single(phi, nb_points=10, hessian=True,
+                               tolerance=1e-8):
+    """ Makes sure the batch methods match the point by point evaluation """
+    Q = np.random.rand(nb_points, phi.input_dimension())
+    checks = [check_is_close(
+        phi.forward_batch(Q),
+        DifferentiableMap.forward_batch(phi, Q), tolerance)]
+    checks.append(check_is_close(
+        phi.jacobian_batch(Q),
+        DifferentiableMap.jacobian_batch(phi, Q), tolerance))
+    if hessian:
+        checks.append(check_is_close(
+            phi.hessian_batch(Q),
+            DifferentiableMap.hessian_batch(phi, Q), tolerance))
+    return all(checks)
@@ -76,17 +76,21 @@ class PixelMap:
         """
         matrix coordinates allow to visualy compare with world on a flat screen
         these are the coordinates used for representing 2D environments
+
+        x can be a point or an array of points (N, 2)
         """
-        grid_coord = self.world_to_grid(x)
-        return np.array([grid_coord[1], grid_coord[0]])
+        return self.world_to_grid(x)[..., ::-1]
 
     def world_to_grid(self, x):
-        """ grid coordinates of a point in world coordinates."""
-        return np.floor((x - self.origin_minus) / self.resolution).astype(int)
+        """ grid coordinates of a point, or array of points (N, 2),
+            in world coordinates."""
+        return np.floor(
+            (np.asarray(x) - self.origin_minus) / self.resolution).astype(int)
 
     def grid_to_world(self, p):
-        """ world coorindates of the center of a grid cell """
-        return self.resolution * p.astype(float) + self.origin
+        """ world coorindates of the center of a grid cell,
+            or of an array of grid cells (N, 2) """
+        return self.resolution * np.asarray(p, dtype=float) + self.origin
 
 
 class RegressedPixelGridSpline(DifferentiableMap):
@@ -118,7 +122,7 @@ class RegressedPixelGridSpline(DifferentiableMap):
 
     def jacobian(self, p):
         assert p.size == 2
-        J = np.matrix([[0., 0.]])
+        J = np.zeros((1, 2))
         J[0, 0] = self._interp_spline(p[0], p[1], dx=1)
         J[0, 1] = self._interp_spline(p[0], p[1], dy=1)
         return J
@@ -23,6 +23,8 @@ import numpy as np
 # from matplotlib.pyplot import cm
 import math
 from .pixel_map import *
+from scipy.interpolate import RectBivariateSpline
+from scipy import ndimage
 from abc import abstractmethod
 from .differentiable_geometry import *
 from .rotations import *
@@ -42,11 +44,24 @@ class Shape:
     function are represented as analytical or other type of functions.
     The implementations should return a set of points on the
     contour, to allow easy drawing.
+
+    The assignments of the attributes of the shapes are counted in
+    Shape.nb_modifications, so that the caches built from the shape
+    parameters can be invalidated (see ObstacleArrays.key), the
+    parameters have to be assigned (e.g., circle.origin = p) and not
+    modified in place.
     """
 
+    nb_modifications = 0
+
     def __init__(self):
         self.nb_points = 50
 
+    def __setattr__(self, name, value):
+        if name in self.__dict__:
+            Shape.nb_modifications += 1
+        object.__setattr__(self, name, value)
+
     @abstractmethod
     def closest_point(self, x):
         """
@@ -102,6 +117,9 @@ class Shape:
         """
         Returns the hessian of the distance function.
 
+        There is no default implementation, see
+        shapes_without_derivatives.
+
         Parameters
         ----------
             x : numpy array
@@ -112,6 +130,36 @@ class Shape:
     def sampled_points(self):
         raise NotImplementedError()
 
+    def bounding_box(self):
+        """
+        Returns [lower, upper] the corners of an axis aligned box
+        that contains the shape.
+        """
+        raise NotImplementedError()
+
+
+def shapes_without_derivatives():
+    """
+    Returns a dictionary of the shape classes for which the
+    gradient or hessian of the distance is not implemented
+    (raises NotImplementedError), with the names of the
+    corresponding methods.
+    """
+    shapes = {}
+    classes = Shape.__subclasses__()
+    while classes:
+        shape = classes.pop()
+        classes.extend(shape.__subclasses__())
+        methods = []
+        if (shape.dist_gradient is Shape.dist_gradient and
+                shape.closest_point is Shape.closest_point):
+            methods.append("dist_gradient")
+        if shape.dist_hessian is Shape.dist_hessian:
+            methods.append("dist_hessian")
+        if methods:
+            shapes[shape] = methods
+    return shapes
+
 
 def point_distance_gradient(x, origin):
     """
@@ -181,6 +229,10 @@ class Circle(Shape):
         """ Warning: not parraleized but should work from 3D """
         return point_distance_hessian(x, self.origin)
 
+    def bounding_box(self):
+        origin = np.asarray(self.origin, dtype=float)
+        return [origin - self.radius, origin + self.radius]
+
     def sampled_points(self):
         """ TODO make this generic (3D) and parallelizable... Tough."""
         points = []
@@ -205,15 +257,20 @@ class Ellipse(Shape):
         assert self._a >= self._b
 
     def is_inside(self, x):
-        return ((x[0] / self._a)**2 + (x[1] / self._b)**2) < 1.
+        x_center = (x.T - self.origin).T
+        return ((x_center[0] / self._a)**2 + (x_center[1] / self._b)**2) < 1.
 
-    def dist_from_border(self, x):
+    def _closest_parameter(self, x):
         """
             Iterative method described, Signed distance
             http://www.am.ub.edu/~robert/Documents/ellipse.pdf
+
+            returns the angle phi of the closest point in the
+            first quadrant and the signs of the coordinates of x
         """
-        x_abs = math.fabs(x[0])
-        y_abs = math.fabs(x[1])
+        x_center = x - self.origin
+        x_abs = math.fabs(x_center[0])
+        y_abs = math.fabs(x_center[1])
         a_m_b = self._a**2 - self._b**2
         phi = 0.
         for i in range(100):
@@ -225,11 +282,51 @@ class Ellipse(Shape):
             phi = phi_n
             if phi > math.pi / 2:
                 break
-        d = math.sqrt((x_abs - self._a * math.cos(phi))**2 +
-                      (y_abs - self._b * math.sin(phi))**2)
+        sign = np.where(x_center < 0., -1., 1.)
+        return phi, sign
+
+    def closest_point(self, x):
+        phi, sign = self._closest_parameter(x)
+        return self.origin + sign * np.array([
+            self._a * math.cos(phi), self._b * math.sin(phi)])
+
+    def dist_from_border(self, x):
+        d = vector_norm(x - self.closest_point(x))
         sign = -1 if self.is_inside(x) else 1.
         return sign * d
 
+    def _normal(self, phi, sign):
+        """ outward normal at the point of parameter phi """
+        n = sign * np.array([self._b * math.cos(phi), self._a * math.sin(phi)])
+        return n / vector_norm(n)
+
+    def dist_gradient(self, x):
+        """ the outward normal at the closest point, which
+            is also defined on the border of the ellipse """
+        return self._normal(*self._closest_parameter(x))
+
+    def dist_hessian(self, x):
+        """
+        The hessian of the signed distance d is
+
+                H = k / (1 + k d) t t^T
+
+        where t is the tangent and k the curvature
+        of the ellipse at the closest point.
+        """
+        phi, sign = self._closest_parameter(x)
+        n = self._normal(phi, sign)
+        t = np.array([-n[1], n[0]])
+        k = self._a * self._b / (
+            (self._a * math.sin(phi))**2 +
+            (self._b * math.cos(phi))**2)**1.5
+        d = self.dist_from_border(x)
+        return k / (1. + k * d) * np.outer(t, t)
+
+    def bounding_box(self):
+        radii = np.array([self._a, self._b])
+        return [self.origin - radii, self.origin + radii]
+
     def sampled_points(self):
         points = []
         for theta in np.linspace(0, 2 * math.pi, self.nb_points):
@@ -282,6 +379,9 @@ class Segment(Shape):
     def sampled_points(self):
         return sample_line(self._p1, self._p2, self.nb_points)
 
+    def bounding_box(self):
+        return [np.minimum(self._p1, self._p2), np.maximum(self._p1, self._p2)]
+
     def closest_point(self, x):
         """
         Compute the closest point by projecting to the infite line
@@ -330,6 +430,8 @@ class Segment(Shape):
             return point_distance_hessian(x, self._p2)
         else:
             # 3 - closer to the side
+            # The distance to a line is affine in 2D so the hessian
+            # is exactly zero, this is not an approximation.
             # Warning: only holds for 2D segments for now
             # in the 3D case we need to implement the Hessian of the distance
             # to a cylinder, which has to do with the projection of the
@@ -346,16 +448,36 @@ def segment_from_end_points(p1, p2):
         length=np.linalg.norm(p12))
 
 
+def segments_closest_points(p1, p2, points):
+    """
+    Returns the closest points on a set of segments
+
+    Parameters
+    ----------
+        p1, p2 : numpy arrays (S, 2), end points of the segments
+        points : numpy array (N, 2)
+
+    Returns
+    -------
+        numpy array (N, S, 2)
+    """
+    u = p2 - p1
+    uu = np.maximum(np.sum(u ** 2, axis=1), 1e-300)
+    v = points[:, None, :] - p1[None, :, :]
+    d = np.clip(np.sum(v * u[None, :, :], axis=2) / uu, 0., 1.)
+    return p1[None, :, :] + d[:, :, None] * u[None, :, :]
+
+
 class Box(Shape):
     """
         An axis aligned box (hypercube) defined by
             - origin    : its center
             - dim       : its extent
 
-        TODO 1) define distance
-             2) class should work for 2D and 3D boxes
-             3) test this function
-             4) make callable using stack
+        The distance, gradient and hessian are computed in closed form
+        from the coordinates relative to the half extents
+        q = |x - origin| - dim / 2, for single points or arrays of
+        points of shape (n, ...), (e.g., meshgrid data).
     """
 
     def __init__(self,
@@ -374,30 +496,63 @@ class Box(Shape):
     def diag(self):
         return np.linalg.norm(self.dim)
 
+    def bounding_box(self):
+        return [self.lower_corner(), self.upper_corner()]
+
+    def _half_dim(self, x):
+        return .5 * self.dim.reshape(self.dim.shape + (1,) * (x.ndim - 1))
+
+    def _relative_coordinates(self, x):
+        """ returns the sign of the coordinates relative to the center
+            and q = |x - origin| - dim / 2 """
+        x_center = (x.T - self.origin).T
+        sign = np.where(x_center < 0., -1., 1.)
+        return sign, np.absolute(x_center) - self._half_dim(x)
+
     def is_inside(self, x):
         """
         Returns false if any of the component of the vector
         is smaller or bigger than the lower and top corner
         of the box respectively
 
-        Warning : This is only valid for AxisAligned Box
-
         Parameters
         ----------
         x : numpy array with
             arbitrary dimensions, 2d and 3d
             or meshgrid data shape = (2 or 3, n, n)
         """
-        l_corner = self.lower_corner()
-        u_corner = self.upper_corner()
-        single = x.shape == (2,) or x.shape == (3,)
-        shape = 1 if single else (x.shape[1], x.shape[2])
-        inside = np.full(shape, True)
-        for k in range(x.shape[0]):
-            inside = np.where(np.logical_or(
-                x[k] < l_corner[k],
-                x[k] > u_corner[k]), False, inside)
-        return inside
+        sign, q = self._relative_coordinates(x)
+        return np.all(q <= 0., axis=0)
+
+    def dist_from_border(self, x):
+        sign, q = self._relative_coordinates(x)
+        q_max = np.max(q, axis=0)
+        d = np.where(q_max > 0., vector_norm(np.maximum(q, 0.)), q_max)
+        return d.item() if d.ndim == 0 else d
+
+    def dist_gradient(self, x):
+        sign, q = self._relative_coordinates(x)
+        q_out = np.maximum(q, 0.)
+        norm = vector_norm(q_out)
+        outside = norm > 0.
+        g_out = q_out / np.where(outside, norm, 1.)
+        axis = np.arange(x.shape[0]).reshape(
+            (x.shape[0],) + (1,) * (x.ndim - 1))
+        g_in = (axis == np.argmax(q, axis=0)).astype(float)
+        return sign * np.where(outside, g_out, g_in)
+
+    def dist_hessian(self, x):
+        """ only non zero in the corner zones, where it is the hessian
+            of the distance to the vertex (see point_distance_hessian) """
+        sign, q = self._relative_coordinates(x)
+        q_out = np.maximum(q, 0.)
+        corner = np.all(q > 0., axis=0)
+        d_inv = np.where(corner, 1. / np.where(corner, vector_norm(q_out), 1.),
+                         0.)
+        x_v = sign * q_out
+        n = x.shape[0]
+        eye = np.eye(n).reshape((n, n) + (1,) * (x.ndim - 1))
+        return d_inv * eye - d_inv ** 3 * x_v[:, None] * x_v[None, :]
 
     def verticies(self):
         """ TODO test """
@@ -413,13 +568,18 @@ class Box(Shape):
         return v
 
     def segments(self):
-        v = self.verticies()
-        s = [None] * 4
-        s[0] = segment_from_end_points(v[0], v[1])
-        s[1] = segment_from_end_points(v[1], v[2])
-        s[2] = segment_from_end_points(v[2], v[3])
-        s[3] = segment_from_end_points(v[3], v[0])
-        return s
+        """ the segments are cached until the origin or dim change """
+        key = tuple(self.origin) + tuple(self.dim)
+        if getattr(self, "_segments_key", None) != key:
+            v = self.verticies()
+            s = [None] * 4
+            s[0] = segment_from_end_points(v[0], v[1])
+            s[1] = segment_from_end_points(v[1], v[2])
+            s[2] = segment_from_end_points(v[2], v[3])
+            s[3] = segment_from_end_points(v[3], v[0])
+            self._segments = s
+            self._segments_key = key
+        return self._segments
 
     def closest_segment(self, x):
         min_dist = np.inf
@@ -437,18 +597,6 @@ class Box(Shape):
     def closest_point(self, x):
         return self.closest_segment(x)[1]
 
-    def dist_hessian(self, x):
-        return self.closest_segment(x)[0].dist_hessian(x)
-
-    def dist_from_border(self, x):
-        d = [None] * 4
-        for i, segment in enumerate(self.segments()):
-            d[i] = segment.dist_from_border(x)
-        sign = np.where(Box.is_inside(self, x), -1., 1.)
-        minimum = np.min(np.array(d), axis=0)
-        d = sign * minimum
-        return np.asscalar(d) if d.size == 1 else d
-
     def sampled_points(self):
         points = []
         v = self.verticies()
@@ -465,29 +613,26 @@ class AxisAlignedBox(Box):
         An axis aligned box (hypercube) defined by
             - origin    : its center
             - dim       : its extent
-    """
 
-    def __init__(self,
-                 origin=np.array([0., 0.]),
-                 dim=np.array([1., 1.])):
-        Box.__init__(self, origin, dim)
-        """
-        In all zones (1) the hessian of the signed distance
-        field is zero((n, n)) and gradient (0, 1) or (1, 0)
-
-                   v1 | (1) | v2
-                   ___|_____|___
-                  (1) | (1) | (1)
-                   ___|_____|___
-                   v4 | (1) | v3
+        The coordinates relative to the half extents (see Box)
+        classify the zones of all points at once:
 
-        ZONES:
                    1  |  5  |  2
                    ___|_____|___
                    8  |  9  |  6
                    ___|_____|___
                    4  |  7  |  3
-        """
+
+        In the corner zones (1 to 4) the distance is the distance to the
+        vertex, in the side zones (5 to 8) it is the distance to the side
+        and its hessian is zero. Inside (9) it is the distance to the
+        closest side.
+    """
+
+    def __init__(self,
+                 origin=np.array([0., 0.]),
+                 dim=np.array([1., 1.])):
+        Box.__init__(self, origin, dim)
         self.half_dim = 0.5 * self.dim
         self._v1 = np.array([-self.half_dim[0], self.half_dim[1]])
         self._v2 = np.array([self.half_dim[0], self.half_dim[1]])
@@ -495,42 +640,6 @@ class AxisAlignedBox(Box):
         self._v4 = np.array([-self.half_dim[0], -self.half_dim[1]])
         self._verticies = [self._v1, self._v2, self._v3, self._v4]
 
-        self._switcher_distance = {
-            1: lambda x: vector_norm(x - self._v1),
-            2: lambda x: vector_norm(x - self._v2),
-            3: lambda x: vector_norm(x - self._v3),
-            4: lambda x: vector_norm(x - self._v4),
-            5: lambda x: x[1] - self._v1[1],
-            6: lambda x: x[0] - self._v3[0],
-            7: lambda x: self._v1[1] - x[1],
-            8: lambda x: self._v1[0] - x[0],
-            9: lambda x: -min(self.half_dim - np.absolute(x))
-        }
-
-        self._switcher_gradient = {
-            1: lambda x: point_distance_gradient(x, self._v1),
-            2: lambda x: point_distance_gradient(x, self._v2),
-            3: lambda x: point_distance_gradient(x, self._v3),
-            4: lambda x: point_distance_gradient(x, self._v4),
-            5: lambda x: np.array([0, 1]),
-            6: lambda x: np.array([1, 0]),
-            7: lambda x: np.array([0, -1]),
-            8: lambda x: np.array([-1, 0]),
-            9: lambda x: self._inside_gradient(x)
-        }
-
-        self._switcher_hessian = {
-            1: lambda x: point_distance_hessian(x, self._v1),
-            2: lambda x: point_distance_hessian(x, self._v2),
-            3: lambda x: point_distance_hessian(x, self._v3),
-            4: lambda x: point_distance_hessian(x, self._v4),
-            5: lambda x: np.zeros((self.origin.size, self.origin.size)),
-            6: lambda x: np.zeros((self.origin.size, self.origin.size)),
-            7: lambda x: np.zeros((self.origin.size, self.origin.size)),
-            8: lambda x: np.zeros((self.origin.size, self.origin.size)),
-            9: lambda x: np.zeros((self.origin.size, self.origin.size))
-        }
-
     def find_zone(self, x_center):
         """
                    1  |  5  |  2
@@ -569,39 +678,6 @@ class AxisAlignedBox(Box):
             else:
                 return 9
 
-    def is_inside(self, x):
-        x_center = (x.T - self.origin).T
-        return self.find_zone(x_center) == 9
-
-    def _inside_gradient(self, x):
-        d1 = np.fabs(self.half_dim[0] - x[0])
-        d2 = np.fabs(self.half_dim[1] - x[1])
-        d3 = np.fabs(-self.half_dim[0] - x[0])
-        d4 = np.fabs(-self.half_dim[1] - x[1])
-        switcher = {
-            0: np.array([1, 0]),
-            1: np.array([0, 1]),
-            2: np.array([-1, 0]),
-            3: np.array([0, -1])}
-        idx = np.argmin([d1, d2, d3, d4])
-        return switcher[idx]
-
-    def dist_from_border(self, x):
-        single = x.shape == (2,) or x.shape == (3,)
-        if not single:
-            # For now we can not use meshgrid for this class
-            return Box.dist_from_border(self, x)
-        x_center = (x.T - self.origin).T
-        return self._switcher_distance.get(self.find_zone(x_center))(x_center)
-
-    def dist_gradient(self, x):
-        x_center = (x.T - self.origin).T
-        return self._switcher_gradient.get(self.find_zone(x_center))(x_center)
-
-    def dist_hessian(self, x):
-        x_center = (x.T - self.origin).T
-        return self._switcher_hessian.get(self.find_zone(x_center))(x_center)
-
 
 def line_side(a, b, p):
     """
@@ -640,7 +716,13 @@ class Polygon(Shape):
         A Polygon class
             - origin    : its center
             - verticies : stored and passed in a counter-clockwise order
-        TODO: TEST
+            - convex    : if False the inside test uses the winding
+                          number, which works for any simple polygon
+
+        The edges are stored as arrays of start and end points, the
+        distance, gradient and hessian are computed for all points and
+        all edges with one broadcast. The methods work for single points
+        or arrays of points of shape (2, ...), (e.g., meshgrid data).
     """
 
     def __init__(self,
@@ -649,9 +731,11 @@ class Polygon(Shape):
                      np.array([1., 1.]),
                      np.array([0., 1.]),
                      np.array([0., 0.]),
-                     np.array([1., 0.])]):
+                     np.array([1., 0.])],
+                 convex=True):
         Shape.__init__(self)
         self.origin = origin
+        self.convex = convex
         self._verticies = verticies
         self._edges = [None] * len(self._verticies)
         self.create_segments()
@@ -664,10 +748,56 @@ class Polygon(Shape):
             else:
                 v2 = self._verticies[0]
             self._edges[i] = segment_from_end_points(v1, v2)
+        self._edge_starts = np.array(self._verticies, dtype=float)
+        self._edge_ends = np.roll(self._edge_starts, -1, axis=0)
+
+    def edge_arrays(self):
+        """ returns the start and end points of the edges (E, 2) """
+        return self._edge_starts, self._edge_ends
+
+    def _closest_points(self, points):
+        """ returns the distances (N, E) and closest points (N, E, 2)
+            of the points (N, 2) to all edges """
+        closest = segments_closest_points(
+            self._edge_starts, self._edge_ends, points)
+        d = np.linalg.norm(points[:, None, :] - closest, axis=2)
+        return d, closest
+
+    def _inside(self, points):
+        """ inside test for an array of points (N, 2) """
+        a, b = self._edge_starts, self._edge_ends
+        u = b - a
+        v = points[:, None, :] - a[None, :, :]
+        cross = u[None, :, 0] * v[:, :, 1] - u[None, :, 1] * v[:, :, 0]
+        if self.convex:
+            # left side of all edges
+            return np.all(cross >= 0, axis=1)
+        y = points[:, 1][:, None]
+        upward = (a[None, :, 1] <= y) & (b[None, :, 1] > y) & (cross > 0)
+        downward = (a[None, :, 1] > y) & (b[None, :, 1] <= y) & (cross < 0)
+        return np.sum(upward, axis=1) - np.sum(downward, axis=1) != 0
+
+    def _evaluate(self, x):
+        """ returns the points (N, 2), the sign (N), the distances to
+            the closest edges (N), the closest points (N, 2) and the
+            projection on the closest edges (N) """
+        points = np.asarray(x, dtype=float).reshape(2, -1).T
+        d, closest = self._closest_points(points)
+        rows = np.arange(points.shape[0])
+        e = np.argmin(d, axis=1)
+        sign = np.where(self._inside(points), -1., 1.)
+        u = self._edge_ends[e] - self._edge_starts[e]
+        t = np.sum((points - self._edge_starts[e]) * u, axis=1) / np.sum(
+            u ** 2, axis=1)
+        return points, sign, d[rows, e], closest[rows, e], t, e
 
     def verticies(self):
         return self._verticies
 
+    def bounding_box(self):
+        points = [e.p1() for e in self._edges] + [e.p2() for e in self._edges]
+        return [np.min(points, axis=0), np.max(points, axis=0)]
+
     def is_inside(self, x):
         """
         Returns false if x is outside of the polygon
@@ -675,46 +805,49 @@ class Polygon(Shape):
         Parameters
         ----------
         x : numpy array with
-            arbitrary dimensions, 2d and 3d
-            or meshgrid data shape = (2 or 3, n, n)
+            arbitrary dimensions, 2d
+            or meshgrid data shape = (2, n, n)
 
-        Computes inside by checking that the point is on the
-        "right side" of all edges of the polygon
+        For convex polygons computes inside by checking that the point
+        is on the left side of all edges of the polygon, otherwise
+        uses the winding number.
         """
-        single = x.shape == (2,) or x.shape == (3,)
-        shape = 1 if single else (x.shape[1], x.shape[2])
-        inside = np.full(shape, True)
-        for e in self._edges:
-            inside = np.where(line_side(e.p1(), e.p2(), x), inside, False)
-        return inside
+        points = np.asarray(x, dtype=float).reshape(2, -1).T
+        inside = self._inside(points)
+        return inside[0] if x.ndim == 1 else inside.reshape(x.shape[1:])
 
     def closest_edge(self, x):
-        min_dist = np.inf
-        closest_point = np.zeros(x.shape)
-        closest_edge = None
-        for edge in self._edges:
-            p = edge.closest_point(x)
-            d = np.linalg.norm(x - p)
-            if min_dist > d:
-                min_dist = d
-                closest_point = p.copy()
-                closest_edge = edge
-        return closest_edge, closest_point, min_dist
+        points, sign, d, closest, t, e = self._evaluate(x)
+        return self._edges[e[0]], closest[0], d[0]
 
     def closest_point(self, x):
-        return self.closest_edge(x)[1]
-
-    def dist_hessian(self, x):
-        return self.closest_edge(x)[0].dist_hessian(x)
+        points, sign, d, closest, t, e = self._evaluate(x)
+        return closest[0] if x.ndim == 1 else closest.T.reshape(x.shape)
 
     def dist_from_border(self, x):
-        d = [None] * len(self._edges)
-        for i, edge in enumerate(self._edges):
-            d[i] = edge.dist_from_border(x)
-        sign = np.where(self.is_inside(x), -1., 1.)
-        minimum = np.min(np.array(d), axis=0)
-        d = sign * minimum
-        return np.asscalar(d) if d.size == 1 else d
+        points, sign, d, closest, t, e = self._evaluate(x)
+        d = sign * d
+        return d[0] if x.ndim == 1 else d.reshape(x.shape[1:])
+
+    def dist_gradient(self, x):
+        points, sign, d, closest, t, e = self._evaluate(x)
+        g = sign[:, None] * (points - closest) / d[:, None]
+        return g[0] if x.ndim == 1 else g.T.reshape(x.shape)
+
+    def dist_hessian(self, x):
+        """ zero when the closest point is inside an edge, otherwise
+            it is the hessian of the distance to the vertex
+            (see point_distance_hessian) """
+        points, sign, d, closest, t, e = self._evaluate(x)
+        vertex = np.logical_or(t <= 0., t >= 1.)
+        d_inv = np.where(vertex, 1. / d, 0.)
+        x_v = points - closest
+        H = (d_inv[:, None, None] * np.eye(2)[None, :, :] -
+             (d_inv ** 3)[:, None, None] * x_v[:, :, None] * x_v[:, None, :])
+        H *= sign[:, None, None]
+        if x.ndim == 1:
+            return H[0]
+        return np.transpose(H, (1, 2, 0)).reshape((2, 2) + x.shape[1:])
 
     def sampled_points(self):
         nb_points_per_edge = max(2, int(self.nb_points / len(self._edges)))
@@ -775,7 +908,7 @@ class Complex(Shape):
         for i, shape in enumerate(self._shapes):
             d[i] = shape.dist_from_border(x)
         d = np.min(np.array(d), axis=0)
-        return np.asscalar(d) if d.size == 1 else d
+        return d.item() if d.size == 1 else d
 
     def is_inside(self, x):
         inside = [None] * len(self._shapes)
@@ -783,6 +916,25 @@ class Complex(Shape):
             inside[i] = shape.is_inside(x)
         return np.any(inside)
 
+    def closest_shape(self, x):
+        """ returns the shape with smallest distance at x """
+        d = [shape.dist_from_border(x) for shape in self._shapes]
+        return self._shapes[int(np.argmin(d))]
+
+    def closest_point(self, x):
+        return self.closest_shape(x).closest_point(x)
+
+    def dist_gradient(self, x):
+        return self.closest_shape(x).dist_gradient(x)
+
+    def dist_hessian(self, x):
+        return self.closest_shape(x).dist_hessian(x)
+
+    def bounding_box(self):
+        boxes = [shape.bounding_box() for shape in self._shapes]
+        return [np.min([b[0] for b in boxes], axis=0),
+                np.max([b[1] for b in boxes], axis=0)]
+
 
 class SignedDistance2DMap(DifferentiableMap):
     """
@@ -802,10 +954,10 @@ class SignedDistance2DMap(DifferentiableMap):
         return self._shape.dist_from_border(x)
 
     def jacobian(self, x):
-        return np.matrix(self._shape.dist_gradient(x)).reshape((1, 2))
+        return np.asarray(self._shape.dist_gradient(x)).reshape((1, 2))
 
     def hessian(self, x):
-        return np.matrix(self._shape.dist_hessian(x))
+        return np.asarray(self._shape.dist_hessian(x))
 
 
 class SignedDistanceWorkspaceMap(DifferentiableMap):
@@ -829,29 +981,303 @@ class SignedDistanceWorkspaceMap(DifferentiableMap):
     def jacobian(self, x):
         """ Warning: this gradient is ill defined
             it has a kink when two objects are at the same distance """
-        return np.matrix(self._workspace.min_dist_gradient(x)).reshape((1, 2))
+        return np.asarray(
+            self._workspace.min_dist_gradient(x)).reshape((1, 2))
 
     def hessian(self, x):
         """ Warning: this hessian is ill defined
             it has a kink when two objects are at the same distance """
         [mindist, minid] = self._workspace.min_dist(x)
-        return np.matrix(self._workspace.obstacles[minid].dist_hessian(x))
+        return np.asarray(self._workspace.obstacles[minid].dist_hessian(x))
 
     def evaluate(self, x):
         """ Warning: this gradient is ill defined
             it has a kink when two objects are at the same distance """
         [mindist, minid] = self._workspace.min_dist(x)
         g_mindist = self._workspace.obstacles[minid].dist_gradient(x)
-        J_mindist = np.matrix(g_mindist).reshape((1, 2))
+        J_mindist = np.asarray(g_mindist).reshape((1, 2))
         return [mindist, J_mindist]
 
+    def evaluate_all(self, x, order=2):
+        """ Warning: the derivatives are ill defined
+            they have a kink when two objects are at the same distance """
+        [mindist, minid] = self._workspace.min_dist(x)
+        obstacle = self._workspace.obstacles[minid]
+        J, H = None, None
+        if order >= 1:
+            J = np.asarray(obstacle.dist_gradient(x)).reshape((1, 2))
+        if order >= 2:
+            H = np.asarray(obstacle.dist_hessian(x))
+        return [mindist, J, H]
+
+    def forward_batch(self, Q):
+        d = self._workspace.min_dist_batch(Q)[0]
+        return d.reshape(Q.shape[0], 1)
+
+    def jacobian_batch(self, Q):
+        g = self._workspace.min_dist_gradient_batch(Q)[2]
+        return g.reshape(Q.shape[0], 1, 2)
+
+
+class SmoothSignedDistanceWorkspaceMap(SignedDistanceWorkspaceMap):
+    """
+        Smooth union of the obstacles signed distances d_i
+
+            f(x) = - temperature * log[ sum_i exp(- d_i(x) / temperature) ]
+
+        computed with LogSumExp over the distances to all obstacles.
+        Contrary to the min distance, the gradient and hessian are well
+        defined when two obstacles are at the same distance. The smooth
+        distance is a lower bound of the min distance:
+
+            min_i d_i - temperature * log(K) <= f <= min_i d_i
+
+        All the obstacles and points are evaluated at once,
+        see ObstacleArrays.distances.
+    """
+
+    def __init__(self, workspace, temperature=.01):
+        SignedDistanceWorkspaceMap.__init__(self, workspace)
+        self._temperature = temperature
+
+    def temperature(self):
+        return self._temperature
+
+    def forward(self, x):
+        """ x : numpy array of shape (2, ) or meshgrid data (2, n, m) """
+        if x.shape == (2,):
+            return self.evaluate_all(x, order=0)[0]
+        d = self.forward_batch(x.reshape(2, -1).T)
+        return d.reshape(x.shape[1:])
+
+    def jacobian(self, x):
+        return self.evaluate_all(x, order=1)[1]
+
+    def hessian(self, x):
+        return self.evaluate_all(x, order=2)[2]
+
+    def evaluate(self, x):
+        return self.evaluate_all(x, order=1)[:2]
+
+    def evaluate_all(self, x, order=2):
+        [X, J, H] = self.evaluate_all_batch(x.reshape(1, 2), order)
+        return [X[0, 0],
+                None if J is None else J[0],
+                None if H is None else H[0]]
+
+    def evaluate_all_batch(self, Q, order=2):
+        [D, G, H_d] = self._workspace.obstacle_arrays().distances(Q, order)
+        smooth_max = LogSumExp(D.shape[1], 1. / self._temperature)
+        [v, J_s, H_s] = smooth_max.evaluate_all_batch(-D, order)
+        X = -v
+        if order < 1:
+            return [X, None, None]
+        w = J_s[:, 0, :]
+        J = np.einsum('nk,nki->ni', w, G)[:, None, :]
+        if order < 2:
+            return [X, J, None]
+        H = np.einsum('nk,nkij->nij', w, H_d) - np.einsum(
+            'nkl,nki,nlj->nij', H_s, G, G)
+        return [X, J, H]
+
+    def forward_batch(self, Q):
+        return self.evaluate_all_batch(Q, order=0)[0]
+
+    def jacobian_batch(self, Q):
+        return self.evaluate_all_batch(Q, order=1)[1]
+
+    def hessian_batch(self, Q):
+        return self.evaluate_all_batch(Q, order=2)[2]
+
+
+class GridSignedDistanceMap(DifferentiableMap):
+    """
+        Signed distance field of a workspace rasterized once on a
+        regular grid and interpolated by a bicubic spline. Queries are
+        independent of the number of obstacles and the derivatives are
+        the analytic derivatives of the spline.
+
+    Parameters
+    ----------
+        workspace : the grid covers the workspace box and the padding
+        nb_points : number of grid points along each side
+        exact : if False the grid is computed from the occupancy
+                using the euclidean distance transform (pixel_map.sdf)
+        tolerance : if set the grid resolution is doubled until the
+                    estimated interpolation error is smaller (see max_error)
+        max_nb_points : limit of the refinement
+    """
+
+    def __init__(self, workspace, nb_points=100, padding=0., exact=True,
+                 tolerance=None, max_nb_points=1600):
+        self._workspace = workspace
+        self._padding = padding
+        self._exact = exact
+        self._rasterize(nb_points)
+        while tolerance is not None and self._nb_points < max_nb_points:
+            if self.max_error() <= tolerance:
+                break
+            self._rasterize(min(2 * self._nb_points, max_nb_points))
+
+    def _rasterize(self, nb_points):
+        extent = self._workspace.box.extent()
+        x = np.linspace(extent.x_min - self._padding,
+                        extent.x_max + self._padding, nb_points)
+        y = np.linspace(extent.y_min - self._padding,
+                        extent.y_max + self._padding, nb_points)
+        if self._exact:
+            X, Y = np.meshgrid(x, y, indexing='ij')
+            points = np.stack([X.ravel(), Y.ravel()], axis=1)
+            values = self._workspace.min_dist_batch(points)[0]
+            values = values.reshape(nb_points, nb_points)
+        else:
+            values = sdf(self._occupancy(x, y).astype(int)) * (x[1] - x[0])
+        self._nb_points = nb_points
+        self.resolution = x[1] - x[0]
+        self._grid = (x, y)
+        self._interp_spline = RectBivariateSpline(x, y, values)
+
+    def _occupancy(self, x, y):
+        """ occupancy of the grid, each obstacle is only
+            evaluated in the points of its bounding box """
+        occupancy = np.zeros((x.size, y.size), dtype=bool)
+        for obstacle in self._workspace.obstacles:
+            try:
+                lower, upper = obstacle.bounding_box()
+            except NotImplementedError:
+                lower, upper = self._workspace.box.bounding_box()
+            i = np.searchsorted(x, [lower[0], upper[0]], side='right')
+            j = np.searchsorted(y, [lower[1], upper[1]], side='right')
+            i[0], j[0] = max(i[0] - 1, 0), max(j[0] - 1, 0)
+            if i[1] <= i[0] or j[1] <= j[0]:
+                continue
+            X, Y = np.meshgrid(x[i[0]:i[1]], y[j[0]:j[1]], indexing='ij')
+            d = ObstacleArrays([obstacle]).min_dist(
+                np.stack([X.ravel(), Y.ravel()], axis=1))[0]
+            occupancy[i[0]:i[1], j[0]:j[1]] |= d.reshape(X.shape) < 0
+        return occupancy
+
+    def output_dimension(self):
+        return 1
+
+    def input_dimension(self):
+        return 2
+
+    def nb_points(self):
+        return self._nb_points
+
+    def max_error(self, nb_samples=1000):
+        """ Estimates the interpolation error by comparing to the
+            exact signed distance on points sampled in the grid """
+        x, y = self._grid
+        points = np.random.uniform(
+            [x[0], y[0]], [x[-1], y[-1]], (nb_samples, 2))
+        d = self._workspace.min_dist_batch(points)[0]
+        return np.max(np.abs(d - self.forward_batch(points)[:, 0]))
+
+    def _ev(self, p, dx=0, dy=0):
+        return self._interp_spline.ev(p[0], p[1], dx=dx, dy=dy)
+
+    def forward(self, p):
+        return self._ev(p)
+
+    def jacobian(self, p):
+        return np.array([[self._ev(p, dx=1), self._ev(p, dy=1)]])
+
+    def hessian(self, p):
+        h_xy = self._ev(p, dx=1, dy=1)
+        return np.array([[self._ev(p, dx=2), h_xy],
+                         [h_xy, self._ev(p, dy=2)]])
+
+    def evaluate(self, p):
+        return [self.forward(p), self.jacobian(p)]
+
+    def forward_batch(self, Q):
+        return self._ev(Q.T).reshape(Q.shape[0], 1)
+
+    def jacobian_batch(self, Q):
+        J = np.stack([self._ev(Q.T, dx=1), self._ev(Q.T, dy=1)], axis=1)
+        return J.reshape(Q.shape[0], 1, 2)
+
+    def hessian_batch(self, Q):
+        H = np.zeros((Q.shape[0], 2, 2))
+        H[:, 0, 0] = self._ev(Q.T, dx=2)
+        H[:, 0, 1] = H[:, 1, 0] = self._ev(Q.T, dx=1, dy=1)
+        H[:, 1, 1] = self._ev(Q.T, dy=2)
+        return H
+
+    def evaluate_all(self, p, order=2):
+        """ value, jacobian and hessian of the spline """
+        J, H = None, None
+        if order >= 1:
+            J = self.jacobian(p)
+        if order >= 2:
+            H = self.hessian(p)
+        return [self.forward(p), J, H]
+
+
+def stamp_obstacles(nb_points, workspace, margin=0.):
+    """
+    Returns the signed distance field of the workspace on the
+    nb_points x nb_points cells of its box (indexed [x, y] as the
+    PixelMap) where each obstacle only sets the cells of its bounding box
+    inflated by margin. The other cells are set to inf.
+
+    The values are exact in the cells that are closer than margin to
+    an obstacle, and upper bounds elsewhere.
+    """
+    pixel_map = pixelmap_from_box(nb_points, workspace.box)
+    resolution = pixel_map.resolution
+    sdf = np.full((nb_points, nb_points), np.inf)
+    for obstacle in workspace.obstacles:
+        try:
+            lower, upper = obstacle.bounding_box()
+        except NotImplementedError:
+            lower, upper = workspace.box.bounding_box()
+        lower = np.ceil((lower - margin - pixel_map.origin) / resolution)
+        upper = np.floor((upper + margin - pixel_map.origin) / resolution)
+        lower = np.clip(lower.astype(int), 0, nb_points)
+        upper = np.clip(upper.astype(int) + 1, 0, nb_points)
+        if np.any(upper <= lower):
+            continue
+        i, j = np.meshgrid(np.arange(lower[0], upper[0]),
+                           np.arange(lower[1], upper[1]), indexing='ij')
+        points = pixel_map.grid_to_world(np.stack([i.ravel(), j.ravel()], 1))
+        d = ObstacleArrays([obstacle]).min_dist(points)[0]
+        cells = sdf[lower[0]:upper[0], lower[1]:upper[1]]
+        np.minimum(cells, d.reshape(cells.shape), out=cells)
+    return sdf
+
+
+def rasterize_sdf(nb_points, workspace, margin=None):
+    """
+    Returns the signed distance field of the workspace on the
+    nb_points x nb_points cells of its box (indexed [x, y] as the
+    PixelMap), i.e. the transpose of the field evaluated on the meshgrid.
+
+    The obstacles are stamped in the cells closer than margin
+    (by default two cells, see stamp_obstacles) where the distance is
+    exact. The remaining cells are filled by a euclidean distance
+    transform (EDT) pass, which adds to the distance of the closest
+    exact cell the distance to that cell, this is an upper bound.
+    """
+    pixel_map = pixelmap_from_box(nb_points, workspace.box)
+    resolution = pixel_map.resolution
+    margin = 2. * resolution if margin is None else max(margin, resolution)
+    sdf = stamp_obstacles(nb_points, workspace, margin)
+    band = sdf <= margin
+    if band.all() or not band.any():
+        return sdf
+    dist, (i, j) = ndimage.distance_transform_edt(
+        np.logical_not(band), return_indices=True)
+    return np.minimum(sdf, sdf[i, j] + resolution * dist)
+
 
 def occupancy_map(nb_points, workspace):
     """ Returns an occupancy map in the form of a square matrix
-        using the signed distance field associated to a workspace object """
-    meshgrid = workspace.box.stacked_meshgrid(nb_points)
-    sdf = SignedDistanceWorkspaceMap(workspace)(meshgrid).T
-    return (sdf < 0).astype(float)
+        using the signed distance of the obstacles in their bounding box,
+        (see stamp_obstacles) """
+    return (stamp_obstacles(nb_points, workspace) < 0).astype(float)
 
 
 class EnvBox(Box):
@@ -936,38 +1362,486 @@ def pixelmap_from_box(nb_points, box):
     return PixelMap(resolution, extent)
 
 
+class ObstacleArrays:
+    """
+        Packs the obstacles of a workspace into arrays per obstacle type
+        so that the signed distance of N points is evaluated with a few
+        broadcasted operations instead of a loop over the obstacles.
+
+            - circles   : centers and radii
+            - boxes     : centers and half extents (axis aligned)
+            - segments  : end points of the stand alone segments and
+                          of the polygon edges, with the id of their owner
+
+        Other shapes are evaluated point by point with dist_from_border.
+    """
+
+    def __init__(self, obstacles):
+        self.nb_obstacles = len(obstacles)
+        circles, boxes, segments, polygons, others = [], [], [], [], []
+        for i, o in enumerate(obstacles):
+            if type(o) is Circle:
+                circles.append(i)
+            elif type(o) in (Box, AxisAlignedBox):
+                boxes.append(i)
+            elif type(o) is Segment:
+                segments.append(i)
+            elif (isinstance(o, Polygon) and
+                  type(o).dist_from_border is Polygon.dist_from_border):
+                polygons.append(i)
+            else:
+                others.append(i)
+        self.circle_ids = np.array(circles, dtype=int)
+        self.centers = np.array(
+            [obstacles[i].origin for i in circles]).reshape(-1, 2)
+        self.radii = np.array([obstacles[i].radius for i in circles])
+        self.box_ids = np.array(boxes, dtype=int)
+        self.box_centers = np.array(
+            [obstacles[i].origin for i in boxes]).reshape(-1, 2)
+        self.box_half_dims = np.array(
+            [.5 * obstacles[i].dim for i in boxes]).reshape(-1, 2)
+
+        # Stand alone segments and polygon edges are stacked
+        # the edges of an obstacle are contiguous
+        p1, p2, owners = [], [], []
+        for i in segments:
+            p1.append(obstacles[i].p1())
+            p2.append(obstacles[i].p2())
+            owners.append(i)
+        for i in polygons:
+            starts, ends = obstacles[i].edge_arrays()
+            p1.extend(starts)
+            p2.extend(ends)
+            owners.extend([i] * len(starts))
+        self.p1 = np.array(p1).reshape(-1, 2)
+        self.p2 = np.array(p2).reshape(-1, 2)
+        self.segment_owners = np.array(owners, dtype=int)
+        self.owner_ids = np.array(segments + polygons, dtype=int)
+        self.owner_is_polygon = np.in1d(self.owner_ids, polygons)
+        self._non_convex = [
+            (k, obstacles[i]) for k, i in enumerate(self.owner_ids)
+            if i in polygons and not obstacles[i].convex]
+        # Index of the first edge of each owner and owner of each edge
+        self._starts = np.flatnonzero(
+            np.r_[True, np.diff(self.segment_owners) != 0]) if owners else []
+        self._edge_owner = np.cumsum(
+            np.r_[True, np.diff(self.segment_owners) != 0]) - 1
+        self.other_ids = others
+        self._obstacles = obstacles
+
+    @staticmethod
+    def key(obstacles):
+        """ the arrays have to be rebuilt when the key changes, i.e.,
+            when the list of obstacles changes or when an attribute
+            of a shape is assigned (see Shape.nb_modifications) """
+        return (Shape.nb_modifications, tuple(map(id, obstacles)))
+
+    def _segments_distances(self, points):
+        """ returns the distance to each owner (N, O), the closest
+            points (N, O, 2) and the closest edges (N, O) """
+        closest = segments_closest_points(self.p1, self.p2, points)
+        d = np.linalg.norm(points[:, None, :] - closest, axis=2)
+        d_min = np.minimum.reduceat(d, self._starts, axis=1)
+        # First edge of each owner that reaches the minimum
+        is_min = d == d_min[:, self._edge_owner]
+        edge_ids = np.where(is_min, np.arange(d.shape[1])[None, :], d.shape[1])
+        edge = np.minimum.reduceat(edge_ids, self._starts, axis=1)
+        rows = np.arange(points.shape[0])[:, None]
+        return d_min, closest[rows, edge], edge
+
+    def _polygons_inside(self, points):
+        """ points are inside convex polygons with counter clockwise
+            verticies if they are on the left side of all edges,
+            non convex polygons use their own inside test """
+        u = self.p2 - self.p1
+        v = points[:, None, :] - self.p1[None, :, :]
+        left = (u[None, :, 0] * v[:, :, 1] - u[None, :, 1] * v[:, :, 0]) >= 0
+        inside = np.logical_and.reduceat(left, self._starts, axis=1)
+        for k, polygon in self._non_convex:
+            inside[:, k] = polygon._inside(points)
+        return inside
+
+    def _circles(self, points, order):
+        """ returns the distances (N, C), gradients (N, C, 2)
+            and hessians (N, C, 2, 2) up to order """
+        x_center = points[:, None, :] - self.centers[None, :, :]
+        norm = np.linalg.norm(x_center, axis=2)
+        d = norm - self.radii[None, :]
+        if order < 1:
+            return [d, None, None]
+        g = x_center / norm[:, :, None]
+        if order < 2:
+            return [d, g, None]
+        h = (np.eye(2) - g[:, :, :, None] * g[:, :, None, :]) / norm[
+            :, :, None, None]
+        return [d, g, h]
+
+    def _boxes(self, points, order):
+        """ see Box, returns the distances (N, B), gradients (N, B, 2)
+            and hessians (N, B, 2, 2) up to order """
+        x_center = points[:, None, :] - self.box_centers[None, :, :]
+        q = np.absolute(x_center) - self.box_half_dims[None, :, :]
+        q_out = np.maximum(q, 0.)
+        norm_out = np.linalg.norm(q_out, axis=2)
+        q_max = np.max(q, axis=2)
+        outside = q_max > 0.
+        d = np.where(outside, norm_out, q_max)
+        if order < 1:
+            return [d, None, None]
+        sign = np.where(x_center < 0., -1., 1.)
+        g_out = sign * q_out / np.maximum(norm_out, 1e-300)[:, :, None]
+        axis = np.argmax(q, axis=2)
+        g_in = sign * (np.arange(2)[None, None, :] == axis[:, :, None])
+        g = np.where(outside[:, :, None], g_out, g_in)
+        if order < 2:
+            return [d, g, None]
+        # only the corner zones have a non zero hessian
+        corner = np.all(q > 0., axis=2)
+        d_inv = np.where(corner, 1. / np.maximum(norm_out, 1e-300), 0.)
+        h = (np.eye(2) - g[:, :, :, None] * g[:, :, None, :]) * d_inv[
+            :, :, None, None]
+        return [d, g, h]
+
+    def _segments(self, points, order):
+        """ returns the signed distances (N, O), gradients (N, O, 2)
+            and hessians (N, O, 2, 2) up to order of the segments
+            and polygons, the hessian is only non zero when the closest
+            point is a vertex """
+        d, closest, edge = self._segments_distances(points)
+        inside = None
+        if self.owner_is_polygon.any():
+            inside = np.logical_and(
+                self._polygons_inside(points),
+                self.owner_is_polygon[None, :])
+        sign = 1. if inside is None else np.where(inside, -1., 1.)
+        if order < 1:
+            return [sign * d, None, None]
+        d_safe = np.maximum(d, 1e-300)
+        n = (points[:, None, :] - closest) / d_safe[:, :, None]
+        g = np.asarray(sign)[..., None] * n
+        if order < 2:
+            return [sign * d, g, None]
+        u = self.p2[edge] - self.p1[edge]
+        t = np.sum((closest - self.p1[edge]) * u, axis=2) / np.maximum(
+            np.sum(u ** 2, axis=2), 1e-300)
+        vertex = np.logical_or(t <= 1e-12, t >= 1. - 1e-12)
+        d_inv = np.where(vertex, 1. / d_safe, 0.) * sign
+        h = (np.eye(2) - n[:, :, :, None] * n[:, :, None, :]) * d_inv[
+            :, :, None, None]
+        return [sign * d, g, h]
+
+    def _groups(self, points, order):
+        """ returns the (ids, [d, g, h]) of the packed obstacle types """
+        groups = []
+        if self.circle_ids.size:
+            groups.append((self.circle_ids, self._circles(points, order)))
+        if self.box_ids.size:
+            groups.append((self.box_ids, self._boxes(points, order)))
+        if self.owner_ids.size:
+            groups.append((self.owner_ids, self._segments(points, order)))
+        return groups
+
+    def distances(self, points, order=0):
+        """
+        Returns [D, G, H] the signed distances (N, K), gradients (N, K, 2)
+        and hessians (N, K, 2, 2) to all the K obstacles, the entries
+        above order are None. Obstacles that are not packed are
+        evaluated point by point.
+
+        Parameters
+        ----------
+            points : numpy array (N, 2)
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        N, K = points.shape[0], self.nb_obstacles
+        D = np.zeros((N, K))
+        G = np.zeros((N, K, 2)) if order >= 1 else None
+        H = np.zeros((N, K, 2, 2)) if order >= 2 else None
+        for ids, [d, g, h] in self._groups(points, order):
+            D[:, ids] = d
+            if order >= 1:
+                G[:, ids] = g
+            if order >= 2:
+                H[:, ids] = h
+        for i in self.other_ids:
+            obstacle = self._obstacles[i]
+            for n, p in enumerate(points):
+                D[n, i] = obstacle.dist_from_border(p)
+                if order >= 1:
+                    G[n, i] = obstacle.dist_gradient(p)
+                if order >= 2:
+                    H[n, i] = obstacle.dist_hessian(p)
+        return [D, G, H]
+
+    def min_dist(self, points, with_gradient=False):
+        """
+        Returns [distances, obstacle ids] or
+        [distances, obstacle ids, gradients] when with_gradient is set
+
+        Parameters
+        ----------
+            points : numpy array (N, 2)
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        N = points.shape[0]
+        rows = np.arange(N)
+        D = np.full((N, max(self.nb_obstacles, 1)), np.inf)
+        groups = self._groups(points, 1 if with_gradient else 0)
+        for ids, [d, g, h] in groups:
+            D[:, ids] = d
+        for i in self.other_ids:
+            D[:, i] = [self._obstacles[i].dist_from_border(p)
+                       for p in points]
+
+        if not self.nb_obstacles:
+            return [D[:, 0], np.full(N, -1, dtype=int)] + (
+                [np.zeros((N, 2))] if with_gradient else [])
+
+        i_m = np.argmin(D, axis=1)
+        d_m = D[rows, i_m]
+        if not with_gradient:
+            return [d_m, i_m]
+
+        g_m = np.zeros((N, 2))
+        for ids, [d, g, h] in groups:
+            local = np.full(self.nb_obstacles, -1, dtype=int)
+            local[ids] = np.arange(ids.size)
+            k = local[i_m]
+            in_group = k >= 0
+            g_m[in_group] = g[rows[in_group], k[in_group]]
+        for i in self.other_ids:
+            for n in np.flatnonzero(i_m == i):
+                g_m[n] = self._obstacles[i].dist_gradient(points[n])
+        return [d_m, i_m, g_m]
+
+
+class ObstacleGridIndex:
+    """
+        Spatial index of obstacles based on a uniform grid of buckets.
+
+        Each obstacle is stored in all the cells overlapped by its bounding
+        box. Nearest obstacle queries visit the cells in rings of increasing
+        size around the query point and stop when the ring is further than
+        the best distance found (branch and bound). The signed distance of
+        an obstacle is only evaluated when the distance to its bounding box
+        is smaller than the best distance.
+
+        Obstacles can be inserted and removed incrementally.
+    """
+
+    def __init__(self, cell_size=.1):
+        self._cell_size = cell_size
+        self._cells = {}
+        self._boxes = {}
+        self._lower_cell = None
+        self._upper_cell = None
+
+    def size(self):
+        return len(self._boxes)
+
+    def cell(self, p):
+        """ returns the integer coordinates of the cell containing p """
+        return tuple(np.floor(np.asarray(p) / self._cell_size).astype(int))
+
+    def _covered_cells(self, lower, upper):
+        l_cell = self.cell(lower)
+        u_cell = self.cell(upper)
+        for i in range(l_cell[0], u_cell[0] + 1):
+            for j in range(l_cell[1], u_cell[1] + 1):
+                yield (i, j)
+
+    def insert(self, obstacle):
+        [lower, upper] = obstacle.bounding_box()
+        lower, upper = tuple(map(float, lower)), tuple(map(float, upper))
+        self._boxes[id(obstacle)] = (obstacle, lower, upper)
+        for c in self._covered_cells(lower, upper):
+            self._cells.setdefault(c, []).append(obstacle)
+        l_cell, u_cell = self.cell(lower), self.cell(upper)
+        if self._lower_cell is None:
+            self._lower_cell, self._upper_cell = l_cell, u_cell
+        else:
+            self._lower_cell = tuple(np.minimum(self._lower_cell, l_cell))
+            self._upper_cell = tuple(np.maximum(self._upper_cell, u_cell))
+
+    def remove(self, obstacle):
+        (obstacle, lower, upper) = self._boxes.pop(id(obstacle))
+        for c in self._covered_cells(lower, upper):
+            bucket = self._cells[c]
+            bucket[:] = [o for o in bucket if o is not obstacle]
+            if not bucket:
+                del self._cells[c]
+
+    def _ring(self, c, k):
+        """ cells at chebyshev distance k from c """
+        if k == 0:
+            yield c
+            return
+        for i in range(-k, k + 1):
+            yield (c[0] + i, c[1] - k)
+            yield (c[0] + i, c[1] + k)
+        for j in range(-k + 1, k):
+            yield (c[0] - k, c[1] + j)
+            yield (c[0] + k, c[1] + j)
+
+    def _lower_bound(self, p, lower, upper):
+        """ lower bound of the signed distance of a shape inside the box
+            when p is inside the box, the distance to the border is at
+            most half the smallest side """
+        dx = max(lower[0] - p[0], p[0] - upper[0], 0.)
+        dy = max(lower[1] - p[1], p[1] - upper[1], 0.)
+        if dx == 0. and dy == 0.:
+            return -.5 * min(upper[0] - lower[0], upper[1] - lower[1])
+        return math.sqrt(dx * dx + dy * dy)
+
+    def nearest(self, p):
+        """ returns [distance, obstacle] of the closest obstacle,
+            [inf, None] if the index is empty """
+        best_d, best_o = np.inf, None
+        if not self._boxes:
+            return [best_d, best_o]
+        c = self.cell(p)
+        x = tuple(map(float, p))
+        max_ring = max(np.max(np.array(c) - self._lower_cell),
+                       np.max(np.array(self._upper_cell) - c))
+        seen = set()
+        for k in range(max(max_ring, 0) + 1):
+            if k > 0 and (k - 1) * self._cell_size > best_d:
+                break
+            for cell in self._ring(c, k):
+                for o in self._cells.get(cell, ()):
+                    if id(o) in seen:
+                        continue
+                    seen.add(id(o))
+                    (o, lower, upper) = self._boxes[id(o)]
+                    if self._lower_bound(x, lower, upper) >= best_d:
+                        continue
+                    d = o.dist_from_border(p)
+                    if d < best_d:
+                        best_d, best_o = d, o
+        return [best_d, best_o]
+
+    def in_collision(self, p):
+        """ only the obstacles whose bounding box contains p are checked """
+        for o in self._cells.get(self.cell(p), ()):
+            (o, lower, upper) = self._boxes[id(o)]
+            if (p[0] < lower[0] or p[0] > upper[0] or
+                    p[1] < lower[1] or p[1] > upper[1]):
+                continue
+            if o.dist_from_border(p) < 0.:
+                return True
+        return False
+
+
 class Workspace:
     """
        Contains obstacles.
+
+       The distance queries are evaluated on arrays of obstacles
+       (see ObstacleArrays), which are rebuilt when the list
+       of obstacles or their parameters change. For large numbers
+       of obstacles an optional spatial index prunes the obstacles
+       far from the query point (see build_spatial_index).
     """
 
     def __init__(self, box=EnvBox()):
         self.box = box
         self.obstacles = []
+        self._arrays = None
+        self._arrays_key = None
+        self._index = None
+        self._index_key = None
+
+    def build_spatial_index(self, cell_size=None):
+        """
+        Indexes the obstacles in a grid of buckets (see ObstacleGridIndex),
+        the cell size defaults to a 20th of the workspace box.
+        """
+        if cell_size is None:
+            cell_size = np.max(self.box.dim) / 20.
+        self._index = ObstacleGridIndex(cell_size)
+        self._positions = {}
+        for i, o in enumerate(self.obstacles):
+            self._index.insert(o)
+            self._positions[id(o)] = i
+        self._index_key = ObstacleArrays.key(self.obstacles)
+
+    def spatial_index(self):
+        """ returns the spatial index, rebuilt if the obstacles were
+            modified without add_obstacle or remove_obstacle
+            (see ObstacleArrays.key) """
+        if self._index is not None and not self._index_is_valid():
+            self.build_spatial_index(self._index._cell_size)
+        return self._index
+
+    def _index_is_valid(self):
+        return self._index_key == ObstacleArrays.key(self.obstacles)
+
+    def add_obstacle(self, obstacle):
+        valid = self._index is not None and self._index_is_valid()
+        self.obstacles.append(obstacle)
+        if valid:
+            self._index.insert(obstacle)
+            self._positions[id(obstacle)] = len(self.obstacles) - 1
+            self._index_key = ObstacleArrays.key(self.obstacles)
+
+    def remove_obstacle(self, obstacle):
+        valid = self._index is not None and self._index_is_valid()
+        self.obstacles.remove(obstacle)
+        if valid:
+            self._index.remove(obstacle)
+            self._positions = dict(
+                (id(o), i) for i, o in enumerate(self.obstacles))
+            self._index_key = ObstacleArrays.key(self.obstacles)
 
     def in_collision(self, pt):
+        if self.spatial_index() is not None:
+            return self._index.in_collision(pt)
         for obst in self.obstacles:
             if obst.dist_from_border(pt) < 0.:
                 return True
         return False
 
+    def obstacle_arrays(self):
+        """ returns the obstacles packed by type """
+        key = ObstacleArrays.key(self.obstacles)
+        if self._arrays is None or self._arrays_key != key:
+            self._arrays = ObstacleArrays(self.obstacles)
+            self._arrays_key = key
+        return self._arrays
+
     def min_dist(self, pt):
+        """
+        Returns [distance, obstacle id] of the closest obstacle
+
+        pt : numpy array of shape (2, ), (N, 2) or meshgrid data (2, n, m)
+        """
+        if pt.shape == (2,) and self.spatial_index() is not None:
+            [d_m, obstacle] = self._index.nearest(pt)
+            return [d_m, self._positions.get(id(obstacle), -1)]
         if pt.shape == (2,):
-            d_m = float("inf")
-            i_m = -1
-        else:
-            """ Here we declare special variable for element wise querry """
-            shape = (pt.shape[1], pt.shape[2])
-            d_m = np.full(shape, np.inf)
-            i_m = np.full(shape, -1)
+            [d_m, i_m] = self.obstacle_arrays().min_dist(pt[None, :])
+            return [d_m[0], i_m[0]]
+        if pt.ndim == 2:
+            return self.min_dist_batch(pt)
+        shape = (pt.shape[1], pt.shape[2])
+        [d_m, i_m] = self.min_dist_batch(pt.reshape(2, -1).T)
+        return [d_m.reshape(shape), i_m.reshape(shape)]
+
+    def min_dist_batch(self, points):
+        """
+        Returns [distances, obstacle ids] for an (N, 2) array of points
+        """
+        return self.obstacle_arrays().min_dist(points)
 
-        for i, obst in enumerate(self.obstacles):
-            d = obst.dist_from_border(pt)
-            closer_to_i = d < d_m
-            d_m = np.where(closer_to_i, d, d_m)
-            i_m = np.where(closer_to_i, i, i_m)
+    def min_dist_gradient_batch(self, points):
+        """
+        Returns [distances, obstacle ids, gradients]
+        for an (N, 2) array of points, the gradients are (N, 2)
 
-        return [d_m, i_m]
+        Warning: this gradient is ill defined
+            it has a kink when two objects are at the same distance
+        """
+        return self.obstacle_arrays().min_dist(points, with_gradient=True)
 
     def min_dist_gradient(self, pt):
         """ Warning: this gradient is ill defined
@@ -977,15 +1851,15 @@ class Workspace:
 
     def add_circle(self, origin=None, radius=None):
         if origin is None and radius is None:
-            self.obstacles.append(Circle())
+            self.add_obstacle(Circle())
         else:
-            self.obstacles.append(Circle(origin, radius))
+            self.add_obstacle(Circle(origin, radius))
 
     def add_segment(self, origin=None, length=None):
         if origin is None and length is None:
-            self.obstacles.append(Segment())
+            self.add_obstacle(Segment())
         else:
-            self.obstacles.append(Segment(origin, length))
+            self.add_obstacle(Segment(origin, length=length))
 
     def all_points(self):
         points = []
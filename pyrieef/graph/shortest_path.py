@@ -17,14 +17,30 @@
 #
 #                                        Jim Mainprice on Sunday June 13 2018
 
-from scipy.sparse import csr_matrix
+from scipy.sparse import csr_matrix, issparse
 import scipy.sparse.csgraph as csgraph
 import numpy as np
+import heapq
+import hashlib
+from collections import OrderedDict
 
 SQRT2 = 1.4142135623730951
 
+# (d_i, d_j, length) of the steps between 8-connected grid cells
+GRID_STEPS = [(i, j, SQRT2 if i and j else 1.)
+              for i in (-1, 0, 1) for j in (-1, 0, 1) if i or j]
+
+
+def min_cost(costmap):
+    """ smallest finite cost of the costmap clipped at zero,
+        zero when no cost is finite """
+    costs = costmap[np.isfinite(costmap)]
+    return max(float(costs.min()), 0.) if costs.size else 0.
+
 
 def check_symmetric(a, tol=1e-8):
+    if issparse(a):
+        return abs(a - a.T).max() <= tol
     return np.allclose(a, a.T, atol=tol)
 
 
@@ -32,8 +48,28 @@ def symmetrize(a):
     return a + a.T - np.diag(a.diagonal())
 
 
+def sparse_graph(graph):
+    """ the graph can either be a dense matrix, where 0 entries
+        are not edges, or already in a sparse format """
+    if issparse(graph):
+        return graph
+    return csgraph.csgraph_from_dense(graph)
+
+
+def predecessors_path(predecessors, source_id, target_id):
+    """ Returns the array of graph ids from target to source by
+        unrolling the predecessors (as returned by scipy.csgraph) """
+    path = [target_id]
+    while path[-1] != source_id:
+        node = predecessors[path[-1]]
+        if node < 0:
+            raise ValueError("target is not reachable")
+        path.append(node)
+    return np.array(path)
+
+
 def shortest_paths(graph_dense):
-    graph_sparse = csgraph.csgraph_from_dense(graph_dense)
+    graph_sparse = sparse_graph(graph_dense)
     # print graph_sparse
     # print graph_sparse.shape
     dist_matrix, predecessors = csgraph.shortest_path(
@@ -44,6 +80,234 @@ def shortest_paths(graph_dense):
     return predecessors
 
 
+def astar(costmap, source, target, average_cost=False, integral_cost=False):
+    """
+        A* search on the 8-connected grid of a 2D costmap
+
+        The edge costs are the same as in CostmapToSparseGraph (cost of
+        the entered cell, average of the two cells, or cost of the entered
+        cell times the length of the step) and as there, edges of zero
+        cost are not edges. No graph is built and the search stops when
+        the target is reached. This is a python loop, on large maps
+        CostmapToSparseGraph.astar_on_map is faster. The heuristic is
+        the minimum cost times the chebyshev (or octile) distance to the
+        target, which is consistent, so the returned path is optimal.
+
+            costmap : M x N matrix of non-negative costs
+            source, target : coordinates (i, j) on the costmap
+
+        Returns the path from source to target as an (L, 2) array.
+    """
+    m, n = costmap.shape
+    costs = costmap.ravel().tolist()
+    c_min = max(float(np.min(costmap)), 0.)
+    s_id = int(source[0]) * n + int(source[1])
+    t_id = int(target[0]) * n + int(target[1])
+    t_i, t_j = divmod(t_id, n)
+
+    def heuristic(i, j):
+        d_i, d_j = abs(i - t_i), abs(j - t_j)
+        if integral_cost:
+            return c_min * (max(d_i, d_j) + (SQRT2 - 1.) * min(d_i, d_j))
+        return c_min * max(d_i, d_j)
+
+    # ties are broken towards the target (smallest heuristic)
+    g = [np.inf] * (m * n)
+    g[s_id] = 0.
+    predecessors = [-1] * (m * n)
+    predecessors[s_id] = s_id
+    closed = bytearray(m * n)
+    h_s = heuristic(*divmod(s_id, n))
+    heap = [(h_s, h_s, s_id)]
+    while heap:
+        _, _, c_id = heapq.heappop(heap)
+        if c_id == t_id:
+            break
+        if closed[c_id]:
+            continue
+        closed[c_id] = 1
+        c_i, c_j = divmod(c_id, n)
+        g_c = g[c_id]
+        for d_i, d_j, length in GRID_STEPS:
+            n_i, n_j = c_i + d_i, c_j + d_j
+            if n_i < 0 or n_i >= m or n_j < 0 or n_j >= n:
+                continue
+            n_id = n_i * n + n_j
+            if closed[n_id]:
+                continue
+            if average_cost:
+                cost = .5 * (costs[c_id] + costs[n_id])
+            elif integral_cost:
+                cost = length * costs[n_id]
+            else:
+                cost = costs[n_id]
+            if cost == 0.:
+                continue
+            g_n = g_c + cost
+            if g_n < g[n_id]:
+                g[n_id] = g_n
+                predecessors[n_id] = c_id
+                h_n = heuristic(n_i, n_j)
+                heapq.heappush(heap, (g_n + h_n, h_n, n_id))
+    if predecessors[t_id] < 0:
+        raise ValueError("target is not reachable")
+    path = [t_id]
+    while path[-1] != s_id:
+        path.append(predecessors[path[-1]])
+    path = np.array(path[::-1])
+    return np.stack([path // n, path % n], axis=1)
+
+
+class LifelongPlanningAStar:
+    """
+        Lifelong Planning A* (Koenig, Likhachev and Furcy, 2004) on the
+        8-connected grid of a 2D costmap for a fixed source and target
+
+        The edge costs and the heuristic are the same as for astar.
+        When cells of the costmap change (update_costs), only the
+        vertices whose shortest path is affected are expanded again
+        by the next search, instead of searching from scratch.
+
+        nb_expansions counts the vertices expanded by all searches.
+    """
+
+    def __init__(self, costmap, source, target,
+                 average_cost=False, integral_cost=False):
+        self.average_cost = average_cost
+        self.integral_cost = integral_cost
+        self._m, self._n = costmap.shape
+        self._costs = np.asarray(costmap, dtype=float).ravel().tolist()
+        self._c_min = max(min(self._costs), 0.)
+        self._s_id = int(source[0]) * self._n + int(source[1])
+        self._t_id = int(target[0]) * self._n + int(target[1])
+        self._t_i, self._t_j = divmod(self._t_id, self._n)
+        self._g = [np.inf] * len(self._costs)
+        self._rhs = [np.inf] * len(self._costs)
+        self._rhs[self._s_id] = 0.
+        self._keys = {}  # vertices in the queue and their keys
+        self._heap = []
+        self._push(self._s_id)
+        self.nb_expansions = 0
+
+    def _neighbors(self, u):
+        """ returns the graph ids of the neighbors of u
+            and the length of the steps """
+        i, j = divmod(u, self._n)
+        neighbors = []
+        for d_i, d_j, length in GRID_STEPS:
+            n_i, n_j = i + d_i, j + d_j
+            if 0 <= n_i < self._m and 0 <= n_j < self._n:
+                neighbors.append((n_i * self._n + n_j, length))
+        return neighbors
+
+    def _cost(self, u, v, length):
+        """ cost of the edge from u to v, infinite when
+            there is no edge (zero cost) """
+        if self.average_cost:
+            cost = .5 * (self._costs[u] + self._costs[v])
+        elif self.integral_cost:
+            cost = length * self._costs[v]
+        else:
+            cost = self._costs[v]
+        return cost if cost != 0. else np.inf
+
+    def _heuristic(self, u):
+        i, j = divmod(u, self._n)
+        d_i, d_j = abs(i - self._t_i), abs(j - self._t_j)
+        if self.integral_cost:
+            return self._c_min * (
+                max(d_i, d_j) + (SQRT2 - 1.) * min(d_i, d_j))
+        return self._c_min * max(d_i, d_j)
+
+    def _key(self, u):
+        k = min(self._g[u], self._rhs[u])
+        return (k + self._heuristic(u), k)
+
+    def _push(self, u):
+        key = self._key(u)
+        self._keys[u] = key
+        heapq.heappush(self._heap, (key, u))
+
+    def _top_key(self):
+        """ removes the outdated entries of the heap """
+        while self._heap and (
+                self._keys.get(self._heap[0][1]) != self._heap[0][0]):
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else (np.inf, np.inf)
+
+    def _update_vertex(self, u):
+        if u != self._s_id:
+            self._rhs[u] = min(self._g[v] + self._cost(v, u, length)
+                               for v, length in self._neighbors(u))
+        self._keys.pop(u, None)
+        if self._g[u] != self._rhs[u]:
+            self._push(u)
+
+    def _compute_shortest_path(self):
+        t_id = self._t_id
+        while (self._top_key() < self._key(t_id) or
+               self._rhs[t_id] != self._g[t_id]):
+            if not self._heap:
+                break
+            _, u = heapq.heappop(self._heap)
+            del self._keys[u]
+            self.nb_expansions += 1
+            if self._g[u] > self._rhs[u]:
+                self._g[u] = self._rhs[u]
+            else:
+                self._g[u] = np.inf
+                self._update_vertex(u)
+            for v, _ in self._neighbors(u):
+                self._update_vertex(v)
+
+    def update_costs(self, cells, costs):
+        """ Sets the costs of the cells (i, j) of the costmap,
+            the search is repaired by the next call to shortest_path """
+        affected = set()
+        for (i, j), cost in zip(cells, costs):
+            u = int(i) * self._n + int(j)
+            self._costs[u] = float(cost)
+            affected.add(u)
+            if self.average_cost:
+                affected.update(v for v, _ in self._neighbors(u))
+        c_min = max(min([self._c_min] + [float(c) for c in costs]), 0.)
+        if c_min < self._c_min:
+            # the heuristic has to remain a lower bound
+            self._c_min = c_min
+            self._keys = {u: self._key(u) for u in self._keys}
+            self._heap = [(key, u) for u, key in self._keys.items()]
+            heapq.heapify(self._heap)
+        for u in affected:
+            self._update_vertex(u)
+
+    def update_costmap(self, costmap):
+        """ Updates the cells that differ from the current costmap """
+        previous = np.array(self._costs).reshape(self._m, self._n)
+        cells = np.argwhere(costmap != previous)
+        self.update_costs(cells, costmap[cells[:, 0], cells[:, 1]])
+
+    def distance(self):
+        """ cost of the shortest path from source to target """
+        self._compute_shortest_path()
+        return self._g[self._t_id]
+
+    def shortest_path(self):
+        """ Returns the path from source to target as an (L, 2) array """
+        if self.distance() == np.inf:
+            raise ValueError("target is not reachable")
+        path = [self._t_id]
+        visited = set(path)
+        while path[-1] != self._s_id:
+            u = path[-1]
+            v, _ = min(
+                (e for e in self._neighbors(u) if e[0] not in visited),
+                key=lambda e: self._g[e[0]] + self._cost(e[0], u, e[1]))
+            path.append(v)
+            visited.add(v)
+        path = np.array(path[::-1])
+        return np.stack([path // self._n, path % self._n], axis=1)
+
+
 class CostmapToSparseGraph:
     """Class that convert image to sparse graph representation
         TODO write a test for and decide weather it should
@@ -55,8 +319,9 @@ class CostmapToSparseGraph:
         self.average_cost = average_cost
         self.integral_cost = False
         self.init = False
-        self._graph_dense = None
-        self._edges = []
+        self._graph = None
+        self._edges = None
+        self._nonzero = None
 
     def graph_id(self, i, j):
         return i + j * self.costmap.shape[0]
@@ -66,6 +331,12 @@ class CostmapToSparseGraph:
         i = g_id % self.costmap.shape[0]
         return (i, j)
 
+    def costmap_path(self, g_ids):
+        """ Converts an array of graph ids to a list of
+            costmap coordinates (i, j) """
+        i, j = self.costmap_id(np.asarray(g_ids))
+        return list(zip(i, j))
+
     def is_in_costmap(self, i, j):
         """ Returns true if the node coord is in the costmap """
         return (
@@ -77,7 +348,7 @@ class CostmapToSparseGraph:
             from n1 to n2"""
         n1_id = self.graph_id(n1_i, n1_j)
         n2_id = self.graph_id(n2_i, n2_j)
-        return self._graph_dense[n1_id, n2_id]
+        return self._graph[n1_id, n2_id]
 
     def edge_cost(self, c_i, c_j, n_i, n_j):
         cost_c = self.costmap[c_i, c_j]
@@ -103,6 +374,36 @@ class CostmapToSparseGraph:
         coord[7] = (i - 1, j + 1)
         return coord
 
+    def grid_edges(self):
+        """ Returns the (source, target) graph ids of all the
+            edges of the 8-connected grid sorted by source and target,
+            which is the order of the data of the sparse graph """
+        m, n = self.costmap.shape
+        ids = np.arange(m * n)
+        i, j = ids % m, ids // m
+        sources, targets = [], []
+        for (n_i, n_j) in self.neiborghs(i, j):
+            valid = (n_i >= 0) & (n_i < m) & (n_j >= 0) & (n_j < n)
+            sources.append(ids[valid])
+            targets.append(self.graph_id(n_i[valid], n_j[valid]))
+        sources = np.concatenate(sources)
+        targets = np.concatenate(targets)
+        order = np.lexsort((targets, sources))
+        return sources[order], targets[order]
+
+    def edge_costs(self, costmap):
+        """ Vectorized version of edge_cost for all edges """
+        costs = costmap.flatten(order='F')  # graph_id = i + j * M
+        sources, targets = self._edges
+        if self.average_cost:
+            return 0.5 * (costs[sources] + costs[targets])
+        if self.integral_cost:
+            m = costmap.shape[0]
+            diagonal = ((sources % m) != (targets % m)) & (
+                (sources // m) != (targets // m))
+            return np.where(diagonal, SQRT2, 1.) * costs[targets]
+        return costs[targets]
+
     def convert(self):
         """ Converts a costmap to a compressed sparse graph
 
@@ -110,36 +411,42 @@ class CostmapToSparseGraph:
                    gives the cost of a certain node
             node_map_coord  = (i, j)
             node_graph_id   = i + j * M
+
+            The graph is built directly in CSR format,
+            nodes have at most 8 neighbors. As in the dense
+            representation, edges of zero cost are not edges.
         """
+        self._edges = self.grid_edges()
+        self._graph = self._sparse_graph(self.edge_costs(self.costmap))
+        return self._graph
+
+    def _sparse_graph(self, costs):
+        """ CSR graph of the grid edges with non zero costs """
         nb_nodes = self.costmap.shape[0] * self.costmap.shape[1]
-        self._graph_dense = np.zeros((nb_nodes, nb_nodes))
-        self._edges = []
-        for (c_i, c_j), c_ij in np.ndenumerate(self.costmap):
-            c_node = self.graph_id(c_i, c_j)
-            for (n_i, n_j) in self.neiborghs(c_i, c_j):
-                if self.is_in_costmap(n_i, n_j):
-                    # get the neighbor graph id
-                    # compute edge cost and store it in graph
-                    n_node = self.graph_id(n_i, n_j)
-                    self._graph_dense[c_node, n_node] = self.edge_cost(
-                        c_i, c_j, n_i, n_j)
-                    self._edges.append([c_node, n_node])
-        return self._graph_dense
+        sources, targets = self._edges
+        self._nonzero = costs != 0
+        indptr = np.zeros(nb_nodes + 1, dtype=int)
+        indptr[1:] = np.cumsum(np.bincount(
+            sources[self._nonzero], minlength=nb_nodes))
+        return csr_matrix(
+            (costs[self._nonzero], targets[self._nonzero], indptr),
+            shape=(nb_nodes, nb_nodes))
 
     def update_graph(self, costmap):
-        """ updates the graph fast """
+        """ updates the graph fast, only the edge costs
+            are recomputed, the structure of the graph is kept
+            unless the set of zero cost edges changes """
         assert costmap.shape == self.costmap.shape
-        assert self._graph_dense is not None
-        assert self._edges is not []
+        assert self._graph is not None
         self.costmap = costmap
-        nb_nodes = self.costmap.shape[0] * self.costmap.shape[1]
-        self._graph_dense = np.zeros((nb_nodes, nb_nodes))
-        for e in self._edges:
-            node_0_i, node_0_j = self.costmap_id(e[0])
-            node_1_i, node_1_j = self.costmap_id(e[1])
-            self._graph_dense[e[0], e[1]] = self.edge_cost(
-                node_0_i, node_0_j,
-                node_1_i, node_1_j)
+        self._graph_key = None
+        self._reduced_key = None
+        costs = self.edge_costs(costmap)
+        nonzero = costs != 0
+        if np.array_equal(nonzero, self._nonzero):
+            self._graph.data[:] = costs[nonzero]
+        else:
+            self._graph = self._sparse_graph(costs)
 
     def shortest_path(self, predecessors, s_i, s_j, t_i, t_j):
         """ Performs a shortest path querry and returns
@@ -150,14 +457,8 @@ class CostmapToSparseGraph:
         """
         source_id = self.graph_id(s_i, s_j)
         target_id = self.graph_id(t_i, t_j)
-        path = []
-        path.append((s_i, s_j))
-        while True:
-            source_id = predecessors[target_id, source_id]
-            path.append(self.costmap_id(source_id))
-            if source_id == target_id:
-                break
-        return path
+        return self.costmap_path(predecessors_path(
+            predecessors[target_id], target_id, source_id))
 
     def breadth_first_search(self, graph_dense, s_i, s_j, t_i, t_j):
         """ Performs a shortest path querry and returns
@@ -165,53 +466,40 @@ class CostmapToSparseGraph:
             expressed in costmap coordinates. This method is targeted
             for single querry.
 
-            graph_dense : dense graph retpresentation of the costmap
+            graph_dense : dense or sparse graph retpresentation
+                          of the costmap
         """
         source_id = self.graph_id(s_i, s_j)
         target_id = self.graph_id(t_i, t_j)
-        graph_sparse = csgraph.csgraph_from_dense(graph_dense)
+        graph_sparse = sparse_graph(graph_dense)
         nodes, predecessors = csgraph.breadth_first_order(
             graph_sparse,
             source_id,
             directed=False,
             return_predecessors=True)
-        path = []
-        path.append((t_i, t_j))
-        while True:
-            target_id = predecessors[target_id]
-            path.append(self.costmap_id(target_id))
-            if source_id == target_id:
-                break
-        return path
+        return self.costmap_path(predecessors_path(
+            predecessors, source_id, target_id))
 
     def dijkstra(self, graph_dense, s_i, s_j, t_i, t_j):
         """
             Performs a graph search for source and target
 
-            graph_dense : dense graph retpresentation of the costmap
+            graph_dense : dense or sparse graph retpresentation
+                          of the costmap
             s_i, s_j : source coordinate on the costmap
             t_i, t_j : target coordinate on the costmap
         """
         source_id = self.graph_id(s_i, s_j)
         target_id = self.graph_id(t_i, t_j)
-        graph_sparse = csgraph.csgraph_from_dense(graph_dense)
+        graph_sparse = sparse_graph(graph_dense)
         dist_matrix, predecessors = csgraph.dijkstra(
             graph_sparse,
             directed=not self.average_cost,
             return_predecessors=True,
             indices=source_id,
             limit=np.inf)
-        path = []
-        path.append((t_i, t_j))
-        while True:
-            target_id_bkp = target_id
-            target_id = predecessors[target_id]
-            t_i, t_j = self.costmap_id(target_id)
-            s_i, s_j = self.costmap_id(target_id_bkp)
-            path.append((t_i, t_j))
-            if source_id == target_id:
-                break
-        return path
+        return self.costmap_path(predecessors_path(
+            predecessors, source_id, target_id))
 
     def dijkstra_on_map(self, costmap, s_i, s_j, t_i, t_j):
         """
@@ -227,7 +515,7 @@ class CostmapToSparseGraph:
             t_i, t_j : target coordinate on the costmap
         """
         self.update_graph(costmap)
-        return self.dijkstra(self._graph_dense, s_i, s_j, t_i, t_j)
+        return self.dijkstra(self._graph, s_i, s_j, t_i, t_j)
 
     def shortest_path_on_map(self, costmap, s_i, s_j, t_i, t_j):
         """
@@ -236,5 +524,206 @@ class CostmapToSparseGraph:
             querry graph search on a 2D costmap with scipy"""
 
         self.update_graph(costmap)
-        return self.shortest_path(shortest_paths(self._graph_dense),
+        return self.shortest_path(shortest_paths(self._graph),
                                   s_i, s_j, t_i, t_j)
+
+    def heuristic(self, t_i, t_j):
+        """ lower bound of the cost from all nodes to the target,
+            consistent with the edge costs (see astar) """
+        m = self.costmap.shape[0]
+        ids = np.arange(self.costmap.size)
+        d_i, d_j = np.abs(ids % m - t_i), np.abs(ids // m - t_j)
+        c_min = min_cost(self.costmap)
+        if self.integral_cost:
+            return c_min * (np.maximum(d_i, d_j) +
+                            (SQRT2 - 1.) * np.minimum(d_i, d_j))
+        return c_min * np.maximum(d_i, d_j)
+
+    def astar_on_map(self, costmap, s_i, s_j, t_i, t_j):
+        """
+            Performs an A* search for source and target on the costmap
+            with the edge costs of the class options.
+
+            The search is restricted to a window of the costmap around
+            the source and the target. A path of cost U found in the
+            window is optimal when the window contains all the cells v
+            such that c_min * max(chebyshev(s, v), chebyshev(v, t)) <= U,
+            otherwise the search is run again on these cells with U as
+            a limit. In a window, scipy's dijkstra is run on the reduced
+            edge costs w(u, v) - h(u) + h(v) >= 0, where h is the
+            consistent heuristic (see heuristic), which expands the
+            vertices in the A* order and stops at the limit.
+
+            The graph of the full costmap and its reduced costs are
+            only updated when the costmap or the target change.
+
+            Returns the path from source to target as an (L, 2) array.
+        """
+        m, n = costmap.shape
+        margin = max(8, max(abs(s_i - t_i), abs(s_j - t_j)) // 4)
+        while True:
+            window = (max(min(s_i, t_i) - margin, 0),
+                      min(max(s_i, t_i) + margin + 1, m),
+                      max(min(s_j, t_j) - margin, 0),
+                      min(max(s_j, t_j) + margin + 1, n))
+            [cost, path] = self._window_search(
+                costmap, window, s_i, s_j, t_i, t_j, np.inf)
+            if cost < np.inf:
+                break
+            if window == (0, m, 0, n):
+                raise ValueError("target is not reachable")
+            margin *= 2
+        c_min = min_cost(costmap)
+        if c_min == 0.:
+            bound = (0, m, 0, n)
+        else:
+            r = int(np.floor(cost / c_min))
+            bound = (max(max(s_i, t_i) - r, 0),
+                     min(min(s_i, t_i) + r + 1, m),
+                     max(max(s_j, t_j) - r, 0),
+                     min(min(s_j, t_j) + r + 1, n))
+        if (window[0] > bound[0] or window[1] < bound[1] or
+                window[2] > bound[2] or window[3] < bound[3]):
+            # the paths cheaper than cost are in the bound
+            [cost, bound_path] = self._window_search(
+                costmap, bound, s_i, s_j, t_i, t_j, cost)
+            if cost < np.inf:
+                path = bound_path
+        return path
+
+    def _window_search(self, costmap, window, s_i, s_j, t_i, t_j, limit):
+        """ A* search restricted to the window (i_0, i_1, j_0, j_1) of
+            the costmap, returns [cost, path], the cost is infinite
+            when there is no path of cost smaller than limit """
+        (i_0, i_1, j_0, j_1) = window
+        if window == (0, costmap.shape[0], 0, costmap.shape[1]):
+            converter = self
+            [reduced, h] = self._reduced_graph(costmap, t_i, t_j)
+        else:
+            converter = CostmapToSparseGraph(
+                costmap[i_0:i_1, j_0:j_1], self.average_cost)
+            converter.integral_cost = self.integral_cost
+            converter.convert()
+            [reduced, h] = converter._reduced_graph(
+                converter.costmap, t_i - i_0, t_j - j_0)
+        source_id = converter.graph_id(s_i - i_0, s_j - j_0)
+        target_id = converter.graph_id(t_i - i_0, t_j - j_0)
+        distances, predecessors = csgraph.dijkstra(
+            reduced,
+            directed=True,
+            return_predecessors=True,
+            indices=source_id,
+            limit=limit - h[source_id] + 1e-9 * abs(limit))
+        if not np.isfinite(distances[target_id]):
+            return [np.inf, None]
+        i, j = converter.costmap_id(
+            predecessors_path(predecessors, source_id, target_id)[::-1])
+        path = np.stack([i + i_0, j + j_0], axis=1)
+        return [distances[target_id] + h[source_id], path]
+
+    def _reduced_graph(self, costmap, t_i, t_j):
+        """ returns the graph with the reduced edge costs for the
+            target and the heuristic, kept until the costmap or the
+            target change """
+        key = hashlib.sha1(np.ascontiguousarray(costmap, dtype=float))
+        key = (key.hexdigest(), t_i, t_j)
+        if getattr(self, "_reduced_key", None) != key:
+            if self._graph is None:
+                self.costmap = costmap
+                self.convert()
+            elif key[0] != getattr(self, "_graph_key", None):
+                self.update_graph(costmap)
+            h = self.heuristic(t_i, t_j)
+            graph = self._graph
+            data = graph.data - np.repeat(h, np.diff(graph.indptr))
+            data += h[graph.indices]
+            self._reduced = [csr_matrix(
+                (np.maximum(data, 0., out=data), graph.indices,
+                 graph.indptr), shape=graph.shape), h]
+            self._reduced_key = key
+            self._graph_key = key[0]
+        return self._reduced
+
+
+class CachedShortestPaths:
+    """
+        Multi-query shortest paths on costmaps
+
+        Keeps the single source distances and predecessors of the last
+        max_size (costmap, source) pairs in a least recently used cache,
+        queries from a cached source are answered by backtracking only.
+        Several sources can be computed in one dijkstra call (compute).
+        The graph of the converter is only updated when the costmap
+        changes. The edge costs are given by the converter options.
+
+        hits and misses count the sources found in the cache.
+    """
+
+    def __init__(self, converter, max_size=32):
+        self._converter = converter
+        self._max_size = max_size
+        self._cache = OrderedDict()
+        self._costmap_key = None
+        self.hits = 0
+        self.misses = 0
+        if converter._graph is None:
+            converter.convert()
+
+    @staticmethod
+    def costmap_key(costmap):
+        return hashlib.sha1(
+            np.ascontiguousarray(costmap, dtype=float)).hexdigest()
+
+    def _set_costmap(self, costmap):
+        key = self.costmap_key(costmap)
+        if key != self._costmap_key or (
+                self._converter.costmap is not costmap):
+            self._converter.update_graph(costmap)
+            self._costmap_key = key
+        return key
+
+    def compute(self, costmap, sources):
+        """ Returns the [distances, predecessors] arrays of
+            all sources (i, j), the missing ones are computed
+            in a single dijkstra call """
+        key = self._set_costmap(costmap)
+        ids = [self._converter.graph_id(i, j) for i, j in sources]
+        missing = []
+        for g_id in ids:
+            if (key, g_id) in self._cache:
+                self.hits += 1
+                self._cache.move_to_end((key, g_id))
+            elif g_id not in missing:
+                self.misses += 1
+                missing.append(g_id)
+        if missing:
+            distances, predecessors = csgraph.dijkstra(
+                self._converter._graph,
+                directed=not self._converter.average_cost,
+                return_predecessors=True,
+                indices=missing)
+            for k, g_id in enumerate(missing):
+                self._cache[key, g_id] = [distances[k], predecessors[k]]
+        entries = [self._cache[key, g_id] for g_id in ids]
+        while len(self._cache) > self._max_size:
+            self._cache.popitem(last=False)
+        return entries
+
+    def distance_on_map(self, costmap, s_i, s_j, t_i, t_j):
+        distances, _ = self.compute(costmap, [(s_i, s_j)])[0]
+        return distances[self._converter.graph_id(t_i, t_j)]
+
+    def dijkstra_on_map(self, costmap, s_i, s_j, t_i, t_j):
+        """ Same as CostmapToSparseGraph.dijkstra_on_map,
+            the path goes from target to source """
+        _, predecessors = self.compute(costmap, [(s_i, s_j)])[0]
+        return self._converter.costmap_path(predecessors_path(
+            predecessors,
+            self._converter.graph_id(s_i, s_j),
+            self._converter.graph_id(t_i, t_j)))
+
+    def clear(self):
+        self._cache.clear()
+        self._costmap_key = None
+        self.hits = 0
+        self.misses = 0
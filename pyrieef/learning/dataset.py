@@ -28,7 +28,7 @@ from utils import *
 from utils.misc import *
 import numpy as np
 from geometry.workspace import *
-from motion.trajectory import Trajectory
+from motion.trajectory import Trajectory, TrajectoryBatch, trajectory_batch
 
 # TODO write some import test
 
@@ -195,28 +195,30 @@ def load_paths_from_file(filename='paths_1k_demos.hdf5'):
 
 def save_trajectories_to_file(
         trajectories, filename='trajectories_1k_demos.hdf5'):
-    nb_traj = len(trajectories)
-    assert nb_traj > 0
-    length = trajectories[0].x().size
-    trajectories_data = [np.zeros(length)] * nb_traj
-    for i, traj in enumerate(trajectories):
-        trajectories_data[i] = traj.x()
+    """ Saves a list of trajectories or a TrajectoryBatch,
+        the trajectories are stored as the rows of a matrix """
+    if not isinstance(trajectories, TrajectoryBatch):
+        trajectories = trajectory_batch(trajectories)
+    assert len(trajectories) > 0
     data = {}
-    data["n"] = np.array([trajectories[0].n()])
-    data["datasets"] = np.stack(trajectories_data)
+    data["n"] = np.array([trajectories.n()])
+    data["datasets"] = trajectories.x().reshape(len(trajectories), -1)
     write_dictionary_to_file(data, filename=filename)
 
 
-def load_trajectories_from_file(filename='trajectories_1k_small.hdf5'):
-    """ Load data from an hdf5 file """
+def load_trajectories_from_file(filename='trajectories_1k_small.hdf5',
+                                as_batch=False):
+    """ Load data from an hdf5 file, returns a list of trajectories
+        or a TrajectoryBatch when as_batch is set """
     data = dict_to_object(load_dictionary_from_file(filename))
     print((" -- trajectories * n : {}".format(data.n[0])))
     print((" -- trajectories * l : {}".format(len(data.datasets))))
     n = data.n[0]
-    trajectories = [None] * len(data.datasets)
-    for k, trj in enumerate(data.datasets):
-        trajectories[k] = Trajectory(q_init=trj[:n], x=trj)
-    return trajectories
+    batch = TrajectoryBatch(
+        x=data.datasets.reshape(len(data.datasets), -1, n))
+    if as_batch:
+        return batch
+    return [trajectory for trajectory in batch]
 
 
 def get_yaml_options():
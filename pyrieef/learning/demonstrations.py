@@ -26,11 +26,13 @@ from graph.shortest_path import *
 from learning.dataset import *
 from learning.random_environment import *
 from learning.random_paths import *
+from learning.parallel_generation import *
 from utils.misc import *
 from geometry.workspace import *
 from motion.cost_terms import *
 from motion.trajectory import *
 from motion.objective import *
+from optimization.algorithms import newton_optimize_trajectories
 from tqdm import tqdm
 import time
 from utils.options import *
@@ -46,26 +48,34 @@ TRAJ_LENGTH = 20
 DEFAULT_WS_FILE = '1k_small.hdf5'
 
 
-def obsatcle_potential(workspace):
-    sdf = SignedDistanceWorkspaceMap(workspace)
+def obsatcle_potential(workspace, sdf=None):
+    if sdf is None:
+        sdf = SignedDistanceWorkspaceMap(workspace)
     return CostGridPotential2D(sdf, ALPHA, MARGIN, OFFSET)
 
 
-def optimize(path, workspace, costmap, verbose=False):
+def motion_optimization_problem(path, workspace, sdf_temperature=None):
+    """ Returns the optimization problem and the initial trajectory,
+        with sdf_temperature the obstacles are the smooth union
+        of their signed distances (SmoothSignedDistanceWorkspaceMap) """
     T = len(path) - 1
     trajectory = Trajectory(T, 2)
     for i, p in enumerate(path):
         trajectory.configuration(i)[:] = path[i]
 
+    if sdf_temperature is None:
+        sdf = SignedDistanceWorkspaceMap(workspace)
+    else:
+        sdf = SmoothSignedDistanceWorkspaceMap(workspace, sdf_temperature)
     optimizer = MotionOptimization2DCostMap(
         T=T,
         n=2,
         q_init=trajectory.initial_configuration(),
         q_goal=trajectory.final_configuration(),
         box=workspace.box,
-        signed_distance_field=SignedDistanceWorkspaceMap(workspace))
-    optimizer.obstacle_potential = obsatcle_potential(workspace)
-    optimizer.verbose = verbose
+        signed_distance_field=sdf,
+        sdf_temperature=sdf_temperature)
+    optimizer.obstacle_potential = obsatcle_potential(workspace, sdf)
     optimizer.set_scalars(
         obstacle_scalar=1.,
         init_potential_scalar=0.,
@@ -80,6 +90,12 @@ def optimize(path, workspace, costmap, verbose=False):
     optimizer.add_box_limits()
     optimizer.add_attractor(trajectory)
     optimizer.create_objective()
+    return optimizer, trajectory
+
+
+def optimize(path, workspace, costmap, verbose=False):
+    optimizer, trajectory = motion_optimization_problem(path, workspace)
+    optimizer.verbose = verbose
     t_start = time.time()
     # print(optimizer.verbose)
     [dist, traj, gradient, deltas] = optimizer.optimize(
@@ -92,22 +108,43 @@ def optimize(path, workspace, costmap, verbose=False):
     return trajectory
 
 
-def compute_demonstration(
-        workspace, graph, nb_points,
-        show_result, average_cost, verbose, no_linear_interpolation):
+def optimize_batch(paths, workspaces, verbose=False):
+    """ Optimizes the paths in their workspaces all at once,
+        see newton_optimize_trajectories. Returns the trajectories,
+        None when the gradient is too big. """
+    problems = [motion_optimization_problem(path, workspace)
+                for path, workspace in zip(paths, workspaces)]
+    trajectories = [trajectory for optimizer, trajectory in problems]
+    [gradients, iterations] = newton_optimize_trajectories(
+        [optimizer.objective for optimizer, trajectory in problems],
+        trajectories, verbose=verbose, maxiter=MAX_ITERATIONS)
+    gradient_norms = np.linalg.norm(gradients, axis=1)
+    return [None if g > MAX_GRADIENT_NORM else trajectory
+            for g, trajectory in zip(gradient_norms, trajectories)]
+
+
+def sample_interpolated_path(
+        workspace, graph, nb_points, no_linear_interpolation):
+    """ Samples a path on the grid and returns TRAJ_LENGTH configurations
+        interpolated along it, None when no path is found """
     pixel_map = workspace.pixel_map(nb_points)
     path = sample_path(workspace, graph, nb_points, no_linear_interpolation)
     if path is None:
         return None
-    traj = [None] * len(path)
+    traj = pixel_map.grid_to_world(np.array(path))
     trajectory = ContinuousTrajectory(len(path) - 1, 2)
-    for i, p in enumerate(path):
-        traj[i] = pixel_map.grid_to_world(np.array(p))
-        trajectory.configuration(i)[:] = traj[i]
+    trajectory.x()[:traj.size] = traj.ravel()
+    return trajectory.configurations_at_parameters(
+        np.linspace(0, 1, TRAJ_LENGTH))
 
-    interpolated_traj = [None] * TRAJ_LENGTH
-    for i, s in enumerate(np.linspace(0, 1, TRAJ_LENGTH)):
-        interpolated_traj[i] = trajectory.configuration_at_parameter(s)
+
+def compute_demonstration(
+        workspace, graph, nb_points,
+        show_result, average_cost, verbose, no_linear_interpolation):
+    interpolated_traj = sample_interpolated_path(
+        workspace, graph, nb_points, no_linear_interpolation)
+    if interpolated_traj is None:
+        return None
 
     optimized_trajectory = optimize(
         interpolated_traj, workspace, None, verbose)
@@ -126,12 +163,79 @@ def compute_demonstration(
     return optimized_trajectory
 
 
-def generate_one_demonstration(nb_points, demo_id):
+def compute_demonstration_with_retries(
+        workspace, graph, nb_points, show_result=False,
+        average_cost=False, verbose=False):
+    """ Samples paths in the workspace until one is optimized,
+        the first 20 tries do not accept linear interpolations """
+    trajectory = None
+    nb_tries = 0
+    while trajectory is None:
+        nb_tries += 1
+        hard = nb_tries < 20
+        try:
+            trajectory = compute_demonstration(
+                workspace,
+                graph,
+                nb_points=nb_points,
+                show_result=show_result,
+                average_cost=average_cost,
+                verbose=verbose,
+                no_linear_interpolation=hard)
+        except ValueError as e:
+            trajectory = None
+            if verbose:
+                print("Warning : ", e)
+    return trajectory
+
+
+def compute_demonstrations_batch(
+        workspaces, graph, nb_points, verbose=False):
+    """ Computes one demonstration per workspace, the paths sampled in
+        all workspaces are optimized at once (see optimize_batch) and new
+        paths are sampled for the failed ones, the first 20 tries do not
+        accept linear interpolations """
+    trajectories = [None] * len(workspaces)
+    remaining = list(range(len(workspaces)))
+    nb_tries = 0
+    while remaining:
+        nb_tries += 1
+        hard = nb_tries < 20
+        ids, paths = [], []
+        for k in remaining:
+            try:
+                path = sample_interpolated_path(
+                    workspaces[k], graph, nb_points, hard)
+            except ValueError as e:
+                path = None
+                if verbose:
+                    print("Warning : ", e)
+            if path is not None:
+                ids.append(k)
+                paths.append(path)
+        optimized = optimize_batch(
+            paths, [workspaces[k] for k in ids], verbose) if ids else []
+        for k, trajectory in zip(ids, optimized):
+            if trajectory is None:
+                print("Warning: gradient too big !!!")
+                continue
+            collision = collision_check_trajectory(workspaces[k], trajectory)
+            if collision and verbose:
+                print("Warning: has collision !!!")
+                continue
+            trajectories[k] = trajectory
+        remaining = [k for k in remaining if trajectories[k] is None]
+    return trajectories
+
+
+def generate_one_demonstration(nb_points, demo_id, workspaces=None):
+    """ the workspaces are loaded from file when not given """
     grid = np.ones((nb_points, nb_points))
     graph = CostmapToSparseGraph(grid, False)
     graph.convert()
-    workspaces = load_workspaces_from_file(
-        filename="workspaces_" + DEFAULT_WS_FILE)
+    if workspaces is None:
+        workspaces = load_workspaces_from_file(
+            filename="workspaces_" + DEFAULT_WS_FILE)
     print(("Compute demo ", demo_id))
 
     hard = True
@@ -158,38 +262,64 @@ def generate_demonstrations(nb_points):
     workspaces = load_workspaces_from_file(
         filename="workspaces_" + DEFAULT_WS_FILE)
     trajectories = [None] * len(workspaces)
+    if options.batch:
+        # the trajectories are optimized with newton_optimize_trajectories
+        # instead of scipy's Newton-CG, which changes the dataset
+        nb_demos = len(workspaces)
+        if show_demo_id >= 0 and not options.show_result:
+            nb_demos = show_demo_id + 1
+        trajectories[:nb_demos] = compute_demonstrations_batch(
+            workspaces[:nb_demos], graph, nb_points, verbose)
+        return trajectories
     for k, workspace in enumerate(tqdm(workspaces)):
         if verbose:
             print(("Compute demo ", k))
-        nb_tries = 0
-        while trajectories[k] is None:
-            nb_tries += 1
-            hard = nb_tries < 20
-            try:
-                trajectories[k] = compute_demonstration(
-                    workspace,
-                    graph,
-                    nb_points=nb_points,
-                    # show_result=show_result,
-                    show_result=(show_demo_id == k or options.show_result),
-                    average_cost=options.average_cost,
-                    verbose=verbose,
-                    no_linear_interpolation=hard)
-            except ValueError as e:
-                trajectories[k] = None
-                if verbose:
-                    print("Warning : ", e)
+        trajectories[k] = compute_demonstration_with_retries(
+            workspace,
+            graph,
+            nb_points=nb_points,
+            show_result=(show_demo_id == k or options.show_result),
+            average_cost=options.average_cost,
+            verbose=verbose)
         if show_demo_id == k and not options.show_result:
             break
     return trajectories
 
 
+def _demonstration_item(context, k):
+    [workspaces, graph, nb_points, average_cost] = context
+    return compute_demonstration_with_retries(
+        workspaces[k], graph, nb_points, average_cost=average_cost)
+
+
+def generate_demonstrations_in_parallel(
+        nb_points, average_cost=False, workspaces=None,
+        basename='trajectories_' + DEFAULT_WS_FILE,
+        shard_size=100, nb_processes=None, seed=0):
+    """ Computes the demonstrations of all workspaces with a pool of
+        processes and saves them in shards (see generate_shards),
+        the workspaces are loaded once from file when not given.
+        Returns the shard filenames. """
+    if workspaces is None:
+        workspaces = load_workspaces_from_file(
+            filename="workspaces_" + DEFAULT_WS_FILE)
+    graph = CostmapToSparseGraph(
+        np.ones((nb_points, nb_points)), average_cost)
+    graph.convert()
+    return generate_shards(
+        _demonstration_item, len(workspaces),
+        save_trajectories_to_file, basename,
+        shard_size=shard_size, nb_processes=nb_processes, seed=seed,
+        context=[workspaces, graph, nb_points, average_cost])
+
+
 if __name__ == '__main__':
 
     np.random.seed(0)
     parser = optparse.OptionParser("usage: %prog [options] arg1 arg2")
     parser.add_option('--nb_points', type="int", default=24)
-    add_boolean_options(parser, ['verbose', 'show_result', 'average_cost'])
+    add_boolean_options(
+        parser, ['verbose', 'show_result', 'average_cost', 'batch'])
     (options, args) = parser.parse_args()
     verbose = options.verbose
     show_demo_id = -1
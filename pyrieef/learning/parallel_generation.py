@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2018, University of Stuttgart
+# All rights reserved.
+#
+# Permission to use, copy, modify, and distribute this software for any purpose
+# with or without   fee is hereby granted, provided   that the above  copyright
+# notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS  SOFTWARE INCLUDING ALL  IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR  BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR  ANY DAMAGES WHATSOEVER RESULTING  FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION,   ARISING OUT OF OR IN    CONNECTION WITH THE USE   OR
+# PERFORMANCE OF THIS SOFTWARE.
+#
+#                                        Jim Mainprice on Sunday June 13 2018
+
+from .common_imports import *
+from learning.dataset import learning_data_dir
+import multiprocessing
+import random
+from tqdm import tqdm
+
+# Set in each worker process by the pool initializer
+_worker_function = None
+_worker_context = None
+
+
+def seed_item(seed, k):
+    """ Seeds the random generators for item k, the random numbers
+        of an item do not depend on the process that computes it """
+    np.random.seed([seed, k])
+    random.seed("{}_{}".format(seed, k))
+
+
+def shard_filename(basename, shard_id):
+    """ trajectories.hdf5 -> trajectories_shard_00003.hdf5 """
+    name, extension = os.path.splitext(basename)
+    return "{}_shard_{:05d}{}".format(name, shard_id, extension)
+
+
+def shard_filenames(basename, nb_items, shard_size):
+    nb_shards = int(np.ceil(float(nb_items) / shard_size))
+    return [shard_filename(basename, i) for i in range(nb_shards)]
+
+
+def _initialize_worker(function, context):
+    global _worker_function, _worker_context
+    _worker_function = function
+    _worker_context = context
+
+
+def _compute_shard(shard):
+    """ computes the items [begin, end) of a shard """
+    shard_id, begin, end, seed = shard
+    results = [None] * (end - begin)
+    for k in range(begin, end):
+        seed_item(seed, k)
+        results[k - begin] = _worker_function(_worker_context, k)
+    return shard_id, results
+
+
+def generate_shards(function, nb_items, save_shard, basename,
+                    shard_size=1000, nb_processes=None, seed=0,
+                    context=None):
+    """
+    Computes function(context, k) for all items k in [0, nb_items) in a
+    pool of processes and saves the results by shards of shard_size
+    items with save_shard(results, filename).
+
+    The context (e.g., the workspaces) is passed once to each process.
+    The random generators are seeded for each item from (seed, k) so
+    the results do not depend on the number of processes. A shard file
+    is only written when complete, the shards that already exist in
+    the data directory are skipped, hence an interrupted generation
+    can be resumed by calling this function again.
+
+    Returns the list of shard filenames.
+    """
+    filenames = shard_filenames(basename, nb_items, shard_size)
+    shards = []
+    for i, filename in enumerate(filenames):
+        if os.path.isfile(learning_data_dir() + os.sep + filename):
+            continue
+        begin = i * shard_size
+        shards.append((i, begin, min(begin + shard_size, nb_items), seed))
+
+    def save(shard_id, results):
+        filename = filenames[shard_id]
+        save_shard(results, filename + ".tmp")
+        os.rename(learning_data_dir() + os.sep + filename + ".tmp",
+                  learning_data_dir() + os.sep + filename)
+
+    if nb_processes == 1:
+        _initialize_worker(function, context)
+        for shard in tqdm(shards):
+            save(*_compute_shard(shard))
+    else:
+        pool = multiprocessing.Pool(
+            nb_processes, _initialize_worker, (function, context))
+        try:
+            for shard_id, results in tqdm(
+                    pool.imap_unordered(_compute_shard, shards),
+                    total=len(shards)):
+                save(shard_id, results)
+        finally:
+            pool.terminate()
+    return filenames
+
+
+def load_shards(load_shard, basename, nb_items, shard_size=1000):
+    """ Loads the shards in order with load_shard(filename),
+        which should return a list, and concatenates them """
+    results = []
+    for filename in shard_filenames(basename, nb_items, shard_size):
+        results.extend(load_shard(filename))
+    return results
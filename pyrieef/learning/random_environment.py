@@ -29,6 +29,7 @@ from random import *
 import optparse
 import os
 from learning import dataset
+from learning.parallel_generation import *
 from tqdm import tqdm
 from numpy.testing import assert_allclose
 import itertools
@@ -50,13 +51,14 @@ def chomp_obstacle_cost(min_dist, epsilon):
         If min_dist < 0, cost = -min_dist + epsilon/2
         If min_dist >= 0 && min_dist < epsilon, have a different cost
         If min_dist >= epsilon, cost = 0
+
+        min_dist can be a single value or an array
     """
-    cost = 0.
-    if min_dist < 0:
-        cost = - min_dist + 0.5 * epsilon
-    elif min_dist <= epsilon:
-        cost = (1. / (2 * epsilon)) * ((min_dist - epsilon) ** 2)
-    return cost
+    d = np.asarray(min_dist, dtype=float)
+    cost = np.where(d < 0, - d + 0.5 * epsilon, 0.)
+    cost = np.where((d >= 0) & (d <= epsilon),
+                    (1. / (2 * epsilon)) * ((d - epsilon) ** 2), cost)
+    return cost.item() if cost.ndim == 0 else cost
 
 
 def grids(workspace, grid_to_world, epsilon):
@@ -65,32 +67,18 @@ def grids(workspace, grid_to_world, epsilon):
         To convert it to int or floats, use the following
         matrix.astype(int)
         matrix.astype(float)
+
+        The signed distance field is rasterized (see rasterize_sdf)
+        with a margin of the box diagonal, so that it is exact on all
+        the cells and not an upper bound beyond epsilon.
     """
     # print "grid_to_world.shape : ", grid_to_world.shape
     m = grid_to_world.shape[0]
     assert grid_to_world.shape[1] == m
 
-    costs = np.zeros((m, m))
-    meshgrid = workspace.box.stacked_meshgrid(m)
-    sdf = SignedDistanceWorkspaceMap(workspace)(meshgrid).T
+    sdf = rasterize_sdf(m, workspace, margin=workspace.box.diag())
     occupancy = sdf <= 0.
-    test_grids = False
-    if test_grids:
-        # return [None, None, None]
-        occupancy_tmp = np.zeros((m, m))
-        sdf_tmp = np.zeros((m, m))
-        for i, j in itertools.product(range(m), range(m)):
-            [min_dist, obstacle_id] = workspace.min_dist(grid_to_world[i, j])
-            sdf_tmp[i, j] = min_dist
-            occupancy_tmp[i, j] = min_dist <= 0.
-            costs[i, j] = chomp_obstacle_cost(min_dist, epsilon)
-
-        assert_allclose(sdf_tmp, sdf)
-        assert_allclose(occupancy_tmp, occupancy)
-    else:
-        for i, j in itertools.product(range(m), range(m)):
-            costs[i, j] = chomp_obstacle_cost(sdf[i, j], epsilon)
-
+    costs = chomp_obstacle_cost(sdf, epsilon)
     return [occupancy, sdf, costs]
 
 
@@ -123,19 +111,64 @@ def sample_circle_workspace(box,
     return None
 
 
+def sample_environment(opt, lims, box, grid_to_world):
+    """ Samples one environment made of opt.maxnumobjs circles
+        returns the grids [occupancy, sdf, costs] and the circles """
+    # Try for this many time to do any one single thing before restarting
+    maxnumtries = 100
+    maxnobjs = opt.maxnumobjs
+    minrad = opt.minobjrad
+    maxrad = opt.maxobjrad
+
+    # Create empty workspace.
+    workspace = Workspace(box)
+    numtries = 0  # Initialize num tries
+    # nobj = int(ceil(random() * maxnobjs))
+    nobj = maxnobjs
+    while True:
+        r = minrad + np.random.random() * (maxrad - minrad)
+        c = samplerandpt(lims)
+        # If this object is reasonably far away from other objects
+        [min_dist, obstacle_id] = workspace.min_dist(c)
+        if True or min_dist >= (r + 0.1):
+            workspace.add_circle(c, r)
+        numtries += 1  # Increment num tries
+
+        # Go further only if we have not exceeded all tries
+        if len(workspace.obstacles) >= nobj or numtries >= maxnumtries:
+            break
+
+    # Compute the occupancy grid and the cost
+    # Needs states in Nx2 format
+    [occ, sdf, cost] = grids(workspace, grid_to_world, opt.epsilon)
+    ws_c = -1000. * np.ones((maxnobjs, 2))
+    ws_r = -1000. * np.ones((maxnobjs, 2))
+    for i, o in enumerate(workspace.obstacles):
+        ws_c[i, :] = o.origin
+        ws_r[i, 0] = o.radius
+    return [np.array([occ, sdf, cost]), np.array([ws_c, ws_r])]
+
+
+def environment_grid(opt, lims):
+    """ The box which defines the workspace, is axis aligned
+        and it's origin is at the center """
+    dim = np.array([lims[0][1] - lims[0][0], lims[1][1] - lims[1][0]])
+    box = EnvBox(origin=dim / 2., dim=dim)
+    grid = PixelMap(1. / opt.xsize, box.extent())
+    cells = np.stack(np.meshgrid(
+        np.arange(grid.nb_cells_x), np.arange(grid.nb_cells_y),
+        indexing='ij'), axis=-1)
+    return box, grid.grid_to_world(cells)
+
+
 def random_environments(opt):
 
     lims = np.array([[0., 1.], [0., 1.]])
     # size        = torch.LongStorage({opt.xsize, opt.ysize}) # col x row
     size = np.array([opt.xsize, opt.ysize])
     numdatasets = opt.numdatasets
-    maxnobjs = opt.maxnumobjs
-    minrad = opt.minobjrad
-    maxrad = opt.maxobjrad
-    epsilon = opt.epsilon
     resolution_x = 1. / opt.xsize
     resolution_y = 1. / opt.ysize
-    save_workspace = True
     if opt.seed >= 0:
         print(("set random seed ({})".format(opt.seed)))
         np.random.seed(opt.seed)
@@ -151,58 +184,15 @@ def random_environments(opt):
     k = 0
 
     # Create structure that contains grids and obstacles
-    # The box which defines the workspace, is axis aligned
-    # and it's origin is at the center
-    box = EnvBox()
-    box.dim[0] = lims[0][1] - lims[0][0]
-    box.dim[1] = lims[1][1] - lims[1][0]
-    box.origin[0] = box.dim[0] / 2.
-    box.origin[1] = box.dim[1] / 2.
-    grid = PixelMap(resolution, box.extent())
-    grid_to_world = np.zeros((grid.nb_cells_x, grid.nb_cells_y, 2))
-    for i in range(grid.nb_cells_x):
-        for j in range(grid.nb_cells_y):
-            grid_to_world[i, j] = grid.grid_to_world(np.array([i, j]))
+    # Warning: the default arguments of EnvBox should not be modified
+    box, grid_to_world = environment_grid(opt, lims)
 
-    # Try for this many time to do any one single thing before restarting
-    maxnumtries = 100
     print(("Num datasets : " + str(numdatasets)))
     for k in tqdm(list(range(numdatasets))):
-
-        # Create empty workspace.
-        workspace = Workspace(box)
-        numtries = 0  # Initialize num tries
-        # nobj = int(ceil(random() * maxnobjs))
-        nobj = maxnobjs
-        while True:
-            r = minrad + np.random.random() * (maxrad - minrad)
-            c = samplerandpt(lims)
-            # If this object is reasonably far away from other objects
-            [min_dist, obstacle_id] = workspace.min_dist(c)
-            if True or min_dist >= (r + 0.1):
-                workspace.add_circle(c, r)
-            numtries += 1  # Increment num tries
-
-            # Go further only if we have not exceeded all tries
-            if len(workspace.obstacles) >= nobj or numtries >= maxnumtries:
-                # Compute the occupancy grid and the cost
-                # Needs states in Nx2 format
-                [occ, sdf, cost] = grids(workspace, grid_to_world, epsilon)
-                datasets[k] = np.array([occ, sdf, cost])
-
-                if save_workspace:
-                    ws_c = -1000. * np.ones((maxnobjs, 2))
-                    ws_r = -1000. * np.ones((maxnobjs, 2))
-                    for i, o in enumerate(workspace.obstacles):
-                        ws_c[i, :] = o.origin
-                        ws_r[i, 0] = o.radius
-                    dataws[k] = np.array([ws_c, ws_r])
-
-                if opt.display:
-                    draw_grids([occ, sdf, cost])
-                break
-        else:
-            print('[OBJS] Reached max number of tries. Restarting run...')
+        [datasets[k], dataws[k]] = sample_environment(
+            opt, lims, box, grid_to_world)
+        if opt.display:
+            draw_grids(datasets[k])
 
     data = {}
     data["lims"] = lims
@@ -219,6 +209,50 @@ def random_environments(opt):
     return data, workspaces
 
 
+def _environment_item(context, k):
+    [opt, lims, box, grid_to_world] = context
+    return sample_environment(opt, lims, box, grid_to_world)
+
+
+def _save_environment_shard(environments, filename):
+    dataset.write_dictionary_to_file(
+        {"datasets": np.stack([e[0] for e in environments]),
+         "workspaces": np.stack([e[1] for e in environments])},
+        filename)
+
+
+def _load_environment_shard(filename):
+    data = dataset.load_dictionary_from_file(filename)
+    return list(zip(data["datasets"], data["workspaces"]))
+
+
+def random_environments_in_parallel(
+        opt, basename, shard_size=1000, nb_processes=None):
+    """ Same as random_environments with a pool of processes, the
+        environments are saved in shards (see generate_shards) that
+        are reused when the generation is resumed.
+        The environments differ from the serial ones as each
+        of them is sampled with its own seed (opt.seed, k). """
+    lims = np.array([[0., 1.], [0., 1.]])
+    size = np.array([opt.xsize, opt.ysize])
+    box, grid_to_world = environment_grid(opt, lims)
+    generate_shards(
+        _environment_item, opt.numdatasets, _save_environment_shard,
+        basename, shard_size=shard_size, nb_processes=nb_processes,
+        seed=max(opt.seed, 0), context=[opt, lims, box, grid_to_world])
+    environments = load_shards(
+        _load_environment_shard, basename, opt.numdatasets, shard_size)
+    data = {}
+    data["lims"] = lims
+    data["size"] = size
+    data["datasets"] = np.stack([e[0] for e in environments])
+    workspaces = {}
+    workspaces["lims"] = lims
+    workspaces["size"] = size
+    workspaces["datasets"] = np.stack([e[1] for e in environments])
+    return data, workspaces
+
+
 def get_dataset_id(data_id):
     options_data = dataset.get_yaml_options()
     options = dict_to_object(options_data[data_id])
@@ -64,7 +64,7 @@ def cost_grid(workspace, nb_points):
 
 def grid_to_world_path(workspace, path, nb_points):
     grid = workspace.pixel_map(nb_points)
-    return [grid.grid_to_world(np.array(p)) for p in path]
+    return grid.grid_to_world(np.array(path))
 
 
 def sample_path(
@@ -73,7 +73,9 @@ def sample_path(
         nb_points,
         no_linear_interpolation):
     """ finds a path that does not collide with enviroment
-    but that is significantly difficult to perform """
+    but that is significantly difficult to perform
+
+    graph : CostmapToSparseGraph or CachedShortestPaths """
     cost = cost_grid(workspace, nb_points)
     pixel_map = workspace.pixel_map(nb_points)
     half_diag = workspace.box.diag() / 2.
@@ -105,8 +107,7 @@ def generate_paths(nb_points):
         filename="workspaces_" + DEFAULT_WS_FILE)
 
     grid = np.ones((nb_points, nb_points))
-    graph = CostmapToSparseGraph(grid, AVERAGE_COST)
-    graph.convert()
+    graph = CachedShortestPaths(CostmapToSparseGraph(grid, AVERAGE_COST))
 
     paths = [None] * len(workspaces)
     for k, workspace in enumerate(tqdm(workspaces)):
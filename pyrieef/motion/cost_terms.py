@@ -27,8 +27,8 @@ class FiniteDifferencesVelocity(AffineMap):
     """ Define velocities where clique = [ x_t ; x_{t+1} ] """
 
     def __init__(self, dim, dt):
-        self._a = np.matrix(np.zeros((dim, 2 * dim)))
-        self._b = np.matrix(np.zeros((dim, 1)))
+        self._a = np.zeros((dim, 2 * dim))
+        self._b = np.zeros(dim)
         self._initialize_matrix(dim, dt)
 
     def _initialize_matrix(self, dim, dt):
@@ -44,8 +44,8 @@ class FiniteDifferencesAcceleration(AffineMap):
     """ Define accelerations where clique = [ x_{t-1} ; x_{t} ; x_{t+1} ] """
 
     def __init__(self, dim, dt):
-        self._a = np.matrix(np.zeros((dim, 3 * dim)))
-        self._b = np.matrix(np.zeros((dim, 1)))
+        self._a = np.zeros((dim, 3 * dim))
+        self._b = np.zeros(dim)
         self._initialize_matrix(dim, dt)
 
     def _initialize_matrix(self, dim, dt):
@@ -75,10 +75,30 @@ class SquaredNormDerivative(DifferentiableMap):
         return self._sq_norm(self._derivative(clique))
 
     def jacobian(self, clique):
-        return self._derivative(clique) * self._derivative.a()
+        a = self._derivative.a()
+        return np.dot(self._derivative(clique), a).reshape(1, a.shape[1])
 
     def hessian(self, clique):
-        return self._derivative.a().T * self._derivative.a()
+        return np.dot(self._derivative.a().T, self._derivative.a())
+
+    def forward_batch(self, cliques):
+        d = self._derivative.forward_batch(cliques)
+        return 0.5 * np.sum(d ** 2, axis=1).reshape(cliques.shape[0], 1)
+
+    def jacobian_batch(self, cliques):
+        d = self._derivative.forward_batch(cliques)
+        return np.dot(d, self._derivative.a())[:, None, :]
+
+    def hessian_batch(self, cliques):
+        H = self.hessian(None)
+        return np.repeat(H[None, :, :], cliques.shape[0], axis=0)
+
+    def evaluate_all_batch(self, cliques, order=2):
+        d = self._derivative.forward_batch(cliques)
+        V = 0.5 * np.sum(d ** 2, axis=1).reshape(cliques.shape[0], 1)
+        J = np.dot(d, self._derivative.a())[:, None, :] if order >= 1 else None
+        H = self.hessian_batch(cliques) if order >= 2 else None
+        return [V, J, H]
 
 
 class SquaredNormVelocity(SquaredNormDerivative):
@@ -141,14 +161,14 @@ class LogBarrierFunction(DifferentiableMap):
             return np.where(d, infinity, -self.mu * np.log(x))
 
     def jacobian(self, x):
-        J = np.matrix(np.zeros((1, 1)))
+        J = np.zeros((1, 1))
         if x < self._margin:
             return J
         J[0, 0] = -self.mu / x
         return J
 
     def hessian(self, x):
-        H = np.matrix(np.zeros((1, 1)))
+        H = np.zeros((1, 1))
         if x < self._margin:
             return H
         H[0, 0] = self.mu / (x ** 2)
@@ -199,27 +219,25 @@ class BoundBarrier(DifferentiableMap):
         return value
 
     def jacobian(self, x):
-        J = np.matrix(np.zeros((
-            self.output_dimension(), self.input_dimension())))
+        J = np.zeros((self.output_dimension(), self.input_dimension()))
         for i, x_i in enumerate(x):
             l_dist = x_i - self._v_lower[i]
             u_dist = self._v_upper[i] - x_i
             if l_dist < self._margin or u_dist < self._margin:
-                return np.matrix(np.zeros((
-                    self.output_dimension(), self.input_dimension())))
+                return np.zeros((
+                    self.output_dimension(), self.input_dimension()))
             J[0, i] += -self._alpha / l_dist
             J[0, i] += self._alpha / u_dist
         return J
 
     def hessian(self, x):
-        H = np.matrix(np.zeros((
-            self.input_dimension(), self.input_dimension())))
+        H = np.zeros((self.input_dimension(), self.input_dimension()))
         for i, x_i in enumerate(x):
             l_dist = x_i - self._v_lower[i]
             u_dist = self._v_upper[i] - x_i
             if l_dist < self._margin or u_dist < self._margin:
-                return np.matrix(np.zeros((
-                    self.output_dimension(), self.output_dimension())))
+                return np.zeros((
+                    self.input_dimension(), self.input_dimension()))
             H[i, i] += self._alpha / (l_dist ** 2)
             H[i, i] += self._alpha / (u_dist ** 2)
         return H
@@ -236,6 +254,7 @@ class SimplePotential2D(DifferentiableMap):
         self._rho_scaling = 100.
         self._alpha = 10.
         self._margin = 0.
+        self._offset = 0.
 
     def output_dimension(self):
         return 1
@@ -246,21 +265,23 @@ class SimplePotential2D(DifferentiableMap):
     def forward(self, x):
         return self._rho_scaling * np.exp(-self._alpha * self._sdf.forward(x))
 
-    def _sdf_jacobian(self, x):
-        sdf, J_sdf = self._sdf.evaluate(x)
-        d_obs = sdf - self._margin
-        rho = self._rho_scaling * np.exp(-self._alpha * d_obs)
-        return J_sdf, rho
-
     def jacobian(self, x):
-        J_sdf, rho = self._sdf_jacobian(x)
-        return -self._alpha * rho * J_sdf
+        return self.evaluate_all(x, order=1)[1]
 
     def hessian(self, x):
-        J_sdf, rho = self._sdf_jacobian(x)
-        H_sdf = self._sdf.hessian(x)
-        J_sdf_sq = J_sdf.T * J_sdf
-        return rho * (self._alpha**2 * J_sdf_sq - self._alpha * H_sdf)
+        return self.evaluate_all(x, order=2)[2]
+
+    def evaluate_all(self, x, order=2):
+        """ the signed distance field is only queried once """
+        [sdf, J_sdf, H_sdf] = self._sdf.evaluate_all(x, order)
+        d_obs = sdf - self._margin
+        rho = self._rho_scaling * np.exp(-self._alpha * d_obs)
+        J = -self._alpha * rho * J_sdf if order >= 1 else None
+        H = None
+        if order >= 2:
+            J_sdf_sq = np.dot(J_sdf.T, J_sdf)
+            H = rho * (self._alpha**2 * J_sdf_sq - self._alpha * H_sdf)
+        return [rho + self._offset, J, H]
 
 
 class CostGridPotential2D(SimplePotential2D):
@@ -306,11 +327,11 @@ class ObstaclePotential2D(DifferentiableMap):
     def jacobian(self, x):
         [sdf, J_sdf] = self._sdf.evaluate(x)
         rho = np.exp(-self._alpha * sdf)
-        J = np.matrix(np.zeros((3, 2)))
+        J = np.zeros((3, 2))
         J[0, :] = -self._alpha * self._rho_scaling * rho * J_sdf
-        J[1:3, :] = np.matrix(np.eye(2, 2))
+        J[1:3, :] = np.eye(2, 2)
         return J
 
     def hessian(self, x):
         J_phi = self.jacobian(x)
-        return J_phi.T * J_phi
+        return np.dot(J_phi.T, J_phi)
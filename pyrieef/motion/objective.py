@@ -33,7 +33,8 @@ class MotionOptimization2DCostMap:
                  signed_distance_field=None,
                  costmap=None,
                  q_init=None,
-                 q_goal=None):
+                 q_goal=None,
+                 sdf_temperature=None):
         self.verbose = False
         self.config_space_dim = n       # nb of dofs
         self.T = T                      # time steps
@@ -41,6 +42,7 @@ class MotionOptimization2DCostMap:
         self.trajectory_space_dim = (self.config_space_dim * (self.T + 2))
         self.workspace = None
         self.signed_distance_field = signed_distance_field
+        self.sdf_temperature = sdf_temperature
         self.costmap = costmap
         self.objective = None
 
@@ -80,7 +82,7 @@ class MotionOptimization2DCostMap:
         self.workspace = workspace
         self.box = workspace.box
         self.extent = workspace.box.extent()
-        self.signed_distance_field = SignedDistanceWorkspaceMap(workspace)
+        self.signed_distance_field = self.create_sdf(workspace)
         self.obstacle_potential = obstacle_potential
         self.q_init = trajectory.initial_configuration()
         self.q_goal = trajectory.final_configuration()
@@ -132,7 +134,7 @@ class MotionOptimization2DCostMap:
         workspace.obstacles.append(Circle(p1, .1))
         workspace.obstacles.append(Circle(p2, .1))
         # workspace.obstacles.append(Box(p2, .1))
-        self.signed_distance_field = SignedDistanceWorkspaceMap(workspace)
+        self.signed_distance_field = self.create_sdf(workspace)
         self.workspace = workspace
         return workspace
 
@@ -142,17 +144,26 @@ class MotionOptimization2DCostMap:
         p2 = np.array([-2, 2])
         workspace.obstacles.append(Circle(p1, .1))
         workspace.obstacles.append(Circle(p2, .1))
-        self.signed_distance_field = SignedDistanceWorkspaceMap(workspace)
+        self.signed_distance_field = self.create_sdf(workspace)
         self.workspace = workspace
         return workspace
 
+    def create_sdf(self, workspace):
+        """ Signed distance field of the workspace, the smooth union
+            of the obstacles (SmoothSignedDistanceWorkspaceMap)
+            when sdf_temperature is set """
+        if self.sdf_temperature is None:
+            return SignedDistanceWorkspaceMap(workspace)
+        return SmoothSignedDistanceWorkspaceMap(
+            workspace, self.sdf_temperature)
+
     def create_smoothness_metric(self):
         """ TODO this does not seem to work at all... """
         a = FiniteDifferencesAcceleration(1, self.dt).a()
         # print "a : "
         # print a
         no_variance = True
-        K_dof = np.matrix(np.zeros((self.T + 1, self.T + 1)))
+        K_dof = np.zeros((self.T + 1, self.T + 1))
         for i in range(0, self.T + 1):
             if i == 0:
                 K_dof[i, i:i + 2] = a[0, 1:3]
@@ -164,14 +175,14 @@ class MotionOptimization2DCostMap:
                     K_dof[i, i] *= 1000  # No variance at end points
             elif i > 0:
                 K_dof[i, i - 1:i + 2] = a
-        A_dof = K_dof.T * K_dof
+        A_dof = np.dot(K_dof.T, K_dof)
         # print K_dof
         # print A_dof
 
         # represented in the form :  \xi = [q_0 ; q_1; ... ; q_2]
-        K_full = np.matrix(np.zeros((
+        K_full = np.zeros((
             self.config_space_dim * (self.T + 1),
-            self.config_space_dim * (self.T + 1))))
+            self.config_space_dim * (self.T + 1)))
         for dof in range(self.config_space_dim):
             for (i, j), K_ij in np.ndenumerate(K_dof):
                 id_row = i * self.config_space_dim + dof
@@ -180,7 +191,7 @@ class MotionOptimization2DCostMap:
                     K_full[id_row, id_col] = K_ij
         # print K_full
         # print K_full.shape
-        A = K_full.T * K_full
+        A = np.dot(K_full.T, K_full)
         self.metric = A
         return A
 
@@ -339,8 +350,12 @@ class MotionOptimization2DCostMap:
 
         xi = trajectory.active_segment()
 
-        if optimizer is "natural_gradient":
-            optimizer = NaturalGradientDescent(self.objective, self.metric)
+        # The optimizers query the same iterates several times
+        objective = CachedObjectiveFunction(
+            self.objective, order=2 if optimizer == "newton" else 1)
+
+        if optimizer == "natural_gradient":
+            optimizer = NaturalGradientDescent(objective, self.metric)
             optimizer.set_eta(self._eta)
 
             dist = float("inf")
@@ -357,13 +372,13 @@ class MotionOptimization2DCostMap:
                 gradient = optimizer.gradient(xi)
                 delta = optimizer.delta(xi)
 
-        elif optimizer is "newton":
+        elif optimizer == "newton":
             res = optimize.minimize(
                 x0=np.array(xi),
                 method='Newton-CG',
-                fun=self.objective.forward,
-                jac=self.objective.gradient,
-                hess=self.objective.hessian,
+                fun=objective.forward,
+                jac=objective.gradient,
+                hess=objective.hessian,
                 options={'maxiter': nb_steps, 'disp': self.verbose}
             )
             trajectory.active_segment()[:] = res.x
@@ -20,7 +20,9 @@
 from .__init__ import *
 from geometry.differentiable_geometry import *
 from geometry.utils import *
-from scipy.interpolate import interp1d
+from scipy.interpolate import CubicSpline
+from scipy import sparse
+from collections import OrderedDict
 
 
 class FunctionNetwork(DifferentiableMap):
@@ -54,6 +56,10 @@ class CliquesFunctionNetwork(FunctionNetwork):
         Base class to implement a function network
         It allows to register functions and evaluates
         f(x_{i-1}, x_i, x_{i+1}) = \sum_i f_i(x_{i-1}, x_i, x_{i+1})
+
+        Functions registered for all cliques are evaluated in one call
+        on the stacked cliques (see all_cliques_array) through
+        the forward_batch, jacobian_batch and hessian_batch methods.
     """
 
     def __init__(self, input_dimension, clique_element_dim):
@@ -66,6 +72,8 @@ class CliquesFunctionNetwork(FunctionNetwork):
         self._functions = self._nb_cliques * [None]
         for i in range(self._nb_cliques):
             self._functions[i] = []
+        self._batch_functions = []
+        self._hessian_ids = None
 
     def output_dimension(self):
         return 1
@@ -83,6 +91,10 @@ class CliquesFunctionNetwork(FunctionNetwork):
             # print("x_c[{}] : {}".format(t, x_t))
             for f in self._functions[t]:
                 value += f.forward(x_t)
+        if self._batch_functions:
+            x_c = self.all_cliques_array(x)
+            for f in self._batch_functions:
+                value += f.forward_batch(x_c).sum()
         return value
 
     def jacobian(self, x):
@@ -96,31 +108,138 @@ class CliquesFunctionNetwork(FunctionNetwork):
             The sub jacobian of the maps are the sum of clique jacobians
             each clique function f : R^dim -> R, where dim is the clique size.
         """
-        J = np.matrix(np.zeros((
-            self.output_dimension(),
-            self.input_dimension())))
+        J = np.zeros((self.output_dimension(), self.input_dimension()))
         for t, x_t in enumerate(self.all_cliques(x)):
             for f in self._functions[t]:
                 assert f.output_dimension() == self.output_dimension()
                 c_id = t * self._clique_element_dim
-                J[0, c_id:c_id + self._clique_dim] += f.jacobian(x_t)
+                J[:, c_id:c_id + self._clique_dim] += f.jacobian(x_t)
+        if self._batch_functions:
+            x_c = self.all_cliques_array(x)
+            J_c = np.zeros((self._nb_cliques, self._clique_dim))
+            for f in self._batch_functions:
+                J_c += f.jacobian_batch(x_c)[:, 0, :]
+            self._add_clique_jacobians(J, J_c)
         return J
 
-    def hessian(self, x):
+    def _add_clique_jacobians(self, J, J_c):
+        """ adds the stacked clique jacobians J_c to the full jacobian """
+        # Element k of clique t is configuration t + k
+        n = self._clique_element_dim
+        size = n * self._nb_cliques
+        for k in range(self._nb_clique_elements):
+            J[0, k * n:k * n + size] += J_c[:, k * n:(k + 1) * n].ravel()
+
+    def hessian(self, x, out=None):
         """
             The hessian matrix is of dimension m x m
                 m (rows) : input size
                 m (cols) : input size
+
+            out : optional preallocated m x m array to write the result
+        """
+        return self.hessian_from_blocks(self.clique_hessians(x), out)
+
+    def hessian_from_blocks(self, blocks, out=None):
+        """ assembles the full hessian from the stacked clique hessians """
+        if out is None:
+            H = np.zeros((self.input_dimension(), self.input_dimension()))
+        else:
+            H = out
+            H.fill(0.)
+        dim = self._clique_dim
+        for t, H_t in enumerate(blocks):
+            c_id = t * self._clique_element_dim
+            H[c_id:c_id + dim, c_id:c_id + dim] += H_t
+        return H
+
+    def hessian_sparse(self, x):
+        """
+            Same as hessian but returns a scipy.sparse csr matrix.
+
+            The hessian of the network is block tri-diagonal, each clique
+            contributes a dense block on the diagonal that overlaps with
+            its neighbors, so the memory is linear in the number of cliques.
+        """
+        return self.sparse_hessian_from_blocks(self.clique_hessians(x))
+
+    def sparse_hessian_from_blocks(self, blocks):
+        """ same as hessian_from_blocks with a csr matrix """
+        rows, cols = self.clique_hessian_indices()
+        size = self.input_dimension()
+        return sparse.coo_matrix(
+            (blocks.ravel(), (rows, cols)), shape=(size, size)).tocsr()
+
+    def clique_hessians(self, x):
+        """
+        returns the hessians of all cliques stacked in an array
+        of dimension nb_cliques x clique_dim x clique_dim
         """
-        H = np.matrix(np.zeros((
-            self.input_dimension(),
-            self.input_dimension())))
         dim = self._clique_dim
+        blocks = np.zeros((self._nb_cliques, dim, dim))
+        for t, x_t in enumerate(self.all_cliques(x)):
+            for f in self._functions[t]:
+                blocks[t] += f.hessian(x_t)
+        if self._batch_functions:
+            x_c = self.all_cliques_array(x)
+            for f in self._batch_functions:
+                blocks += f.hessian_batch(x_c)
+        return blocks
+
+    def evaluate_cliques(self, x, order=2):
+        """
+        returns [value, J, blocks], the value and jacobian of the
+        network and the stacked clique hessians (see clique_hessians),
+        all functions are evaluated once per clique with evaluate_all
+        """
+        dim = self._clique_dim
+        value = 0.
+        J, blocks = None, None
+        if order >= 1:
+            J = np.zeros((self.output_dimension(), self.input_dimension()))
+        if order >= 2:
+            blocks = np.zeros((self._nb_cliques, dim, dim))
         for t, x_t in enumerate(self.all_cliques(x)):
             c_id = t * self._clique_element_dim
             for f in self._functions[t]:
-                H[c_id:c_id + dim, c_id:c_id + dim] += f.hessian(x_t)
-        return H
+                [v, J_t, H_t] = f.evaluate_all(x_t, order)
+                value += v
+                if order >= 1:
+                    J[:, c_id:c_id + dim] += J_t
+                if order >= 2:
+                    blocks[t] += H_t
+        if self._batch_functions:
+            x_c = self.all_cliques_array(x)
+            J_c = np.zeros((self._nb_cliques, dim))
+            for f in self._batch_functions:
+                [v, J_t, H_t] = f.evaluate_all_batch(x_c, order)
+                value += v.sum()
+                if order >= 1:
+                    J_c += J_t[:, 0, :]
+                if order >= 2:
+                    blocks += H_t
+            if order >= 1:
+                self._add_clique_jacobians(J, J_c)
+        return [value, J, blocks]
+
+    def evaluate_all(self, x, order=2):
+        [value, J, blocks] = self.evaluate_cliques(x, order)
+        H = self.hessian_from_blocks(blocks) if order >= 2 else None
+        return [value, J, H]
+
+    def clique_hessian_indices(self):
+        """
+        returns the row and column indices of all clique hessian
+        entries in the full hessian, in the order of the blocks
+        """
+        if self._hessian_ids is None:
+            dim = self._clique_dim
+            c_ids = self._clique_element_dim * np.arange(self._nb_cliques)
+            ids = c_ids[:, None] + np.arange(dim)[None, :]
+            rows = np.repeat(ids[:, :, None], dim, axis=2)
+            cols = np.repeat(ids[:, None, :], dim, axis=1)
+            self._hessian_ids = (rows.ravel(), cols.ravel())
+        return self._hessian_ids
 
     def clique_value(self, t, x_t):
         """
@@ -128,7 +247,7 @@ class CliquesFunctionNetwork(FunctionNetwork):
         TODO create a test using this function.
         """
         value = 0.
-        for f in self._functions[t]:
+        for f in self._functions[t] + self._batch_functions:
             value += f.forward(x_t)
         return value
 
@@ -158,16 +277,28 @@ class CliquesFunctionNetwork(FunctionNetwork):
         assert len(cliques) == self._nb_cliques
         return cliques
 
+    def all_cliques_array(self, x):
+        """
+        returns all cliques stacked in an array of dimension
+            nb_cliques x clique_dim
+        the cliques overlap, hence the array is a read-only view of x
+        """
+        x = np.ascontiguousarray(x, dtype=float)
+        stride = x.strides[0]
+        return np.lib.stride_tricks.as_strided(
+            x, shape=(self._nb_cliques, self._clique_dim),
+            strides=(self._clique_element_dim * stride, stride),
+            writeable=False)
+
     def register_function_for_clique(self, t, f):
         """ Register function f for clique i """
         assert f.input_dimension() == self._clique_dim
         self._functions[t].append(f)
 
     def register_function_for_all_cliques(self, f):
-        """ Register function f """
+        """ Register function f, evaluated on all cliques at once """
         assert f.input_dimension() == self._clique_dim
-        for t in range(self._nb_cliques):
-            self._functions[t].append(f)
+        self._batch_functions.append(f)
 
     def register_function_last_clique(self, f):
         """ Register function f """
@@ -221,13 +352,19 @@ class TrajectoryObjectiveFunction(DifferentiableMap):
         we can take it out of the optimization and through away the gradient
         computed for that configuration.
 
+        By default the hessian is returned as a block tridiagonal
+        scipy.sparse csr matrix, which can be used directly by
+        the Newton solvers, set sparse_hessian to False to get
+        a dense matrix.
+
         TODO Test...
         """
 
-    def __init__(self, q_init, function_network):
+    def __init__(self, q_init, function_network, sparse_hessian=True):
         self._q_init = q_init
         self._n = q_init.size
         self._function_network = function_network
+        self._sparse_hessian = sparse_hessian
 
     def full_vector(self, x_active):
         assert x_active.size == (
@@ -249,12 +386,92 @@ class TrajectoryObjectiveFunction(DifferentiableMap):
 
     def jacobian(self, x):
         x_full = self.full_vector(x)
-        return self._function_network.jacobian(x_full)[0, self._n:]
+        return self._function_network.jacobian(x_full)[:, self._n:]
 
     def hessian(self, x):
         x_full = self.full_vector(x)
-        H = self._function_network.hessian(x_full)[self._n:, self._n:]
-        return np.array(H)
+        if self._sparse_hessian:
+            H = self._function_network.hessian_sparse(x_full)
+            return H[self._n:, self._n:]
+        return self._function_network.hessian(x_full)[self._n:, self._n:]
+
+    def evaluate_all(self, x, order=2):
+        """ value, gradient and hessian from a single network pass """
+        x_full = self.full_vector(x)
+        [value, J, blocks] = self._function_network.evaluate_cliques(
+            x_full, order)
+        value = min(1e100, value)
+        H = None
+        if order >= 1:
+            J = J[:, self._n:]
+        if order >= 2:
+            if self._sparse_hessian:
+                H = self._function_network.sparse_hessian_from_blocks(blocks)
+            else:
+                H = self._function_network.hessian_from_blocks(blocks)
+            H = H[self._n:, self._n:]
+        return [value, J, H]
+
+    def set_sparse_hessian(self, sparse_hessian):
+        self._sparse_hessian = sparse_hessian
+
+
+class CachedObjectiveFunction(DifferentiableMap):
+    """ Memoizes the evaluations of an objective function
+
+        Optimizers tend to query the value, gradient and hessian
+        independently at the same iterate. This wrapper keeps the
+        results of the last max_size inputs (LRU) and computes them in a
+        single pass with evaluate_all. On any miss all derivatives up to
+        order are computed, so that the value, gradient (and hessian) of
+        an iterate cost a single evaluation.
+
+        hits and misses count the queries answered from the cache.
+        """
+
+    def __init__(self, f, max_size=4, order=1):
+        self._f = f
+        self._max_size = max_size
+        self._order = order
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def output_dimension(self):
+        return self._f.output_dimension()
+
+    def input_dimension(self):
+        return self._f.input_dimension()
+
+    def forward(self, x):
+        return self.evaluate_all(x, order=0)[0]
+
+    def jacobian(self, x):
+        return self.evaluate_all(x, order=1)[1].copy()
+
+    def hessian(self, x):
+        return self.evaluate_all(x, order=2)[2].copy()
+
+    def evaluate_all(self, x, order=2):
+        """ returns the cached [x, J, H], do not modify them in place """
+        key = np.ascontiguousarray(x, dtype=float).tobytes()
+        entry = self._cache.pop(key, None)
+        if entry is not None and entry[0] >= order:
+            self.hits += 1
+            self._cache[key] = entry
+            return entry[1]
+        self.misses += 1
+        order = max(order, self._order)
+        values = self._f.evaluate_all(x, order)
+        self._cache[key] = (order, values)
+        if len(self._cache) > self._max_size:
+            self._cache.popitem(last=False)
+        return values
+
+    def clear(self):
+        self._cache.clear()
+        self.hits = 0
+        self.misses = 0
 
 
 class Trajectory:
@@ -386,31 +603,48 @@ class Trajectory:
 
 
 class ContinuousTrajectory(Trajectory):
-    """ Implements a trajectory that can be continously interpolated """
+    """ Implements a trajectory that can be continously interpolated
+
+        The cumulative arc lengths of the configurations are cached
+        with a copy of the configurations they were computed from, the
+        configurations can be modified through any view of the vector x,
+        so the copy is compared before each use. """
+
+    def arc_lengths(self):
+        """ length in configuration space from the first configuration
+            to each configuration 0 to T """
+        configurations = self._x[:self._n * (self._T + 1)]
+        if getattr(self, "_arc_lengths", None) is None or not np.array_equal(
+                self._arc_lengths_x, configurations):
+            q = configurations.reshape(self._T + 1, self._n)
+            self._arc_lengths = np.r_[0., np.cumsum(
+                np.linalg.norm(np.diff(q, axis=0), axis=1))]
+            self._arc_lengths_x = configurations.copy()
+        return self._arc_lengths
 
     def configuration_at_parameter(self, s):
         """ The trajectory is indexed by s \in [0, 1] """
-        d_param = s * self.length()
-        q_prev = self.configuration(0)
-        dist = 0.
-        for i in range(1, self._T + 1):
-            q_curr = self.configuration(i)
-            d = np.linalg.norm(q_curr - q_prev)
-            if d_param <= (d + dist):
-                return interpolate(q_prev, q_curr, d_param - dist, d)
-            dist += d
-            q_prev = q_curr
-        return None
+        if s > 1.:
+            return None
+        return self.configurations_at_parameters(np.array([s]))[0]
+
+    def configurations_at_parameters(self, s):
+        """ Returns the configurations (m, n) at an array of
+            parameters s \in [0, 1] of size m """
+        s = np.asarray(s, dtype=float)
+        arc_lengths = self.arc_lengths()
+        d_param = s * arc_lengths[-1]
+        i = np.searchsorted(arc_lengths, d_param) - 1
+        i = np.clip(i, 0, self._T - 1)
+        d = arc_lengths[i + 1] - arc_lengths[i]
+        alpha = (d_param - arc_lengths[i]) / np.where(d > 0., d, 1.)
+        alpha = np.clip(alpha, 0., 1.)[:, None]
+        q = self._x[:self._n * (self._T + 1)].reshape(self._T + 1, self._n)
+        return (1. - alpha) * q[i] + alpha * q[i + 1]
 
     def length(self):
         """ length in configuration space """
-        length = 0.
-        q_prev = self.configuration(0)
-        for i in range(1, self._T + 1):
-            q_curr = self.configuration(i)
-            length += np.linalg.norm(q_curr - q_prev)
-            q_prev = q_curr
-        return length
+        return self.arc_lengths()[-1]
 
 
 class ConstantAccelerationTrajectory(ContinuousTrajectory):
@@ -447,8 +681,9 @@ class CubicSplineTrajectory(ContinuousTrajectory):
     """
     Implements a trajectory that can be continously interpolated
 
-    Velocities and accelerations are computed using finite differences
-        which is why we set an epsilon parameter.
+    A single cubic spline interpolates all the degrees of freedom,
+        the configurations, velocities and accelerations are evaluated
+        analytically for a time or an array of times.
 
     The trajectory is defined for a time interval
         t \in [0., dt * (T + 1)]
@@ -464,8 +699,7 @@ class CubicSplineTrajectory(ContinuousTrajectory):
     def __init__(self, T=0, n=2, dt=0.1, q_init=None, x=None):
         Trajectory.__init__(self, T=T, n=n, q_init=q_init, x=x)
         self._dt = float(dt)
-        self._f = []
-        self._epsilon = 1e-6
+        self._f = None
 
     def time_indices(self):
         return np.linspace(0., self._T * self._dt, self._T + 1)
@@ -473,42 +707,109 @@ class CubicSplineTrajectory(ContinuousTrajectory):
     def initialize_spline(self):
         time = self.time_indices()
         configurations = np.array(self.list_configurations())
-        self._f = []
-        for d in range(self._n):
-            self._f.append(interp1d(
-                time, configurations[:, d], kind='cubic'))
+        self._f = CubicSpline(
+            time, configurations, axis=0, extrapolate=False)
 
     def __call__(self, t):
         return self.config_at_time(t)
 
+    def _evaluate(self, t, order):
+        """ returns the derivative of the spline of a given order
+            (n, ) for a single time or (m, n) for an array of times,
+            raises a ValueError for times outside of the spline knots """
+        assert self._f is not None
+        assert np.all(np.asarray(t) >= 0.)
+        assert np.all(np.asarray(t) <= self._dt * (self._T + 1))
+        if np.any(np.asarray(t) > self._f.x[-1]):
+            raise ValueError("time {} is above the interpolation range".format(
+                np.max(t)))
+        return self._f(t, order)
+
     def config_at_time(self, t):
-        assert self._n == len(self._f)
-        assert t >= 0.
-        assert t <= self._dt * (self._T + 1)
-        q = np.zeros((self._n))
-        for d in range(self._n):
-            q[d] = self._f[d](t)
-        return q
+        return self._evaluate(t, 0)
 
     def velocity(self, t):
-        assert t >= 0.
-        assert t <= self._dt * (self._T + 1)
-        if t > (self._dt * (self._T + 1) - self._epsilon):
-            return np.zeros(self._n)
-        q0 = self.config_at_time(t)
-        q1 = self.config_at_time(t + self._epsilon)
-        v = (q1 - q0) / self._epsilon
-        return v
+        return self._evaluate(t, 1)
 
     def acceleration(self, t):
-        assert t >= 0.
-        assert t <= self._dt * (self._T + 1)
-        if t < self._epsilon or t > self._dt * (self._T + 1) - self._epsilon:
-            return np.zeros(self._n)
-        q0 = self.config_at_time(t - self._epsilon)
-        q1 = self.config_at_time(t)
-        q2 = self.config_at_time(t + self._epsilon)
-        return (q2 - 2 * q1 + q0) / (self._epsilon**2)
+        return self._evaluate(t, 2)
+
+
+class TrajectoryBatch:
+    """
+        Implements a batch of B trajectories with the same T and n
+        stored in a single contiguous array of shape (B, T + 2, n),
+        (i.e., the vectors x of the trajectories stacked as rows).
+
+        batch[k] returns a Trajectory whose vector x is a view on
+        the batch, hence writing to its configurations writes to
+        the batch (note that Trajectory.set replaces the vector).
+        """
+
+    def __init__(self, B=0, T=0, n=2, x=None):
+        if x is not None:
+            assert x.ndim == 3
+            self._x = np.ascontiguousarray(x, dtype=float)
+        else:
+            assert T > 0
+            self._x = np.zeros((B, T + 2, n))
+
+    def __len__(self):
+        return self._x.shape[0]
+
+    def __getitem__(self, k):
+        trajectory = Trajectory(self.T(), self.n())
+        trajectory._x = self._x[k].reshape(-1)
+        return trajectory
+
+    def __iter__(self):
+        for k in range(len(self)):
+            yield self[k]
+
+    def B(self):
+        return self._x.shape[0]
+
+    def n(self):
+        return self._x.shape[2]
+
+    def T(self):
+        return self._x.shape[1] - 2
+
+    def x(self):
+        """ array of shape (B, T + 2, n) """
+        return self._x
+
+    def configurations(self):
+        """ configurations 0 to T of all trajectories (B, T + 1, n) """
+        return self._x[:, :self.T() + 1]
+
+    def velocity(self, i, dt):
+        """ velocities (B, n) at index i, see Trajectory.velocity,
+            for an array of indices returns (B, len(i), n) """
+        i = np.asarray(i)
+        return (self._x[:, i] - self._x[:, np.maximum(i - 1, 0)]) / dt
+
+    def acceleration(self, i, dt):
+        """ accelerations (B, n) at index i, see Trajectory.acceleration,
+            for an array of indices returns (B, len(i), n) """
+        i = np.asarray(i)
+        q_i_0 = self._x[:, np.maximum(i - 1, 0)]
+        return (self._x[:, i + 1] - 2 * self._x[:, i] + q_i_0) / (dt**2)
+
+    def length(self):
+        """ lengths in configuration space (B, ) """
+        return np.sum(np.linalg.norm(
+            np.diff(self.configurations(), axis=1), axis=2), axis=1)
+
+
+def trajectory_batch(trajectories):
+    """ Copies a list of trajectories with the same T and n in a batch """
+    assert len(trajectories) > 0
+    T, n = trajectories[0].T(), trajectories[0].n()
+    batch = TrajectoryBatch(len(trajectories), T, n)
+    for k, trajectory in enumerate(trajectories):
+        batch.x()[k] = trajectory.x().reshape(T + 2, n)
+    return batch
 
 
 def linear_interpolation_trajectory(q_init, q_goal, T):
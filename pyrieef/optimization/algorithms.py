@@ -17,7 +17,11 @@
 #
 #                                        Jim Mainprice on Sunday June 13 2018
 
+from . import common_imports
+from motion.trajectory import CachedObjectiveFunction
 from scipy import optimize
+from scipy import sparse
+from scipy.sparse.linalg import splu
 import numpy as np
 import time
 
@@ -27,13 +31,21 @@ def newton_optimize_trajectory(
         trajectory,
         verbose=False,
         maxiter=15):
+    """
+    Optimizes the active segment of the trajectory using Newton-CG,
+    the objective hessian can be dense or scipy.sparse
+    (see TrajectoryObjectiveFunction.set_sparse_hessian).
+    The value, gradient and hessian queried at the same iterate
+    are computed in a single pass (see CachedObjectiveFunction).
+    """
     t_start = time.time()
+    f = CachedObjectiveFunction(objective, order=2)
     res = optimize.minimize(
         x0=trajectory.active_segment(),
         method='Newton-CG',
-        fun=objective.forward,
-        jac=objective.gradient,
-        hess=objective.hessian,
+        fun=f.forward,
+        jac=f.gradient,
+        hess=f.hessian,
         tol=1e-9,
         options={'maxiter': maxiter, 'disp': verbose}
     )
@@ -42,3 +54,140 @@ def newton_optimize_trajectory(
         print(("gradient norm : ", np.linalg.norm(res.jac)))
     trajectory.active_segment()[:] = res.x
     return res
+
+
+def newton_optimize_trajectories(
+        objectives,
+        trajectories,
+        verbose=False,
+        maxiter=15,
+        gtol=1e-6,
+        xtol=1e-5,
+        max_line_search=20):
+    """
+    Optimizes the active segments of B trajectories with independent
+    objectives of the same input dimension d using damped Newton steps.
+
+    At each iteration the Newton system of each problem is solved
+    with a sparse LU factorization (or np.linalg.solve for dense
+    hessians), the gradient step is taken for the problems whose
+    hessian is singular or whose Newton step is not a descent direction.
+    Each problem has its own backtracking line search, when no step
+    decreases the objective the search is continued along the gradient
+    (first trying a step of the length of the Newton step) with
+    3 * max_line_search more halvings.
+    A problem stops when its gradient norm is smaller than gtol, when
+    the sum of the absolute values of its step is smaller than xtol
+    (as in scipy's Newton-CG) or when the gradient step also fails,
+    while the other problems continue.
+
+    Only the line search and the masking of the converged problems are
+    stacked, the objectives are evaluated and the Newton systems are
+    solved problem by problem, so that the per problem Python overhead
+    is the same as for newton_optimize_trajectory.
+
+    Parameters
+    ----------
+        objectives : list of B objectives or one objective shared
+                     by all problems (see TrajectoryObjectiveFunction)
+        trajectories : list of B trajectories, modified in place
+
+    Returns
+    -------
+        gradients (B, d) at the solutions and the number of
+        iterations of each problem
+    """
+    t_start = time.time()
+    nb_problems = len(trajectories)
+    if not isinstance(objectives, (list, tuple)):
+        objectives = [objectives] * nb_problems
+    assert len(objectives) == nb_problems
+    X = np.array([t.active_segment() for t in trajectories], dtype=float)
+    dim = X.shape[1]
+    values = np.zeros(nb_problems)
+    G = np.zeros((nb_problems, dim))
+    iterations = np.zeros(nb_problems, dtype=int)
+    active = np.arange(nb_problems)
+    evaluated = np.zeros(nb_problems, dtype=bool)
+    for i in range(maxiter):
+        H = [None] * nb_problems
+        for k in active:
+            [values[k], J, H[k]] = objectives[k].evaluate_all(X[k], order=2)
+            G[k] = np.asarray(J).reshape(dim)
+        evaluated[active] = True
+        active = active[np.linalg.norm(G[active], axis=1) >= gtol]
+        if not active.size:
+            break
+
+        # Newton step per problem, gradient step if not descending
+        g = G[active]
+        P = np.array([_newton_step(H[k], G[k]) for k in active])
+        slope = np.sum(P * g, axis=1)
+        descent = np.logical_and(np.isfinite(slope), slope < 0.)
+        P[~descent] = -g[~descent]
+        slope[~descent] = -np.sum(g[~descent] ** 2, axis=1)
+
+        # Backtracking line search (Armijo) for each problem,
+        # restarted along the gradient when the Newton direction fails
+        alpha = np.ones(active.size)
+        failed = _line_search(
+            objectives, X, values, active, P, slope, alpha,
+            np.arange(active.size), max_line_search)
+        newton = failed[descent[failed]]
+        alpha[newton] = np.linalg.norm(P[newton], axis=1) / np.linalg.norm(
+            g[newton], axis=1)
+        P[newton] = -g[newton]
+        slope[newton] = -np.sum(g[newton] ** 2, axis=1)
+        failed = _line_search(
+            objectives, X, values, active, P, slope, alpha,
+            failed, 3 * max_line_search)
+        moved = np.ones(active.size, dtype=bool)
+        moved[failed] = False
+        steps = alpha[moved, None] * P[moved]
+        X[active[moved]] += steps
+        evaluated[active[moved]] = False
+        iterations[active[moved]] += 1
+        active = active[moved][np.sum(np.abs(steps), axis=1) > xtol]
+        if verbose:
+            print(("iteration {} : {} problems running".format(
+                i, active.size)))
+        if not active.size:
+            break
+
+    for k in np.flatnonzero(~evaluated):
+        G[k] = np.asarray(
+            objectives[k].evaluate_all(X[k], order=1)[1]).reshape(dim)
+    for k, trajectory in enumerate(trajectories):
+        trajectory.active_segment()[:] = X[k]
+    if verbose:
+        print(("optimization done in {} sec.".format(time.time() - t_start)))
+        print(("max gradient norm : ", np.max(np.linalg.norm(G, axis=1))))
+    return [G, iterations]
+
+
+def _line_search(
+        objectives, X, values, active, P, slope, alpha, searching,
+        max_line_search):
+    """ Backtracking (Armijo) of the steps alpha (modified in place)
+        of the problems searching, returns the ones that did not
+        decrease their objective """
+    for _ in range(max_line_search):
+        if not searching.size:
+            break
+        f = np.array([objectives[active[j]].forward(
+            X[active[j]] + alpha[j] * P[j]) for j in searching])
+        decrease = f <= (values[active[searching]] +
+                         1e-4 * alpha[searching] * slope[searching])
+        searching = searching[~decrease]
+        alpha[searching] *= .5
+    return searching
+
+
+def _newton_step(H, g):
+    """ Returns -H^-1 g, nan when the hessian H is singular """
+    try:
+        if sparse.issparse(H):
+            return -splu(H.tocsc()).solve(g)
+        return -np.linalg.solve(H, g)
+    except (RuntimeError, np.linalg.LinAlgError):
+        return np.full(g.shape, np.nan)
@@ -20,6 +20,8 @@
 from . import common_imports
 from geometry.differentiable_geometry import *
 import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import spsolve
 
 
 class UnconstraintedOptimizer:
@@ -64,14 +66,16 @@ class NaturalGradientDescent(UnconstraintedOptimizer):
 
     def delta(self, x):
         g = self._f.gradient(x)
-        g_t = np.matrix(g).T
-        delta = self.A_inv * g_t / np.linalg.norm(g)
-        return self._eta * np.array(delta).reshape(x.size)
+        delta = np.dot(self.A_inv, g) / np.linalg.norm(g)
+        return self._eta * delta
 
 
 class NetwtonAlgorithm(UnconstraintedOptimizer):
+    """ Newton steps, the hessian can be dense or scipy.sparse """
 
     def one_step(self, x):
-        H = self.f_.hessian(x)
-        g = self.f_.gradient(x)
+        H = self._f.hessian(x)
+        g = self._f.gradient(x)
+        if sparse.issparse(H):
+            return x - self._eta * spsolve(H.tocsc(), g)
         return x - self._eta * np.linalg.solve(H, g)
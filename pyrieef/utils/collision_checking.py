@@ -22,24 +22,76 @@ from motion.trajectory import *
 import numpy as np
 
 
+def _waypoints(path):
+    """ configurations 0 to T of a trajectory or array of waypoints """
+    if isinstance(path, Trajectory):
+        path = path.list_configurations()
+    path = np.asarray(path, dtype=float).reshape(-1, 2)
+    return path if path.shape[0] > 1 else np.vstack([path, path])
+
+
+def first_collisions(workspace, paths, tolerance=None):
+    """
+    Returns the parameters s in [0, 1] (normalized arc length, see
+    ContinuousTrajectory) of the first collision along each path,
+    np.inf when the path is collision free.
+
+    The paths (trajectories or arrays of waypoints) are piecewise linear
+    and are all walked at once by conservative advancement (sphere
+    tracing): a point at distance d of the obstacles is the center of a
+    free ball, hence the next point is taken at an arc length d further
+    along the path. The steps are at least tolerance (by default the
+    workspace diagonal / 1000), thinner obstacles can be missed.
+    """
+    if tolerance is None:
+        tolerance = workspace.box.diag() / 1000.
+    paths = [_waypoints(path) for path in paths]
+    nb_paths = len(paths)
+    waypoints = np.vstack(paths)
+    last = np.cumsum([path.shape[0] for path in paths]) - 1
+
+    # The arc lengths of all paths are stacked in a single increasing
+    # array, each path starting one unit after the end of the previous
+    arc_lengths = [np.r_[0., np.cumsum(np.linalg.norm(
+        np.diff(path, axis=0), axis=1))] for path in paths]
+    lengths = np.array([arc[-1] for arc in arc_lengths])
+    offsets = np.r_[0., np.cumsum(lengths + 1.)[:-1]]
+    arc = np.concatenate(
+        [a + o for a, o in zip(arc_lengths, offsets)])
+
+    s = np.zeros(nb_paths)
+    collisions = np.full(nb_paths, np.inf)
+    active = np.arange(nb_paths)
+    while active.size:
+        query = offsets[active] + s[active]
+        k = np.searchsorted(arc, query, side='right') - 1
+        k = np.minimum(k, last[active] - 1)
+        t = (query - arc[k]) / np.maximum(arc[k + 1] - arc[k], 1e-300)
+        t = np.clip(t, 0., 1.)[:, None]
+        points = (1. - t) * waypoints[k] + t * waypoints[k + 1]
+        d = workspace.min_dist_batch(points)[0]
+        collide = d < 0.
+        collisions[active[collide]] = s[active[collide]] / np.maximum(
+            lengths[active[collide]], 1e-300)
+        done = np.logical_or(collide, s[active] >= lengths[active])
+        s[active] = np.minimum(
+            s[active] + np.maximum(d, tolerance), lengths[active])
+        active = active[np.logical_not(done)]
+    return collisions
+
+
+def first_collision(workspace, path, tolerance=None):
+    """ Returns the parameter s in [0, 1] of the first collision
+        along the path or None, see first_collisions """
+    s = first_collisions(workspace, [path], tolerance)[0]
+    return None if np.isinf(s) else s
+
+
 def collision_check_trajectory(workspace, trajectory):
     """ Check trajectory for collision """
-    delta = workspace.box.diag() / 100.
-    interpolated_traj = trajectory.continuous_trajectory()
-    length = interpolated_traj.length()
-    for s in np.linspace(0, 1, num=int(length / delta) + 1):
-        if workspace.in_collision(
-                interpolated_traj.configuration_at_parameter(s)):
-            return True
-    return False
+    return first_collision(workspace, trajectory) is not None
 
 
 def collision_check_linear_interpolation(workspace, p_init, p_goal):
     """ Check interior interpolation for collision """
-    delta = workspace.box.diag() / 100.
-    length = np.linalg.norm(p_init - p_goal)
-    for s in np.linspace(0, 1, num=int(length / delta) + 1):
-        p_interp = (1. - s) * p_init + s * p_goal
-        if workspace.in_collision(p_interp):
-            return True
-    return False
+    return first_collision(workspace, [p_init, p_goal]) is not None
@@ -377,6 +377,8 @@ def test_activations():
 
 def test_trigonometric_functions():
 
+    np.random.seed(0)
+
     f = Arccos()
 
     print("Check Tanh (J implementation) : ")
@@ -398,6 +400,104 @@ def test_radial_basis_function():
     assert abs(f(x) - np.exp(-.5 * phi)) < 1e-5
 
 
+def test_batch():
+    dim = 3
+    a = AffineMap(np.random.rand(dim, dim), np.random.rand(dim))
+    f = AffineMap(np.random.rand(1, dim), np.random.rand(1))
+    sq_norm = SquaredNorm(np.random.rand(dim))
+    rbf = RadialBasisFunction(np.random.rand(2), np.eye(2))
+
+    print("Check batch (loop fallback) : ")
+    assert check_batch_against_single(rbf)
+
+    print("Check batch (maps) : ")
+    assert check_batch_against_single(a, hessian=False)
+    assert check_batch_against_single(IdentityMap(dim), hessian=False)
+    assert check_batch_against_single(
+        RangeSubspaceMap(dim, [0, 2]), hessian=False)
+    assert check_batch_against_single(SoftMax(dim, 3), hessian=False)
+    assert check_batch_against_single(Sigmoid(dim), hessian=False)
+    assert check_batch_against_single(Tanh(dim), hessian=False)
+    assert check_batch_against_single(
+        Compose(RangeSubspaceMap(dim, [1]), a), hessian=False)
+
+    print("Check batch (functions) : ")
+    assert check_batch_against_single(f)
+    assert check_batch_against_single(sq_norm)
+    assert check_batch_against_single(Scale(sq_norm, .3))
+    assert check_batch_against_single(SumOfTerms([f, sq_norm]))
+    assert check_batch_against_single(RangeSubspaceMap(dim, [1]))
+    assert check_batch_against_single(LogSumExp(dim, 10))
+    assert check_batch_against_single(Sigmoid(1))
+    assert check_batch_against_single(Arccos())
+    assert check_batch_against_single(Compose(sq_norm, a), hessian=False)
+    assert check_batch_against_single(Compose(Sigmoid(1), f))
+
+    # Composition with a non-linear function g
+    f_g = Compose(SquaredNorm(np.zeros(1)), Norm(np.random.rand(2)))
+    assert check_hessian_against_finite_difference(f_g)
+    assert check_batch_against_single(f_g)
+    assert check_batch_against_single(Pullback(sq_norm, a))
+    assert check_batch_against_single(
+        ProductFunction(SquaredNorm(np.random.rand(dim)), sq_norm))
+
+    tanh = Tanh(1)
+    q = np.random.rand(1, 1)
+    assert check_is_close(
+        tanh.hessian_batch(q)[0],
+        finite_difference_hessian(tanh, q[0]), 1e-4)
+
+
+def test_matrix_output():
+    dim = 3
+    f = Pullback(SquaredNorm(np.zeros(dim)),
+                 AffineMap(np.random.rand(dim, dim), np.random.rand(dim)))
+    q = np.random.rand(dim)
+    assert type(f.jacobian(q)) == np.ndarray
+    assert type(f.hessian(q)) == np.ndarray
+    assert f.jacobian(q).shape == (1, dim)
+
+    f_matrix = MatrixOutputMap(f)
+    assert type(f_matrix.jacobian(q)) == np.matrix
+    assert type(f_matrix.hessian(q)) == np.matrix
+    assert check_is_close(f_matrix.jacobian(q), f.jacobian(q))
+    assert check_is_close(f_matrix.hessian(q), f.hessian(q))
+    assert check_is_close(f_matrix.gradient(q), f.gradient(q))
+
+
+def test_evaluate_all():
+    np.random.seed(0)
+    dim = 3
+    a = AffineMap(np.random.rand(dim, dim), np.random.rand(dim))
+    f = AffineMap(np.random.rand(1, dim), np.random.rand(1))
+    sq_norm = SquaredNorm(np.random.rand(dim))
+    f_g = Compose(SquaredNorm(np.zeros(1)), Norm(np.random.rand(dim)))
+    functions = [
+        f, sq_norm, f_g,
+        Scale(sq_norm, .3),
+        SumOfTerms([f, sq_norm]),
+        Compose(Sigmoid(1), f),
+        Pullback(sq_norm, a),
+        ProductFunction(f_g, sq_norm),
+        RadialBasisFunction(np.random.rand(2), np.eye(2))]
+    for phi in functions:
+        Q = np.random.rand(5, phi.input_dimension())
+        for q in Q:
+            [x, J, H] = phi.evaluate_all(q)
+            assert_allclose(x, phi.forward(q))
+            assert_allclose(J, phi.jacobian(q))
+            assert_allclose(H, phi.hessian(q))
+            [x, J, H] = phi.evaluate_all(q, order=1)
+            assert_allclose(J, phi.jacobian(q))
+            assert H is None
+        [X, J, H] = phi.evaluate_all_batch(Q)
+        assert_allclose(X, phi.forward_batch(Q))
+        assert_allclose(J, phi.jacobian_batch(Q))
+        assert_allclose(H, phi.hessian_batch(Q))
+        [X, J, H] = phi.evaluate_all_batch(Q, order=0)
+        assert J is None and H is None
+
+
 if __name__ == "__main__":
     # test_finite_difference()
     # test_zero()
@@ -415,4 +515,7 @@ if __name__ == "__main__":
     # test_activations()
     # test_normalize()
     # test_trigonometric_functions()
+    # test_batch()
+    # test_matrix_output()
+    # test_evaluate_all()
     test_radial_basis_function()
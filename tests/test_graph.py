@@ -62,6 +62,208 @@ def test_graph_edge_cost():
                 assert c2 == costmap[n2_i, n2_j]
 
 
+def test_update_graph():
+    np.random.seed(0)
+    costmap = np.random.random((7, 5))
+    for average_cost in [True, False]:
+        converter = CostmapToSparseGraph(costmap, average_cost)
+        converter.integral_cost = not average_cost
+        graph = converter.convert()
+        nb_edges = graph.nnz
+        assert nb_edges == 2 * (6 * 5 + 7 * 4 + 2 * 6 * 4)  # 8-connected
+        costmap = np.random.random((7, 5))
+        converter.update_graph(costmap)
+        assert converter._graph.nnz == nb_edges
+        for (n1_i, n1_j), c_ij in np.ndenumerate(costmap):
+            for (n2_i, n2_j) in converter.neiborghs(n1_i, n1_j):
+                if converter.is_in_costmap(n2_i, n2_j):
+                    assert_allclose(
+                        converter.graph_edge_cost(n1_i, n1_j, n2_i, n2_j),
+                        converter.edge_cost(n1_i, n1_j, n2_i, n2_j))
+
+
+def test_zero_cost_edges():
+    np.random.seed(0)
+    costmap = np.random.random((7, 5)) + .1
+    converter = CostmapToSparseGraph(costmap)
+    nb_edges = converter.convert().nnz
+
+    # edges of zero cost are not edges, the row splits the grid
+    costmap = costmap.copy()
+    costmap[3, :] = 0.
+    converter.update_graph(costmap)
+    assert converter._graph.nnz < nb_edges
+    assert converter._graph.nnz == np.count_nonzero(
+        converter._graph.toarray())
+    try:
+        converter.dijkstra_on_map(costmap, 0, 0, 6, 4)
+        assert False
+    except ValueError:
+        pass
+
+    costmap[3, :] = 1.
+    converter.update_graph(costmap)
+    assert converter._graph.nnz == nb_edges
+    path = converter.dijkstra_on_map(costmap, 0, 0, 6, 4)
+    assert set([path[0], path[-1]]) == set([(0, 0), (6, 4)])
+
+
+def path_cost(converter, path):
+    return sum(converter.edge_cost(p[0], p[1], q[0], q[1])
+               for p, q in zip(path[:-1], path[1:]))
+
+
+def test_astar():
+    np.random.seed(0)
+    for average_cost, integral_cost in [
+            (False, False), (True, False), (False, True)]:
+        for k in range(20):
+            # with an offset the heuristic is used to prune the search
+            costmap = np.random.random((15, 12)) + (k % 2)
+            converter = CostmapToSparseGraph(costmap, average_cost)
+            converter.integral_cost = integral_cost
+            converter.convert()
+            s = np.random.randint(0, 12, 2)
+            t = np.random.randint(0, 12, 2)
+            path = converter.astar_on_map(costmap, s[0], s[1], t[0], t[1])
+            assert path.shape[1] == 2
+            assert_allclose(path[0], s)
+            assert_allclose(path[-1], t)
+            assert np.abs(np.diff(path, axis=0)).max() <= 1
+            path_dijkstra = converter.dijkstra_on_map(
+                costmap, s[0], s[1], t[0], t[1])
+            assert_allclose(path_cost(converter, path),
+                            path_cost(converter, path_dijkstra[::-1]))
+            assert_allclose(path_cost(converter, path), path_cost(
+                converter, astar(costmap, s, t, average_cost, integral_cost)))
+
+
+def test_astar_window():
+    np.random.seed(0)
+    costmap = np.random.random((60, 50)) + 1.
+    converter = CostmapToSparseGraph(costmap, False)
+    converter.convert()
+    queries = [(5, 5, 50, 40), (10, 20, 14, 22), (10, 20, 14, 22)]
+    for k in range(3):
+        if k == 1:
+            # the wall forces a detour out of the first window
+            costmap[12, :45] = np.inf
+        if k == 2:
+            costmap[12, :45] = 1e3
+        for s_i, s_j, t_i, t_j in queries:
+            path = converter.astar_on_map(costmap, s_i, s_j, t_i, t_j)
+            path_dijkstra = converter.dijkstra_on_map(
+                costmap, s_i, s_j, t_i, t_j)
+            assert_allclose(path_cost(converter, path),
+                            path_cost(converter, path_dijkstra[::-1]))
+    costmap[12, :] = np.inf
+    try:
+        converter.astar_on_map(costmap, 10, 20, 14, 22)
+        assert False
+    except ValueError:
+        pass
+
+
+def test_cached_shortest_paths():
+    np.random.seed(0)
+    costmaps = [np.random.random((12, 10)) for _ in range(2)]
+    for average_cost in [True, False]:
+        converter = CostmapToSparseGraph(costmaps[0], average_cost)
+        converter.convert()
+        queries = CachedShortestPaths(
+            CostmapToSparseGraph(costmaps[0], average_cost), max_size=3)
+        queries.compute(costmaps[0], [(1, 2), (3, 4), (1, 2)])
+        assert queries.misses == 2
+        assert queries.hits == 0
+        for k in range(20):
+            costmap = costmaps[k % 2]
+            s = (1, 2) if k < 10 else np.random.randint(0, 10, 2)
+            t = np.random.randint(0, 10, 2)
+            if tuple(s) == tuple(t):
+                continue
+            path = queries.dijkstra_on_map(costmap, s[0], s[1], t[0], t[1])
+            assert path == converter.dijkstra_on_map(
+                costmap, s[0], s[1], t[0], t[1])
+            assert_allclose(
+                queries.distance_on_map(costmap, s[0], s[1], t[0], t[1]),
+                path_cost(converter, path[::-1]))
+        assert queries.hits >= 8
+        assert len(queries._cache) == 3
+
+
+def test_lifelong_planning_astar():
+    np.random.seed(0)
+    s, t = (2, 3), (25, 20)
+    for average_cost, integral_cost in [
+            (False, False), (True, False), (False, True)]:
+        costmap = np.random.random((30, 24)) + .1
+        converter = CostmapToSparseGraph(costmap, average_cost)
+        converter.integral_cost = integral_cost
+        planner = LifelongPlanningAStar(
+            costmap, s, t, average_cost, integral_cost)
+        path = planner.shortest_path()
+        nb_expansions = planner.nb_expansions
+        for k in range(4):
+            costmap = costmap.copy()
+            i, j = path[len(path) // 2 + k]
+            costmap[i - 1:i + 2, j - 1:j + 2] = 5. if k % 2 == 0 else .01
+            converter.costmap = costmap
+            planner.update_costmap(costmap)
+            nb_expansions_before = planner.nb_expansions
+            path = planner.shortest_path()
+            assert_allclose(path[0], s)
+            assert_allclose(path[-1], t)
+            assert_allclose(planner.distance(), path_cost(converter, path))
+            assert_allclose(planner.distance(), path_cost(
+                converter, astar(costmap, s, t, average_cost, integral_cost)))
+            assert planner.nb_expansions - nb_expansions_before < (
+                nb_expansions)
+
+
+def test_zero_cost_edges_searches():
+    np.random.seed(0)
+    costmap = np.random.random((7, 5)) + .5
+    costmap[3, :] = 0.
+    for average_cost, integral_cost in [
+            (False, False), (True, False), (False, True)]:
+        converter = CostmapToSparseGraph(costmap, average_cost)
+        converter.integral_cost = integral_cost
+        converter.convert()
+        for s, t in [((0, 0), (6, 4)), ((0, 0), (2, 4)), ((4, 1), (6, 3))]:
+            searches = [
+                lambda: converter.dijkstra_on_map(
+                    costmap, s[0], s[1], t[0], t[1])[::-1],
+                lambda: converter.astar_on_map(
+                    costmap, s[0], s[1], t[0], t[1]),
+                lambda: astar(costmap, s, t, average_cost, integral_cost),
+                lambda: LifelongPlanningAStar(
+                    costmap, s, t, average_cost, integral_cost
+                ).shortest_path()]
+            costs = []
+            for search in searches:
+                try:
+                    costs.append(path_cost(converter, search()))
+                except ValueError:
+                    costs.append(np.inf)
+            # without average the zero cost row can not be entered
+            reachable = average_cost or (s[0] < 3) == (t[0] < 3)
+            assert np.isfinite(costs[0]) == reachable
+            assert_allclose(costs, costs[0])
+
+
+def test_predecessors_path():
+    predecessors = np.array([-9999, 0, 1, 1, -9999])
+    assert_allclose(predecessors_path(predecessors, 0, 3), [3, 1, 0])
+    assert_allclose(predecessors_path(predecessors, 0, 0), [0])
+    try:
+        predecessors_path(predecessors, 0, 4)
+        assert False
+    except ValueError:
+        pass
+    converter = CostmapToSparseGraph(np.ones((3, 2)))
+    assert converter.costmap_path([0, 4, 5]) == [(0, 0), (1, 1), (2, 1)]
+
+
 def test_costmap_to_graph_symmetry():
     costmap = np.random.random((5, 5))
     converter = CostmapToSparseGraph(costmap, average_cost=True)
@@ -140,6 +342,14 @@ if __name__ == "__main__":
     test_symetrize()
     test_coordinates()
     test_graph_edge_cost()
+    test_update_graph()
+    test_zero_cost_edges()
+    test_astar()
+    test_astar_window()
+    test_cached_shortest_paths()
+    test_lifelong_planning_astar()
+    test_zero_cost_edges_searches()
+    test_predecessors_path()
     test_costmap_to_graph_symmetry()
     test_workspace_to_graph()
     test_workspace_to_shortest_path()
@@ -39,6 +39,25 @@ def test_pixelmap_random():
     print("Random pixel map OK !")
 
 
+def test_pixelmap_arrays():
+    np.random.seed(0)
+    pixel_map = PixelMap(.2)
+    points = np.random.uniform(-.5, .5, (100, 2))
+    grid_points = pixel_map.world_to_grid(points)
+    matrix_points = pixel_map.world_to_matrix(points)
+    world_points = pixel_map.grid_to_world(grid_points)
+    assert grid_points.shape == (100, 2)
+    assert world_points.shape == (100, 2)
+    for k, p in enumerate(points):
+        p_g = pixel_map.world_to_grid(p)
+        assert_allclose(grid_points[k], p_g)
+        assert_allclose(matrix_points[k], pixel_map.world_to_matrix(p))
+        assert_allclose(matrix_points[k], [p_g[1], p_g[0]])
+        assert_allclose(world_points[k], pixel_map.grid_to_world(p_g))
+    assert_allclose(pixel_map.grid_to_world(list(grid_points[0])),
+                    world_points[0])
+
+
 def test_pixelmap_meshgrid():
     resolution = .2
     pixel_map = PixelMap(resolution)
@@ -121,5 +140,6 @@ def test_regressed_grid():
 
 if __name__ == "__main__":
     test_pixelmap_random()
+    test_pixelmap_arrays()
     test_pixelmap_meshgrid()
     test_regressed_grid()
@@ -21,8 +21,11 @@ import __init__
 from learning.random_environment import *
 from learning.random_paths import *
 import learning.demonstrations as demos
+from optimization.algorithms import newton_optimize_trajectory
 from graph.shortest_path import *
 from geometry.workspace import sample_circle_workspaces
+from learning.parallel_generation import *
+from learning.dataset import *
 import time
 import sys
 
@@ -68,7 +71,116 @@ def test_demonstrations():
     print("time : {} sec.".format(time.time() - t_start))
 
 
+def test_demonstrations_batch():
+    np.random.seed(0)
+    nb_points = 24
+    converter = CostmapToSparseGraph(np.ones((nb_points, nb_points)), False)
+    converter.convert()
+    workspaces = [sample_circle_workspaces(nb_circles=3) for _ in range(3)]
+    t_start = time.time()
+    trajectories = demos.compute_demonstrations_batch(
+        workspaces, converter, nb_points)
+    assert len(trajectories) == len(workspaces)
+    for trajectory in trajectories:
+        assert trajectory.n() == 2
+        assert trajectory.T() == demos.TRAJ_LENGTH - 1
+    print("time : {} sec.".format(time.time() - t_start))
+
+
+def test_smooth_sdf_demonstration():
+    # the straight path is on the ridge of the distance to the circles
+    workspace = Workspace()
+    workspace.obstacles.append(Circle(np.array([-.2, .3]), .2))
+    workspace.obstacles.append(Circle(np.array([.3, -.2]), .2))
+    path = np.linspace([-.4, -.4], [.4, .4], demos.TRAJ_LENGTH)
+    optimizer, trajectory = demos.motion_optimization_problem(
+        path, workspace, sdf_temperature=.01)
+    assert isinstance(optimizer.signed_distance_field,
+                      SmoothSignedDistanceWorkspaceMap)
+    res = newton_optimize_trajectory(
+        optimizer.objective, trajectory, maxiter=100)
+    assert res.nit < 100
+    assert np.linalg.norm(res.jac) < 1e-4
+    sdf = SignedDistanceWorkspaceMap(workspace)
+    for i in range(trajectory.T() + 1):
+        assert sdf(trajectory.configuration(i)) > 0.
+
+
+def test_grids():
+    np.random.seed(0)
+    nb_points = 28
+    epsilon = .1
+    workspace = sample_circle_workspaces(nb_circles=5)
+    pixel_map = workspace.pixel_map(nb_points)
+    grid_to_world = np.zeros((nb_points, nb_points, 2))
+    for i in range(nb_points):
+        for j in range(nb_points):
+            grid_to_world[i, j] = pixel_map.grid_to_world(np.array([i, j]))
+    [occupancy, sdf, costs] = grids(workspace, grid_to_world, epsilon)
+    for i in range(nb_points):
+        for j in range(nb_points):
+            min_dist = workspace.min_dist(grid_to_world[i, j])[0]
+            assert occupancy[i, j] == (min_dist <= 0.)
+            assert np.isclose(sdf[i, j], min_dist)
+            assert np.isclose(
+                costs[i, j], chomp_obstacle_cost(min_dist, epsilon))
+
+
+def _random_item(context, k):
+    return context * k + np.random.random()
+
+
+def _save_item_shard(values, filename):
+    write_dictionary_to_file({"values": np.array(values)}, filename)
+
+
+def _load_item_shard(filename):
+    return list(load_dictionary_from_file(filename)["values"])
+
+
+def test_generate_shards():
+    nb_items = 7
+    shard_size = 3
+    basename = "test_generate_shards.hdf5"
+    filenames = shard_filenames(basename, nb_items, shard_size)
+    assert len(filenames) == 3
+    assert filenames[1] == "test_generate_shards_shard_00001.hdf5"
+    paths = [learning_data_dir() + os.sep + f for f in filenames]
+    values = []
+    try:
+        for nb_processes in [1, 2]:
+            for path in paths:
+                remove_file_if_exists(path)
+            generate_shards(
+                _random_item, nb_items, _save_item_shard, basename,
+                shard_size, nb_processes, seed=1, context=10.)
+            values.append(load_shards(
+                _load_item_shard, basename, nb_items, shard_size))
+        assert len(values[0]) == nb_items
+        assert_allclose(values[0], values[1])
+        for k, v in enumerate(values[0]):
+            assert 10. * k <= v <= 10. * k + 1.
+
+        # existing shards are not computed again
+        remove_file_if_exists(paths[1])
+        _save_item_shard([-1.] * shard_size, filenames[0])
+        generate_shards(
+            _random_item, nb_items, _save_item_shard, basename,
+            shard_size, 1, seed=1, context=10.)
+        resumed = load_shards(
+            _load_item_shard, basename, nb_items, shard_size)
+        assert_allclose(resumed[:shard_size], -1.)
+        assert_allclose(resumed[shard_size:], values[0][shard_size:])
+    finally:
+        for path in paths:
+            remove_file_if_exists(path)
+
+
 if __name__ == "__main__":
     test_random_enviroments()
     test_standard_dataset()
     test_demonstrations()
+    test_demonstrations_batch()
+    test_smooth_sdf_demonstration()
+    test_grids()
+    test_generate_shards()
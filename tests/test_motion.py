@@ -22,6 +22,8 @@ from motion.trajectory import *
 from motion.cost_terms import *
 from motion.objective import *
 from motion.control import *
+from optimization.algorithms import *
+from utils.collision_checking import *
 import time
 from numpy.linalg import norm
 from numpy.testing import assert_allclose
@@ -129,6 +131,54 @@ def test_cliques():
         assert_allclose(c, trajectory.clique(i + 1))
 
 
+def test_cliques_batch():
+    np.random.seed(0)
+    problem = MotionOptimization2DCostMap(T=15)
+    network = problem.function_network
+    assert len(network._batch_functions) > 0
+
+    # Same network where each function is registered clique per clique
+    network_loop = CliquesFunctionNetwork(
+        network.input_dimension(), problem.config_space_dim)
+    for t in range(network.nb_cliques()):
+        for f in network._functions[t] + network._batch_functions:
+            network_loop.register_function_for_clique(t, f)
+
+    x = linear_interpolation_trajectory(
+        problem.q_init, problem.q_goal, problem.T).x()
+    x += .01 * np.random.rand(x.size)
+    cliques = network.all_cliques_array(x)
+    for t, x_t in enumerate(network.all_cliques(x)):
+        assert_allclose(cliques[t], x_t)
+    assert_allclose(network.forward(x), network_loop.forward(x))
+    assert_allclose(network.jacobian(x), network_loop.jacobian(x))
+    assert_allclose(network.hessian(x), network_loop.hessian(x))
+    assert_allclose(network.hessian_sparse(x).toarray(),
+                    network_loop.hessian(x))
+
+    H = np.ones((x.size, x.size))
+    network.hessian(x, out=H)
+    assert_allclose(H, network_loop.hessian(x))
+
+    for n in [network, network_loop]:
+        [v, J, H] = n.evaluate_all(x)
+        assert_allclose(v, network_loop.forward(x))
+        assert_allclose(J, network_loop.jacobian(x))
+        assert_allclose(H, network_loop.hessian(x))
+
+    objective = TrajectoryObjectiveFunction(
+        problem.q_init, network, sparse_hessian=False)
+    x_active = x[problem.config_space_dim:]
+    [v, J, H] = objective.evaluate_all(x_active)
+    assert_allclose(v, objective.forward(x_active))
+    assert_allclose(J, objective.jacobian(x_active))
+    assert_allclose(H, objective.hessian(x_active))
+    objective.set_sparse_hessian(True)
+    [v, J, H] = objective.evaluate_all(x_active)
+    assert_allclose(H.toarray(), objective.hessian(x_active).toarray())
+    assert objective.evaluate_all(x_active, order=1)[2] is None
+
+
 def test_trajectory():
     T = 10
     n = 2
@@ -176,6 +226,38 @@ def test_trajectory():
     assert np.isclose(traj.x(), traj_continuous.x()).all()
 
 
+def test_trajectory_batch():
+    np.random.seed(0)
+    dt = .1
+    trajectories = [Trajectory(T=10, n=2) for _ in range(5)]
+    for trajectory in trajectories:
+        trajectory.x()[:] = np.random.random(trajectory.x().size)
+    batch = trajectory_batch(trajectories)
+    assert len(batch) == 5
+    assert batch.x().shape == (5, 12, 2)
+    indices = np.arange(11)
+    velocities = batch.velocity(indices, dt)
+    accelerations = batch.acceleration(indices, dt)
+    lengths = batch.length()
+    for k, trajectory in enumerate(trajectories):
+        assert_allclose(batch[k].x(), trajectory.x())
+        c_trajectory = trajectory.continuous_trajectory()
+        assert_allclose(lengths[k], c_trajectory.length())
+        for i in indices:
+            assert_allclose(velocities[k, i], trajectory.velocity(i, dt))
+            assert_allclose(batch.velocity(i, dt)[k],
+                            trajectory.velocity(i, dt))
+            assert_allclose(accelerations[k, i],
+                            trajectory.acceleration(i, dt))
+
+    # views on the batch
+    batch[2].configuration(3)[:] = 10.
+    assert_allclose(batch.x()[2, 3], [10., 10.])
+    for trajectory in batch:
+        trajectory.configuration(0)[:] = 0.
+    assert_allclose(batch.x()[:, 0], 0.)
+
+
 def test_continuous_trajectory():
     q_init = np.random.random(2)
     q_goal = np.random.random(2)
@@ -200,6 +282,48 @@ def test_continuous_trajectory():
         assert_allclose(q_1, q_2)
 
 
+def test_arc_lengths():
+    np.random.seed(0)
+    trajectory = ContinuousTrajectory(12, 2)
+    trajectory.set(np.random.random(trajectory.x().size))
+    configurations = np.array(trajectory.list_configurations())
+    lengths = norm(np.diff(configurations, axis=0), axis=1)
+    assert_allclose(trajectory.length(), np.sum(lengths))
+    s = np.random.random(50)
+    q = trajectory.configurations_at_parameters(s)
+    for s_i, q_i in zip(s, q):
+        assert_allclose(trajectory.configuration_at_parameter(s_i), q_i)
+        d_param = s_i * np.sum(lengths)
+        i = np.argmax(np.cumsum(lengths) >= d_param)
+        alpha = (d_param - np.sum(lengths[:i])) / lengths[i]
+        assert_allclose(q_i, (1. - alpha) * configurations[i] +
+                        alpha * configurations[i + 1])
+    assert_allclose(trajectory.configuration_at_parameter(0.),
+                    configurations[0])
+    assert_allclose(trajectory.configuration_at_parameter(1.),
+                    configurations[-1])
+    assert trajectory.configuration_at_parameter(1.1) is None
+
+    # the arc lengths are rebuilt when the configurations are modified
+    trajectory.configuration(3)[:] += 1.
+    configurations = np.array(trajectory.list_configurations())
+    assert_allclose(trajectory.length(), np.sum(
+        norm(np.diff(configurations, axis=0), axis=1)))
+    trajectory.x()[:] = 0.
+    assert trajectory.length() == 0.
+    trajectory.active_segment()[:] = 1.
+    assert_allclose(trajectory.length(), np.sqrt(2))
+    trajectory.set(np.zeros(trajectory.x().size))
+    assert trajectory.length() == 0.
+
+    # writes through a view kept before the query
+    q = trajectory.configuration(12)
+    assert trajectory.length() == 0.
+    q[:] = [3., 4.]
+    assert_allclose(trajectory.length(), 5.)
+    assert_allclose(trajectory.configuration_at_parameter(.5), [1.5, 2.])
+
+
 def test_constant_acceleration_trajectory():
     dt = 0.1
     T = 7
@@ -258,6 +382,37 @@ def test_spline_trajectory():
         assert_allclose(v1, v2, atol=1e-3)
 
 
+def test_spline_trajectory_batch():
+    dt = 0.1
+    T = 20
+    trajectory = CubicSplineTrajectory(T, 2, dt)
+    time = trajectory.time_indices()
+    for i, t in enumerate(time):
+        trajectory.configuration(i)[0] = np.sin(t)
+        trajectory.configuration(i)[1] = np.cos(t)
+    trajectory.initialize_spline()
+    t = np.linspace(.1, T * dt - .1, 200)
+    q = trajectory.config_at_time(t)
+    v = trajectory.velocity(t)
+    a = trajectory.acceleration(t)
+    assert q.shape == (200, 2)
+    for k in range(t.size):
+        assert_allclose(q[k], trajectory.config_at_time(t[k]))
+        assert_allclose(v[k], trajectory.velocity(t[k]))
+        assert_allclose(a[k], trajectory.acceleration(t[k]))
+    assert_allclose(q, np.array([np.sin(t), np.cos(t)]).T, atol=1e-5)
+    assert_allclose(v, np.array([np.cos(t), -np.sin(t)]).T, atol=1e-3)
+    assert_allclose(a, -q, atol=1e-2)
+
+    # No extrapolation after the last configuration
+    for t in [T * dt + 1e-6, (T + 1) * dt, np.array([.1, (T + .5) * dt])]:
+        try:
+            trajectory.config_at_time(t)
+            assert False
+        except ValueError:
+            pass
+
+
 def test_center_of_clique():
     config_dim = 2
     nb_way_points = 10
@@ -461,7 +616,7 @@ def test_motion_optimimization_hessian():
         problem.objective, False, tolerance=1e-2)
 
     xi = np.random.rand(problem.objective.input_dimension())
-    H = problem.objective.hessian(xi)
+    H = problem.objective.hessian(xi).toarray()
     H_diff = finite_difference_hessian(problem.objective, xi)
     H_delta = H - H_diff
     print((" - H_delta dist = ", np.linalg.norm(H_delta, ord='fro')))
@@ -588,7 +743,7 @@ def test_smoothness_metric():
 
     active_size = dim * (trajectory.T() - 1)
 
-    H1 = objective.objective.hessian(trajectory.active_segment())
+    H1 = objective.objective.hessian(trajectory.active_segment()).toarray()
     H1 = H1[:active_size, :active_size]
     np.set_printoptions(suppress=True, linewidth=200, precision=0,
                         formatter={'float_kind': '{:8.0f}'.format})
@@ -604,6 +759,108 @@ def test_smoothness_metric():
     assert_allclose(H1, H2)
 
 
+def test_sparse_hessian():
+    np.random.seed(0)
+    problem = MotionOptimization2DCostMap(T=20)
+    objective = problem.objective
+    network = problem.function_network
+    for _ in range(5):
+        x = np.random.rand(network.input_dimension())
+        H = network.hessian(x)
+        H_sparse = network.hessian_sparse(x)
+        assert H_sparse.shape == H.shape
+        assert_allclose(H_sparse.toarray(), H)
+        xi = np.random.rand(objective.input_dimension())
+        objective.set_sparse_hessian(False)
+        H = objective.hessian(xi)
+        objective.set_sparse_hessian(True)
+        assert_allclose(objective.hessian(xi).toarray(), H)
+
+    # Check that newton converges to the same solution
+    trajectory_1 = linear_interpolation_trajectory(
+        problem.q_init, problem.q_goal, problem.T)
+    trajectory_2 = linear_interpolation_trajectory(
+        problem.q_init, problem.q_goal, problem.T)
+    objective.set_sparse_hessian(False)
+    newton_optimize_trajectory(objective, trajectory_1)
+    objective.set_sparse_hessian(True)
+    newton_optimize_trajectory(objective, trajectory_2)
+    assert_allclose(trajectory_1.x(), trajectory_2.x(), atol=1e-6)
+
+
+def test_newton_optimize_trajectories():
+    np.random.seed(0)
+    objectives = []
+    trajectories_1 = []
+    trajectories_2 = []
+    for k in range(5):
+        workspace = Workspace()
+        workspace.obstacles.append(
+            Circle(np.random.uniform(-.6, -.3, 2), .1))
+        problem = MotionOptimization2DCostMap(
+            T=20, q_goal=np.random.uniform(.2, .5, 2),
+            signed_distance_field=SignedDistanceWorkspaceMap(workspace))
+        objectives.append(problem.objective)
+        trajectories_1.append(linear_interpolation_trajectory(
+            problem.q_init, problem.q_goal, problem.T))
+        trajectories_2.append(linear_interpolation_trajectory(
+            problem.q_init, problem.q_goal, problem.T))
+    objectives[2].set_sparse_hessian(False)
+    [gradients, iterations] = newton_optimize_trajectories(
+        objectives, trajectories_1, maxiter=100)
+    assert gradients.shape == (5, objectives[0].input_dimension())
+    assert np.all(np.linalg.norm(gradients, axis=1) < 1e-6)
+    assert np.all(iterations > 0)
+    for objective, trajectory_1, trajectory_2 in zip(
+            objectives, trajectories_1, trajectories_2):
+        newton_optimize_trajectory(objective, trajectory_2, maxiter=100)
+        assert_allclose(trajectory_1.x(), trajectory_2.x(), atol=1e-6)
+
+    # A singular hessian only affects its own problem
+    trajectories = [Trajectory(T=5, n=2) for _ in range(2)]
+    dim = trajectories[0].active_segment().size
+    A = np.random.rand(dim, dim)
+    objectives = [
+        QuadricFunction(np.eye(dim) + np.dot(A, A.T), np.ones(dim), 0.),
+        QuadricFunction(np.diag(np.arange(dim) % 2), np.zeros(dim), 0.)]
+    for trajectory in trajectories:
+        trajectory.active_segment()[:] = np.random.rand(dim)
+    [gradients, iterations] = newton_optimize_trajectories(
+        objectives, trajectories, maxiter=100)
+    assert iterations[0] == 1
+    assert np.all(np.linalg.norm(gradients, axis=1) < 1e-6)
+
+    # The gradient step is tried when the Newton step fails
+    class WrongHessian(QuadricFunction):
+
+        def jacobian(self, x):
+            return QuadricFunction.hessian(self, x).dot(x)[None, :]
+
+        def hessian(self, x):
+            return 1e-9 * np.eye(self.input_dimension())
+
+    trajectory = Trajectory(T=5, n=2)
+    trajectory.active_segment()[:] = np.random.rand(dim)
+    [gradients, iterations] = newton_optimize_trajectories(
+        [WrongHessian(np.eye(dim), np.zeros(dim), 0.)], [trajectory],
+        maxiter=200)
+    assert iterations[0] > 1
+    assert np.linalg.norm(gradients) < 1e-4
+
+
+def test_sdf_temperature():
+    problem = MotionOptimization2DCostMap()
+    assert isinstance(problem.signed_distance_field,
+                      SignedDistanceWorkspaceMap)
+    sdf = problem.signed_distance_field
+    problem = MotionOptimization2DCostMap(sdf_temperature=.01)
+    assert isinstance(problem.signed_distance_field,
+                      SmoothSignedDistanceWorkspaceMap)
+    for q in np.random.uniform(-.5, .5, (10, 2)):
+        assert problem.signed_distance_field(q) <= sdf(q)
+        assert problem.signed_distance_field(q) >= sdf(q) - .01 * np.log(2)
+
+
 def test_trajectory_objective():
     q_init = np.zeros(2)
     problem = MotionOptimization2DCostMap(T=10, n=q_init.size)
@@ -636,14 +893,83 @@ def test_trajectory_following():
         assert u_t.size == q_t.size
 
 
+def test_cached_objective():
+    np.random.seed(0)
+    problem = MotionOptimization2DCostMap(T=10)
+    objective = problem.objective
+    f = CachedObjectiveFunction(objective, max_size=2)
+    x = np.random.rand(objective.input_dimension())
+    assert_allclose(f.forward(x), objective.forward(x))
+    assert_allclose(f.gradient(x), objective.gradient(x))
+    assert_allclose(f.hessian(x).toarray(), objective.hessian(x).toarray())
+    assert f.hits == 1 and f.misses == 2
+    assert_allclose(f.gradient(x), objective.gradient(x))
+    assert_allclose(f.forward(x), objective.forward(x))
+    assert f.hits == 3 and f.misses == 2
+
+    # Least recently used entry is dropped
+    x_1 = np.random.rand(x.size)
+    x_2 = np.random.rand(x.size)
+    f.forward(x_1)
+    f.forward(x_2)
+    f.forward(x)
+    assert f.misses == 5
+
+    f.clear()
+    f_newton = CachedObjectiveFunction(objective, order=2)
+    for x in [x_1, x_2]:
+        f_newton.forward(x)
+        f_newton.gradient(x)
+        f_newton.hessian(x)
+    assert f_newton.hits == 4 and f_newton.misses == 2
+
+
+def test_first_collisions():
+    np.random.seed(0)
+    workspace = Workspace()
+    workspace.obstacles.append(Circle(np.array([.1, .1]), .1))
+    workspace.obstacles.append(Box(np.array([-.2, .2]), np.array([.1, .2])))
+    trajectories = [
+        linear_interpolation_trajectory(
+            np.random.uniform(-.5, .5, 2),
+            np.random.uniform(-.5, .5, 2), T=5) for _ in range(20)]
+    tolerance = 1e-4
+    collisions = first_collisions(workspace, trajectories, tolerance)
+    for trajectory, s_c in zip(trajectories, collisions):
+        c_trajectory = trajectory.continuous_trajectory()
+        s = np.linspace(0, 1, 1000)
+        in_collision = [workspace.in_collision(
+            c_trajectory.configuration_at_parameter(s_i)) for s_i in s]
+        assert collision_check_trajectory(workspace, trajectory) == (
+            not np.isinf(s_c))
+        if not any(in_collision):
+            continue
+        # the collision is found at most a step of tolerance
+        # after the first sample in collision
+        length = c_trajectory.length()
+        s_first = s[np.argmax(in_collision)]
+        assert s_c <= s_first + tolerance / length
+        assert s_c >= s_first - 1. / 999.
+        assert workspace.in_collision(
+            c_trajectory.configuration_at_parameter(s_c))
+    assert collision_check_linear_interpolation(
+        workspace, np.array([0., 0.]), np.array([.2, .2]))
+    assert first_collision(
+        workspace, [np.array([.3, 0.]), np.array([.3, .4])]) is None
+
+
 if __name__ == "__main__":
     # test_finite_differences()
     # test_integration()
     # test_cliques()
+    # test_cliques_batch()
     # test_trajectory()
+    # test_trajectory_batch()
     # test_continuous_trajectory()
+    # test_arc_lengths()
     # test_constant_acceleration_trajectory()
     # test_spline_trajectory()
+    # test_spline_trajectory_batch()
     # test_squared_norm_derivatives()
     # test_log_barrier()
     # test_bound_barrier()
@@ -657,5 +983,10 @@ if __name__ == "__main__":
     # test_linear_interpolation_optimal_potential()
     # test_smoothness_metric()
     # test_trajectory_objective()
+    # test_sparse_hessian()
+    # test_newton_optimize_trajectories()
+    # test_sdf_temperature()
     # test_optimize()
     # test_trajectory_following()
+    # test_cached_objective()
+    # test_first_collisions()
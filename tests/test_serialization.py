@@ -104,8 +104,26 @@ def test_paths_io():
         assert_allclose(paths[i][k], saved_paths[i][k])
 
 
+def test_trajectories_io():
+    trajectories = [Trajectory(T=20, n=2) for _ in range(10)]
+    for trajectory in trajectories:
+        trajectory.x()[:] = np.random.random(trajectory.x().size)
+    filename = "tmp_trajectories_{}.hdf5".format(
+        str(time.time()).split('.')[0])
+    save_trajectories_to_file(trajectories, filename)
+    batch = load_trajectories_from_file(filename, as_batch=True)
+    saved_trajectories = load_trajectories_from_file(filename)
+    os.remove(learning_data_dir() + os.sep + filename)
+    assert batch.x().shape == (10, 22, 2)
+    for k, trajectory in enumerate(trajectories):
+        assert saved_trajectories[k].T() == trajectory.T()
+        assert_allclose(saved_trajectories[k].x(), trajectory.x())
+        assert_allclose(batch[k].x(), trajectory.x())
+
+
 if __name__ == "__main__":
     test_hdf5_io()
     test_hdf5_dictionary_io()
     test_pickle_io()
     test_paths_io()
+    test_trajectories_io()
@@ -153,11 +153,30 @@ def test_axis_aligned_box():
         sdf2 = box2.dist_from_border(p)
         assert np.fabs(sdf1 - sdf2) < 1.e-06
 
-    # TODO make code parallelizable
-    # grid = EnvBox().stacked_meshgrid()
-    # sdf1 = box1.dist_from_border(grid)
-    # sdf2 = box2.dist_from_border(grid)
-    # assert_allclose(sdf1, sdf2)
+    grid = EnvBox().stacked_meshgrid()
+    sdf1 = box1.dist_from_border(grid)
+    sdf2 = box2.dist_from_border(grid)
+    assert_allclose(sdf1, sdf2)
+
+
+def test_axis_aligned_box_batch():
+    np.random.seed(0)
+    box = AxisAlignedBox(origin=np.array([.1, -.2]), dim=np.array([.3, .5]))
+    points = np.random.uniform(-1., 1., (2, 10, 10))
+    assert_allclose(box.dist_from_border(points),
+                    Box.dist_from_border(box, points))
+    gradients = box.dist_gradient(points)
+    hessians = box.dist_hessian(points)
+    assert gradients.shape == (2, 10, 10)
+    assert hessians.shape == (2, 2, 10, 10)
+    f = SignedDistance2DMap(box)
+    for i, j in product(range(10), range(10)):
+        p = points[:, i, j]
+        assert_allclose(gradients[:, i, j], finite_difference_jacobian(
+            f, p)[0], atol=1e-6)
+        assert_allclose(hessians[:, :, i, j], finite_difference_hessian(
+            f, p), atol=1e-4)
+        assert box.is_inside(p) == (box.dist_from_border(p) < 0)
 
 
 def test_ellipse():
@@ -248,6 +267,42 @@ def test_hexagon_jac():
         assert check_is_close(H, H_diff, 1e-4)
 
 
+def test_polygon_batch():
+    np.random.seed(0)
+    # L shaped polygon, non convex
+    verticies = [np.array([0., 0.]), np.array([.6, 0.]),
+                 np.array([.6, .2]), np.array([.2, .2]),
+                 np.array([.2, .6]), np.array([0., .6])]
+    l_shape = Polygon(verticies=verticies, convex=False)
+    assert l_shape.is_inside(np.array([.1, .1]))
+    assert l_shape.is_inside(np.array([.1, .5]))
+    assert not l_shape.is_inside(np.array([.4, .4]))
+    assert not Polygon(verticies=verticies[::-1], convex=False).is_inside(
+        np.array([.4, .4]))
+    for polygon in [hexagon(scale=.5), l_shape]:
+        points = np.random.uniform(-1., 1., (2, 10, 10))
+        sdf = polygon.dist_from_border(points)
+        gradients = polygon.dist_gradient(points)
+        hessians = polygon.dist_hessian(points)
+        assert gradients.shape == (2, 10, 10)
+        assert hessians.shape == (2, 2, 10, 10)
+        f = SignedDistance2DMap(polygon)
+        for i, j in product(range(10), range(10)):
+            p = points[:, i, j]
+            d = min(e.dist_from_border(p) for e in polygon._edges)
+            assert_allclose(abs(sdf[i, j]), d)
+            assert (sdf[i, j] < 0) == polygon.is_inside(p)
+            assert_allclose(gradients[:, i, j], finite_difference_jacobian(
+                f, p)[0], atol=1e-6)
+            assert_allclose(hessians[:, :, i, j], finite_difference_hessian(
+                f, p), atol=1e-4)
+    workspace = Workspace()
+    workspace.obstacles.append(l_shape)
+    points = np.random.uniform(-1., 1., (100, 2))
+    assert_allclose(workspace.min_dist_batch(points)[0],
+                    l_shape.dist_from_border(points.T))
+
+
 def test_sdf_derivatives():
     verbose = False
     circles = []
@@ -261,6 +316,61 @@ def test_sdf_derivatives():
             signed_distance_field)
 
 
+def test_shape_derivatives():
+    np.random.seed(0)
+    shapes = [
+        Ellipse(.6, .3),
+        Segment(np.array([.5, .4]), .3, .5),
+        Box(np.array([.4, .6]), np.array([.4, .3])),
+        hexagon(.3, [.5, .5]),
+        Complex(shapes=[
+            Circle(np.array([.2, .2]), .1),
+            Box(np.array([.7, .6]), np.array([.2, .3]))])]
+    for shape in shapes:
+        signed_distance_field = SignedDistance2DMap(shape)
+        for i in range(10):
+            assert check_jacobian_against_finite_difference(
+                signed_distance_field, False)
+            assert check_hessian_against_finite_difference(
+                signed_distance_field, False)
+    missing = shapes_without_derivatives()
+    for shape in [Circle, Ellipse, Segment, Box, AxisAlignedBox,
+                  Polygon, Complex]:
+        assert shape not in missing
+
+    class Point(Shape):
+
+        def dist_from_border(self, x):
+            return np.linalg.norm(x)
+
+    assert shapes_without_derivatives()[Point] == [
+        "dist_gradient", "dist_hessian"]
+    try:
+        Point().dist_hessian(np.ones(2))
+        assert False
+    except NotImplementedError:
+        pass
+
+    # the signed distance maps have their own derivatives
+    maps = finite_difference_maps()
+    for f in [SignedDistance2DMap, SignedDistanceWorkspaceMap,
+              SmoothSignedDistanceWorkspaceMap, GridSignedDistanceMap]:
+        assert f not in maps
+
+    class Radius(DifferentiableMap):
+
+        def output_dimension(self):
+            return 1
+
+        def input_dimension(self):
+            return 2
+
+        def forward(self, x):
+            return np.linalg.norm(x)
+
+    assert finite_difference_maps()[Radius] == ["jacobian", "hessian"]
+
+
 def test_sdf_workspace():
     workspace = sample_circle_workspaces(nb_circles=10)
     signed_distance_field = SignedDistanceWorkspaceMap(workspace)
@@ -268,6 +378,154 @@ def test_sdf_workspace():
     assert check_hessian_against_finite_difference(signed_distance_field)
 
 
+def test_smooth_sdf():
+    np.random.seed(0)
+    workspace = sample_circle_workspaces(nb_circles=10)
+    workspace.obstacles.append(Box(np.array([.2, .3]), np.array([.3, .2])))
+    workspace.obstacles.append(hexagon(.2, [-.3, -.4]))
+    workspace.obstacles.append(Ellipse(.2, .1))
+    sdf = SmoothSignedDistanceWorkspaceMap(workspace, temperature=.05)
+    for i in range(5):
+        assert check_jacobian_against_finite_difference(sdf, False)
+        assert check_hessian_against_finite_difference(sdf, False)
+    assert check_batch_against_single(sdf)
+
+    # lower bound of the min distance
+    points = np.random.uniform(-1., 1., (100, 2))
+    d = workspace.min_dist_batch(points)[0]
+    d_smooth = sdf.forward_batch(points)[:, 0]
+    bound = sdf.temperature() * np.log(len(workspace.obstacles))
+    assert np.all(d_smooth <= d + 1e-12)
+    assert np.all(d_smooth >= d - bound - 1e-12)
+
+    # well defined gradient between two circles
+    workspace = Workspace()
+    workspace.obstacles.append(Circle(np.array([-.5, 0.]), .1))
+    workspace.obstacles.append(Circle(np.array([.5, 0.]), .1))
+    sdf = SmoothSignedDistanceWorkspaceMap(workspace, temperature=.05)
+    assert_allclose(sdf.gradient(np.array([0., .2])),
+                    [0., .2 / np.sqrt(.29)], atol=1e-10)
+    X, Y = workspace.box.stacked_meshgrid(10)
+    assert sdf(np.array([X, Y])).shape == (10, 10)
+
+
+def test_min_dist_batch():
+    np.random.seed(0)
+    workspace = sample_circle_workspaces(nb_circles=10)
+    workspace.obstacles.append(Box(np.array([.2, .3]), np.array([.3, .2])))
+    workspace.obstacles.append(hexagon(.2, [-.3, -.4]))
+    workspace.obstacles.append(Segment(np.array([.5, -.5]), .5, .4))
+    points = np.random.uniform(-1., 1., (100, 2))
+    [d_m, i_m, g_m] = workspace.min_dist_gradient_batch(points)
+    distances = np.array([o.dist_from_border(points.T[:, :, None])[:, 0]
+                          for o in workspace.obstacles])
+    assert_allclose(d_m, np.min(distances, axis=0))
+    assert_allclose(i_m, np.argmin(distances, axis=0))
+    for p, i, g in zip(points, i_m, g_m):
+        assert_allclose(g, Shape.dist_gradient(workspace.obstacles[i], p))
+    [d, i] = workspace.min_dist(points[0])
+    assert_allclose(d, d_m[0])
+    assert i == i_m[0]
+    assert check_batch_against_single(
+        SignedDistanceWorkspaceMap(workspace), hessian=False)
+
+
+def test_obstacle_arrays_update():
+    np.random.seed(0)
+    workspace = sample_circle_workspaces(nb_circles=3)
+    workspace.obstacles.append(Box(np.array([.2, .3]), np.array([.3, .2])))
+    points = np.random.uniform(-1., 1., (100, 2))
+
+    def check_min_dist():
+        [d_m, i_m] = workspace.min_dist_batch(points)
+        distances = np.array([o.dist_from_border(points.T[:, :, None])[:, 0]
+                              for o in workspace.obstacles])
+        assert_allclose(d_m, np.min(distances, axis=0))
+        assert_allclose(i_m, np.argmin(distances, axis=0))
+
+    # Obstacles modified in place between the queries
+    check_min_dist()
+    workspace.obstacles[0].origin = np.array([.4, -.4])
+    check_min_dist()
+    workspace.obstacles[1].radius = .3
+    check_min_dist()
+    workspace.obstacles[3].dim = np.array([.1, .5])
+    check_min_dist()
+
+
+def test_spatial_index():
+    np.random.seed(0)
+    workspace = sample_circle_workspaces(nb_circles=50, radius_parameter=.05)
+    for i in range(10):
+        workspace.add_segment(workspace.box.sample_uniform(), .2)
+    points = np.random.uniform(-1., 1., (100, 2))
+    [d_brute, i_brute] = workspace.min_dist_batch(points)
+    collisions = [workspace.in_collision(p) for p in points]
+    workspace.build_spatial_index(cell_size=.2)
+    for k, p in enumerate(points):
+        [d, i] = workspace.min_dist(p)
+        assert_allclose(d, d_brute[k])
+        assert i == i_brute[k]
+        assert workspace.in_collision(p) == collisions[k]
+
+    # incremental insert and remove
+    workspace.add_circle(np.array([.5, .5]), .1)
+    assert workspace.min_dist(np.array([.5, .5]))[1] == 60
+    workspace.remove_obstacle(workspace.obstacles[60])
+    workspace.remove_obstacle(workspace.obstacles[0])
+    [d_brute, i_brute] = workspace.min_dist_batch(points)
+    for k, p in enumerate(points):
+        [d, i] = workspace.min_dist(p)
+        assert_allclose(d, d_brute[k])
+        assert i == i_brute[k]
+
+    # obstacles moved after the index is built
+    workspace.obstacles[0].origin = points[0]
+    workspace.obstacles[1].radius = .3
+    [d_brute, i_brute] = workspace.min_dist_batch(points)
+    assert i_brute[0] == 0
+    assert workspace.in_collision(points[0])
+    for k, p in enumerate(points):
+        [d, i] = workspace.min_dist(p)
+        assert_allclose(d, d_brute[k])
+        assert i == i_brute[k]
+        assert workspace.in_collision(p) == (d_brute[k] < 0.)
+
+
+def test_grid_sdf():
+    np.random.seed(0)
+    workspace = sample_circle_workspaces(nb_circles=5)
+    sdf_exact = SignedDistanceWorkspaceMap(workspace)
+    sdf_grid = GridSignedDistanceMap(workspace, nb_points=50, padding=1.)
+    assert check_jacobian_against_finite_difference(sdf_grid)
+    assert check_hessian_against_finite_difference(sdf_grid)
+    assert check_batch_against_single(sdf_grid)
+    sdf_grid = GridSignedDistanceMap(workspace, nb_points=50, tolerance=1e-3)
+    assert sdf_grid.nb_points() > 50
+    for p in np.random.uniform(-.5, .5, (20, 2)):
+        assert abs(sdf_grid(p) - sdf_exact(p)) < 1e-2
+
+
+def test_sdf_evaluate_all():
+    np.random.seed(0)
+    workspace = sample_circle_workspaces(nb_circles=5)
+    for f in [SignedDistanceWorkspaceMap(workspace),
+              GridSignedDistanceMap(workspace, nb_points=50),
+              GridSignedDistanceMap(workspace, nb_points=50, exact=False)]:
+        for p in np.random.uniform(-.5, .5, (20, 2)):
+            [d, J, H] = f.evaluate_all(p)
+            assert_allclose(d, f.forward(p))
+            assert_allclose(J, f.jacobian(p))
+            assert_allclose(H, f.hessian(p))
+
+    # the occupancy is only evaluated in the obstacles bounding boxes
+    sdf_grid = GridSignedDistanceMap(workspace, nb_points=50, exact=False)
+    x, y = sdf_grid._grid
+    X, Y = np.meshgrid(x, y, indexing='ij')
+    d = workspace.min_dist_batch(np.stack([X.ravel(), Y.ravel()], 1))[0]
+    assert_allclose(sdf_grid._occupancy(x, y), d.reshape(X.shape) < 0)
+
+
 def test_meshgrid():
     nb_points = 10
     workspace = Workspace()
@@ -324,6 +582,26 @@ def test_workspace_to_occupancy_map():
         assert_allclose(occ[i, j], v)
 
 
+def test_rasterize_sdf():
+    np.random.seed(0)
+    nb_points = 40
+    workspace = sample_circle_workspaces(nb_circles=5)
+    workspace.obstacles.append(Box(np.array([.2, .3]), np.array([.3, .2])))
+    workspace.obstacles.append(hexagon(.2, [-.3, -.4]))
+    workspace.obstacles.append(Segment(np.array([.5, -.5]), .5, .4))
+    workspace.obstacles.append(Ellipse(.2, .1))
+    grid = workspace.box.stacked_meshgrid(nb_points)
+    sdf_exact = SignedDistanceWorkspaceMap(workspace)(grid).T
+    margin = .1
+    sdf = rasterize_sdf(nb_points, workspace, margin)
+    close = sdf_exact <= margin
+    assert_allclose(sdf[close], sdf_exact[close])
+    assert np.all(sdf >= sdf_exact - 1e-12)
+    assert np.max(sdf - sdf_exact) < .1
+    assert_allclose(occupancy_map(nb_points, workspace),
+                    (sdf_exact < 0).astype(float))
+
+
 if __name__ == "__main__":
 
     # test_circle()
@@ -332,12 +610,22 @@ if __name__ == "__main__":
     # test_line_side()
     # test_polygon()
     # test_axis_aligned_box()
+    # test_axis_aligned_box_batch()
     # test_inside_box()
     # test_ellipse()
     test_polygon()
     # test_hexagon()
+    # test_polygon_batch()
     # test_sdf_derivatives()
+    # test_shape_derivatives()
     # test_sdf_workspace()
+    # test_smooth_sdf()
+    # test_min_dist_batch()
+    # test_obstacle_arrays_update()
+    # test_spatial_index()
+    # test_grid_sdf()
+    # test_sdf_evaluate_all()
     # test_meshgrid()
     # test_sdf_grid()
     # test_workspace_to_occupancy_map()
+    # test_rasterize_sdf()